@@ -2,14 +2,18 @@
 # -*- Coding: utf-8 -*-
 import json
 import os
-import socket
 import sys
 import threading
 import datetime
 T_DELTA = datetime.timedelta(hours=9)
 
+import numpy as np
+
 from src.conf import environment_settings
 from src.lib import code, command, save_result, settings_json
+from src.lib.connection import ConnectionPool, MessageServer
+from src.lib.dataset_store import DatasetStore
+from src.lib.entropy_coder import EntropyCoder
 from src.lib.logger import create_logger
 from src.lib.model.request import (
     CommonRequest, 
@@ -48,11 +52,14 @@ class CloudServer:
         self.thread_receive = None
         self.thread_send = None
         self.retry_count = 0
+        # IoTデバイス・エッジサーバーとの接続は張りっぱなしにして使い回す
+        self.connection_pool = ConnectionPool(self.logger)
+        self.server = None
 
     # UIから受け取ったパラメータを展開
     def parameter_expansion(self, overall_param, edge_param, iot_param, img_path):
         
-        overall_keys = ('model', 'layer', 'mode', 'split_size', 'PCA_rate', 'Qubit_type', 'reload', 'use_udp')
+        overall_keys = ('model', 'layer', 'mode', 'split_size', 'PCA_rate', 'Qubit_type', 'entropy_coder', 'reload', 'use_udp')
         edge_keys = ('reach_rate', 'waiting_time', 'edge_network_delay_time', 'edge_network_dispersion_time', 'edge_network_loss_rate', 'edge_network_band_limitation')
         iot_keys = ('network_delay_time', 'network_dispersion_time', 'network_loss_rate', 'network_band_limitation')
         self.param.overall = dict(zip(overall_keys, overall_param))
@@ -63,8 +70,6 @@ class CloudServer:
     def send_setting_to_iot_device(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT))
             to_json_data = {
                 "model": self.param.overall['model'],
                 "layer": self.param.overall['layer'],
@@ -72,6 +77,7 @@ class CloudServer:
                 "split_size": self.param.overall['split_size'],
                 "PCA_rate": self.param.overall['PCA_rate'],
                 "Qubit_type": self.param.overall['Qubit_type'],
+                "entropy_coder": self.param.overall['entropy_coder'],
                 "reload": self.param.overall['reload'],
                 "use_udp": self.param.overall['use_udp'],
                 "network_delay_time": self.param.iot['network_delay_time'],
@@ -87,11 +93,9 @@ class CloudServer:
                 setting
             )
             self.logger.debug(f"CloudServerSettingRequest : {request.get_json()}")
-            sock.send(request.get_json().encode("ascii"))
-
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-            self.logger.debug(f"Received data : {rcv_data}")
-            response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+            response = self.connection_pool.request(
+                environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT, request
+            )
             self.logger.debug(f"Response JSON : {response.get_json()}")
             self.logger.debug(f"Response payload : {response.payload}")
             assert response.payload == ""
@@ -107,8 +111,6 @@ class CloudServer:
     def send_setting_to_edge_server(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT))
             to_json_data = {
                 "model": self.param.overall['model'],
                 "layer": self.param.overall['layer'],
@@ -116,6 +118,7 @@ class CloudServer:
                 "split_size": self.param.overall['split_size'],
                 "PCA_rate": self.param.overall['PCA_rate'],
                 "Qubit_type": self.param.overall['Qubit_type'],
+                "entropy_coder": self.param.overall['entropy_coder'],
                 "reload": self.param.overall['reload'],
                 "use_udp": self.param.overall['use_udp'],
                 "reach_rate": self.param.edge['reach_rate'],
@@ -132,11 +135,9 @@ class CloudServer:
                 setting
             )
             self.logger.debug(f"CloudServerSettingRequest : {request.get_json()}")
-            sock.send(request.get_json().encode("ascii"))
-
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-            self.logger.debug(f"Received data : {rcv_data}")
-            response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+            response = self.connection_pool.request(
+                environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT, request
+            )
             self.logger.debug(f"Response JSON : {response.get_json()}")
             self.logger.debug(f"Response payload : {response.payload}")
             assert response.payload == ""
@@ -169,8 +170,17 @@ class CloudServer:
         file_name = request.filename
 
         idx = self.param.img_path.find('/images')
+        # 画像をまとめたX_{split}.npyの場合は、同じディレクトリのy_{split}.npyの(ファイル名の番号)番目がラベル
+        labels_path = DatasetStore.labels_path_for(os.path.join(self.iot_device_path, self.param.img_path))
+        if self.dir_mode and labels_path is not None:
+            if os.path.isfile(labels_path):
+                label = str(np.load(labels_path, mmap_mode='r')[int(file_name)])
+                self.record_inference_result(file_name, request.result, label)
+            else:
+                self.logger.info('no label exists')
+                self.gui.put_value_output('no label exists')
         # ディレクトリモードで、画像が正しくimagesというディレクトリに入っていた場合
-        if self.dir_mode and idx >= 0: 
+        elif self.dir_mode and idx >= 0: 
             base_path = self.param.img_path[:idx] # imagesとlabelsが入っているべきディレクトリのパス
             label_dir = os.path.join(self.iot_device_path, base_path, 'labels') # ラベルのテキストファイルが入っているディレクトリのパス
             label_path = os.path.join(label_dir, file_name + '.txt') # ラベルのパス
@@ -180,13 +190,7 @@ class CloudServer:
 
                 with open(label_path, 'r') as f:
                     label = f.read().strip()
-                
-                # 辞書形式で、画像ファイル名をkey、{推論結果, ラベル}をvalueとして保持しておく
-                message = 'Inference result is correct!!' if request.result == label else 'Inference result is incorrect...'
-                self.result_summary[file_name] = {'inference result': request.result, 'label': label, 'message': message}
-                self.logger.info(self.result_summary[file_name])
-                self.inference_results.append({ 'result': request.result, 'label': label })
-                self.gui.put_value_output("Inference result = {}, Label = {}, {}, accuracy rate = {}\n".format(request.result, label, message, self.get_accuracy_rate()))
+                self.record_inference_result(file_name, request.result, label)
             else:
                 self.logger.info('no label exists')
                 self.gui.put_value_output('no label exists')
@@ -200,58 +204,63 @@ class CloudServer:
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return res
 
+    def record_inference_result(self, file_name, result, label):
+        # 辞書形式で、画像ファイル名をkey、{推論結果, ラベル}をvalueとして保持しておく
+        message = 'Inference result is correct!!' if result == label else 'Inference result is incorrect...'
+        self.result_summary[file_name] = {'inference result': result, 'label': label, 'message': message}
+        self.logger.info(self.result_summary[file_name])
+        self.inference_results.append({ 'result': result, 'label': label })
+        self.gui.put_value_output("Inference result = {}, Label = {}, {}, accuracy rate = {}\n".format(result, label, message, self.get_accuracy_rate()))
+
     def command_not_found(self, request):
         # raise Exception("command not found")
         self.logger.error('command not found' + str(request))
 
     def wait_receive(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        is_wait = True
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
-            s.listen(5)
-            while is_wait:
-                conn, addr = s.accept()
-                data = conn.recv(environment_settings.BUFFER_SIZE)
-                self.logger.debug(f"data-> {data}, addr-> {addr}")
-                converted_req = CommonRequest.convert_from_json(data)
-                self.logger.debug(converted_req.get_json())
-
-                # 終了コマンドは個別で処理する
-                if converted_req.command == command.CLOUD_END:
-                    res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
-                    conn.sendall(res.get_json().encode())
-                    conn.close()
-                    if self.thread_send is not None:
-                        self.thread_send.join()
-                    is_wait = False
-                    s.close()
-                    break
-
-                if converted_req.command in self.command_list:
-                    if converted_req.command == command.EDGE_SEND_INFERENCE_RESULT:
-                        converted_req = (
-                            EdgeServerInferenceResultRequest.convert_from_json(data)
-                        )
-                    elif converted_req.command == command.IOT_SEND_PROCESS_TIME:
-                        converted_req = (
-                            ProcessTimeRequest.convert_from_json(data)
-                        )
-                    elif converted_req.command == command.EDGE_SEND_PROCESS_TIME:
-                        converted_req = (
-                            ProcessTimeRequest.convert_from_json(data)
-                        )
-
-                    res = self.command_list[converted_req.command](converted_req)
-                    conn.sendall(res.get_json().encode())
-                else:
-                    self.command_not_found(converted_req)
-                conn.close()
-
-                is_wait = not self.gui.is_disable_ui()
+        self.server = MessageServer(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, self.handle_request, self.logger
+        )
+        self.server.serve_forever()
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
+    def handle_request(self, data):
+        """受信したリクエストを処理し、レスポンスのバイト列を返す"""
+        self.logger.debug(f"data-> {data}")
+        converted_req = CommonRequest.convert_from_json(data)
+        self.logger.debug(converted_req.get_json())
+
+        # 終了コマンドは個別で処理する
+        if converted_req.command == command.CLOUD_END:
+            res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
+            if self.thread_send is not None:
+                self.thread_send.join()
+            self.server.stop()
+            return res.get_json().encode()
+
+        res = None
+        if converted_req.command in self.command_list:
+            if converted_req.command == command.EDGE_SEND_INFERENCE_RESULT:
+                converted_req = (
+                    EdgeServerInferenceResultRequest.convert_from_json(data)
+                )
+            elif converted_req.command == command.IOT_SEND_PROCESS_TIME:
+                converted_req = (
+                    ProcessTimeRequest.convert_from_json(data)
+                )
+            elif converted_req.command == command.EDGE_SEND_PROCESS_TIME:
+                converted_req = (
+                    ProcessTimeRequest.convert_from_json(data)
+                )
+
+            res = self.command_list[converted_req.command](converted_req).get_json().encode()
+        else:
+            self.command_not_found(converted_req)
+
+        if self.gui.is_disable_ui():
+            self.server.stop()
+        return res
+
     # パラメータ設定用UIを表示し、エッジサーバ、IoTデバイスに送信
     def send_setting(self):
         while True:
@@ -284,8 +293,8 @@ class CloudServer:
 
             self.iot_device_path = '../iot_device' # cloud_serverディレクトリから見たiot_deviceのパス
             img_abs_path = os.path.join(self.iot_device_path, self.param.img_path)
-            # ディレクトリモード
-            if os.path.isdir(img_abs_path):
+            # ディレクトリモード(画像をまとめた.npyも同様に扱う)
+            if os.path.isdir(img_abs_path) or img_abs_path.endswith('.npy'):
                 self.logger.info('DIRECTORY MODE')
                 self.dir_mode = True
                 self.result_summary = {}
@@ -314,6 +323,7 @@ class CloudServer:
             self.settings.overall['split_size'],
             self.settings.overall['PCA_rate'],
             self.settings.overall['Qubit_type'],
+            self.settings.overall.get('entropy_coder', EntropyCoder.ENTROPY_NONE),
             self.settings.overall['reload'],
             self.settings.overall['use_udp']
         )
@@ -378,32 +388,17 @@ class CloudServer:
     def send_end_command(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT))
-            request = CommonRequest(command.IOT_END)
-            sock.send(request.get_json().encode("ascii"))
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        except Exception as e:
-            self.logger.exception(e)
-
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT))
-            request = CommonRequest(command.EDGE_END)
-            sock.send(request.get_json().encode("ascii"))
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        except Exception as e:
-            self.logger.exception(e)
-
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
-            request = CommonRequest(command.CLOUD_END)
-            sock.send(request.get_json().encode("ascii"))
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        except Exception as e:
-            self.logger.exception(e)
+        for hostname, port, end_command in [
+            (environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT, command.IOT_END),
+            (environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT, command.EDGE_END),
+            (environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, command.CLOUD_END),
+        ]:
+            try:
+                request = CommonRequest(end_command)
+                self.connection_pool.request(hostname, port, request)
+            except Exception as e:
+                self.logger.exception(e)
+        self.connection_pool.close()
 
         self.logger.info(f"===== end {sys._getframe().f_code.co_name} =====")
 
@@ -20,17 +20,116 @@ IOT_PORT = 22000
 IOT_NETWORK_DEVICE = 'eth0'
 
 BUFFER_SIZE = 2 ** 13
+# TCPで受信する1メッセージの上限サイズ(長さ付きメッセージのため、BUFFER_SIZEを超えても分割して受信できる)
+MAX_MESSAGE_SIZE = 2 ** 26
+# 張りっぱなしのTCP接続で、接続とレスポンスを待つ最大時間(秒)
+# 接続や送信に失敗した場合はMAX_RETRY_COUNT回まで送り直し、送信後にレスポンスが届かない場合は送り直さずにエラーにする
+# (初回のモデル読み込みなどで時間がかかる場合があるので長めにしている)
+CONNECTION_CONNECT_TIMEOUT_SECONDS = 5.0
+CONNECTION_RESPONSE_TIMEOUT_SECONDS = 30.0
+# UDPで受信するデータグラムの最大サイズ
+UDP_BUFFER_SIZE = 2 ** 16
 
-IOT_SPLITTED_NUMPY_LENGTH = 2 ** 9  # ./determine_IOT_SPLITTED_NUMPY_LENGTH.py を参考に
+# 1パケットに含める中間層出力の要素数 (result_summaryでエッジサーバーに通知する)
+# TCPでは長さ付きメッセージで送るため受信バッファの大きさに縛られない
+# UDPでは1データグラムに収まる大きさ(float16の場合は32000程度まで)にする
+IOT_SPLITTED_NUMPY_LENGTH = 2 ** 9  # ./src/lib/benchmark_framing.py で送信速度を確認できる
 IOT_RANDOM_SEED_SHUFFLE = 42
 IOT_LOSS_RATE = 0
 IOT_RANDOM_SEED_TRANSMISSION_PROBABILITY = 52
 
 IOT_VISUALIZE_TARGET_PATH = "./data/visualize_target"
+# MNISTの画像とラベルを.npyで保存するディレクトリ
+IOT_MNIST_DATA_PATH = "./data/mnist"
+# MNISTの各分割の先頭から、画像ファイルとしても保存する枚数
+IOT_MNIST_SAMPLE_IMAGE_COUNT = 100
 
 USE_UDP = True
 
+# ディレクトリモードで、画像の読み込み・CNNの前半での推論・圧縮とパケット分割・送信をパイプラインで並行して行うか
+# Falseの場合は従来どおり1枚ずつ順に処理する(既定では使わない)
+IOT_USE_PIPELINE = False
+# パイプラインのステージ間のキューに溜める推論対象の最大数
+IOT_PIPELINE_QUEUE_DEPTH = 2
+# ディレクトリモードで、CNNの前半でまとめて処理する画像の枚数(1の場合は1枚ずつ処理する)
+# パイプラインのキューにはこの枚数ごとにまとめた推論対象を溜める
+IOT_HEAD_INFERENCE_BATCH_SIZE = 1
+# ディレクトリモードで、先にデコードしておく画像の枚数
+IOT_IMAGE_PREFETCH_COUNT = 4
+# デコード済みの画像を保持するキャッシュの最大サイズ(バイト)
+IOT_IMAGE_CACHE_MAX_BYTES = 256 * 2**20
+
+# result_dataの送信形式 ("binary" または "json")
+# エッジサーバーは受信データの先頭バイトでどちらの形式でも受け付ける
+IOT_WIRE_FORMAT = "binary"
+
+# UDPでresult_dataを送信する時に、エッジサーバーからの受信報告をもとに送信レートを調整しながら送るか
+# Falseの場合はできるだけ速く送る(従来の実験結果と比べられるように、既定では使わない)
+IOT_USE_PACING = False
+# 送信レートの初期値(バイト/秒)、IoTデバイスの帯域制限(network_band_limitation)を設定した場合はその値から始める
+IOT_PACING_INITIAL_RATE = 10 * 2**20
+IOT_PACING_MIN_RATE = 64 * 2**10
+IOT_PACING_MAX_RATE = 2**30
+# 待たずに続けて送信できる最大のバイト数
+IOT_PACING_BURST_BYTES = 64 * 2**10
+# 受信報告の間の損失率が、network_loss_rateにこの値を足したものを超えたら送信レートを下げる
+IOT_PACING_LOSS_MARGIN = 0.02
+# エッジサーバーが受信報告を送る間隔(受信したパケット数)
+EDGE_RECEPTION_REPORT_INTERVAL_PACKETS = 32
+
+# UDPで失われたresult_dataのパケットを再送するか
+# エッジサーバーは受信が途切れた時に届いていないパケットをIoTデバイスに通知し、IoTデバイスはそのパケットだけを再送する
+UDP_RETRANSMISSION = False
+# 最後の受信(または再送要求)から次の再送要求を送るまでの時間(秒)
+EDGE_RETRANSMISSION_REQUEST_INTERVAL_SECONDS = 0.05
+# EdgeServerのタイマーが、data_waiting_timeの経過と再送要求の必要を確認する間隔(秒)
+# 再送要求が遅れないように、EDGE_RETRANSMISSION_REQUEST_INTERVAL_SECONDSより長くしない
+EDGE_RECEPTION_TIMER_INTERVAL_SECONDS = EDGE_RETRANSMISSION_REQUEST_INTERVAL_SECONDS
+# 1つの推論対象に対して再送を要求する最大の回数(遅延が伸び続けないようにする)
+MAX_RETRANSMISSION_ROUNDS = 3
+# 全てのパケットを送信した後、IoTデバイスが再送要求を待つ最大時間(秒)
+IOT_RETRANSMISSION_WAIT_SECONDS = 1.0
+
+# UDPでresult_dataを送信する時に、このパケット数ごとにXORのパリティパケットを1つ付けて送る(0の場合は付けない)
+# エッジサーバーは1グループにつき1つまで、失われたパケットを再送なしで復元できる
+IOT_FEC_GROUP_SIZE = 0
+
+# Qubit_typeがProgressive 16bitの場合に、ベースレイヤー(上位8bit)が揃った時点で推論した後も、
+# リファインメントレイヤー(下位8bit)の受信を続けるかどうか
+# Falseの場合はベースレイヤーが揃った時点で受信を終了し、その推論結果を使う
+EDGE_PROGRESSIVE_REFINEMENT = True
+
+# エッジサーバーで推論対象をまとめて推論する時の最大バッチサイズと、バッチを集めるために待つ最大時間
+EDGE_INFERENCE_MAX_BATCH_SIZE = 8
+EDGE_INFERENCE_MAX_QUEUE_DELAY_SECONDS = 0.005
+# 推論結果のクラウドサーバーへの送信など、推論後の処理を行うスレッド数(推論のスレッドとは別に持つ)
+EDGE_INFERENCE_CALLBACK_WORKERS = 4
+# エッジサーバーがIoTデバイスに送るリクエスト(受信結果の通知・受信報告・再送要求)のレスポンスを待つ最大時間(秒)
+# 応答しないIoTデバイスがあっても、他のIoTデバイスの受信と推論を長く止めないように短めにしている
+EDGE_IOT_RESPONSE_TIMEOUT_SECONDS = 5.0
+# AsyncEdgeServerで、TCPの接続ごとのコマンドの処理と、受信を終了した推論対象の推論を実行するスレッド数
+ASYNC_EDGE_SERVER_WORKERS = 8
+
+# 推論に使うサブモデル(モデルのパス、開始レイヤー、終了レイヤーの組)をいくつまで保持しておくか
+SUB_MODEL_CACHE_SIZE = 8
+
 DEFAULT_16BIT_SCALE = 1000
 DEFAULT_8BIT_SCALE = 10
 DEFAULT_4BIT_SCALE = 4
+# Packed 4bit/2bit、Affine 8bit/16bitで、スケールとゼロ点をチャンネル(最後の次元)ごとに求めるかどうか(Falseの場合はテンソル全体で1組)
+IOT_QUANTIZATION_PER_CHANNEL = True
+# Packed 4bit/2bit、Affine 8bit/16bitで、ゼロ点を0とした符号付きの対称な量子化にするかどうか
+# ReLUの後など負の値がない場合は、Falseの方が範囲を有効に使える
+IOT_QUANTIZATION_SYMMETRIC = False
+# create_calibration_table.pyで作成したテーブルがある場合に、量子化の範囲(最大値・最小値、中央値・標準偏差)として使うかどうか
+# 使う場合は推論対象ごとに統計量を求めない(量子化の結果が変わるので、既定では使わない)
+IOT_USE_CALIBRATION_TABLE = False
+# キャリブレーションした範囲をパーセンタイルでクリップする場合の値(99.9なら0.1から99.9パーセンタイルまで、Noneの場合は最小値から最大値まで)
+IOT_CALIBRATION_CLIP_PERCENTILE = None
 DEFAULT_NORMALIZE_16BIT_SCALE = 10000
+# result_dataのパケットごとに0の要素の割合を見て、0以外の要素だけを送る形式(sparse_codec.py)にするかどうか
+# 0の少ないパケットはそのまま送るので、Trueにしても大きくなるのはパケットごとのヘッダの分だけ(送信形式が変わるので、既定では使わない)
+IOT_SPARSE_ENCODING = False
+# entropy_coderでzlib、zstdを選んだ場合の圧縮レベル(パケットごとに符号化するので、速度を優先して低めにしている)
+ENTROPY_CODER_ZLIB_LEVEL = 6
+ENTROPY_CODER_ZSTD_LEVEL = 3
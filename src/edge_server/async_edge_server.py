@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import socket
+import sys
+import time
+
+from src.conf import environment_settings
+from src.edge_server.edge_server import EdgeServer
+from src.lib.framing import MESSAGE_LENGTH, MessageTooLargeError
+from src.lib.tc import Tc
+
+
+class EdgeServerDatagramProtocol(asyncio.DatagramProtocol):
+    '''UDPで受信したデータグラムをAsyncEdgeServerのワーカーに渡す'''
+    def __init__(self, edge_server):
+        self.edge_server = edge_server
+
+    def datagram_received(self, data, addr):
+        # EdgeServerと同様に、推論結果の送信に失敗した後はUDPのリクエストを処理しない
+        if self.edge_server.has_network_error:
+            return
+        self.edge_server.logger.debug(f"UDP Request addr : {addr}")
+        self.edge_server.submit_udp(self.edge_server.handle_udp_request_safely, data)
+
+    def error_received(self, exc):
+        self.edge_server.logger.warning(f"UDP error : {exc}")
+
+
+class AsyncEdgeServer(EdgeServer):
+    '''
+    asyncioのイベントループ1つでTCP・UDPの受信とdata_waiting_timeの期限を扱うエッジサーバー
+    コマンドの処理はEdgeServerのcommand_listをそのまま使う
+    推論などの重い処理でイベントループを止めないように、コマンドの処理はワーカーのスレッドで実行する
+    TCPのリクエストは接続ごとに受信順に、UDPのデータグラムは1スレッドで受信順に処理する(EdgeServerの接続ごと・UDPのスレッドと同じ)
+    複数のIoTデバイスの接続は同じイベントループで受け付け、受信状態はセッションごとに分けて持つ
+    受信を終了した推論対象のIoTデバイスへの通知と推論は別のワーカーで行い、応答の遅いIoTデバイスが他の受信を止めないようにする
+    '''
+    # 終了コマンドの受信後、処理中のリクエストのレスポンス送信を待つ時間
+    SHUTDOWN_TIMEOUT_SECONDS = 5.0
+
+    def __init__(self):
+        super(AsyncEdgeServer, self).__init__()
+        self.loop = None
+        self.executor = None
+        self.udp_executor = None
+        self.completion_executor = None
+        self.stopped = None
+        # session_id -> data_waiting_timeの期限のタイマー
+        self.timer_handles = {}
+        self.connection_tasks = set()
+        # ヘッダの受信待ち(リクエストを処理していない)の接続(task -> writer)
+        self.idle_connections = {}
+
+    def receive_common_request(self):
+        self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
+        self.is_wait = True
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=environment_settings.ASYNC_EDGE_SERVER_WORKERS)
+        self.udp_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.completion_executor = concurrent.futures.ThreadPoolExecutor(max_workers=environment_settings.ASYNC_EDGE_SERVER_WORKERS)
+        self.inference_scheduler.start()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            # 受信の処理から受信を終了した推論対象が渡されるので、受信の処理を先に終える
+            self.udp_executor.shutdown(wait=True)
+            self.executor.shutdown(wait=True)
+            self.completion_executor.shutdown(wait=True)
+            # 待ち行列に残っている推論対象の推論結果を送信してからソケットを閉じる
+            self.inference_scheduler.stop()
+            self.inference_scheduler.log_statistics()
+            self.report_executor.shutdown(wait=True)
+            self.connection_pool.close()
+            self.iot_connection_pool.close()
+
+        if self.setting is not None:
+            Tc.reset_tc(
+                environment_settings.EDGE_NETWORK_DEVICE,
+                self.setting['edge_network_delay_time'],
+                self.setting['edge_network_dispersion_time'],
+                self.setting['edge_network_loss_rate'],
+                self.setting['edge_network_band_limitation']
+            )
+        self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        tcp_server = await asyncio.start_server(
+            self.handle_tcp_connection, environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT
+        )
+        udp_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: EdgeServerDatagramProtocol(self),
+            local_addr=(environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_UDP_PORT),
+        )
+        self.logger.info('wait receive...')
+        try:
+            await self.stopped.wait()
+        finally:
+            self.is_wait = False
+            for timer_handle in self.timer_handles.values():
+                timer_handle.cancel()
+            self.timer_handles = {}
+            udp_transport.close()
+            tcp_server.close()
+            await tcp_server.wait_closed()
+            # 待機中の接続は閉じ、処理中の接続はレスポンスを送り終えるまで待つ
+            for writer in list(self.idle_connections.values()):
+                writer.close()
+            if self.connection_tasks:
+                done, pending = await asyncio.wait(
+                    list(self.connection_tasks), timeout=self.SHUTDOWN_TIMEOUT_SECONDS
+                )
+                for task in pending:
+                    task.cancel()
+
+    def submit(self, func, *args):
+        """コマンドの処理をワーカーで実行する"""
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def submit_udp(self, func, *args):
+        """UDPのデータグラムの処理を、受信順にUDP用のワーカーで実行する"""
+        return self.loop.run_in_executor(self.udp_executor, func, *args)
+
+    async def handle_tcp_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        addr = writer.get_extra_info('peername')
+        self.logger.debug(f"Connected from : {addr}")
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while not self.stopped.is_set():
+                self.idle_connections[task] = writer
+                try:
+                    header = await reader.readexactly(MESSAGE_LENGTH.size)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        raise ConnectionError("connection closed in the middle of a message")
+                    break
+                finally:
+                    self.idle_connections.pop(task, None)
+
+                (length,) = MESSAGE_LENGTH.unpack(header)
+                if length > environment_settings.MAX_MESSAGE_SIZE:
+                    raise MessageTooLargeError(
+                        f"message size {length} exceeds {environment_settings.MAX_MESSAGE_SIZE}"
+                    )
+                data = await reader.readexactly(length)
+                response = await self.submit(self.handle_tcp_request, data)
+                if response is not None:
+                    writer.write(MESSAGE_LENGTH.pack(len(response)) + response)
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, MessageTooLargeError) as e:
+            self.logger.warning(f"connection from {addr} closed : {e}")
+        except Exception as e:
+            self.logger.exception(e)
+        finally:
+            self.connection_tasks.discard(task)
+            writer.close()
+        self.logger.debug(f"Disconnected from : {addr}")
+
+    def handle_udp_request_safely(self, data):
+        try:
+            self.handle_udp_request(data)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def complete_reception(self, session):
+        """IoTデバイスへの通知と推論は、受信の処理とは別のワーカーで行う"""
+        self.completion_executor.submit(self.complete_reception_safely, session)
+
+    def complete_reception_safely(self, session):
+        try:
+            super(AsyncEdgeServer, self).complete_reception(session)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def stop_receiving(self):
+        # ワーカーのスレッドから呼ばれるため、イベントループ側で終了を通知する
+        self.is_wait = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def start_reception_timer(self, session):
+        """
+        data_waiting_timeの期限をイベントループのタイマーで管理する
+        ワーカーのスレッドから呼ばれるため、タイマーの設定はイベントループ側で行う
+        """
+        self.loop.call_soon_threadsafe(self.schedule_reception_deadline, session)
+
+    def schedule_reception_deadline(self, session):
+        self.cancel_reception_timer(session)
+        if session.latest_received_time is None:
+            return
+        # パケットを受信するたびにタイマーを張り直さず、期限が来た時に最後の受信時刻から張り直す
+        deadline = session.latest_received_time + self.setting['waiting_time'] / 1000.0
+        if environment_settings.UDP_RETRANSMISSION and self.setting['use_udp'] and session.retransmission_rounds < environment_settings.MAX_RETRANSMISSION_ROUNDS:
+            # 再送要求を送る時刻の方が早ければ、その時刻に確認する
+            idle_since = max(session.latest_received_time, session.latest_retransmission_request_time or 0)
+            deadline = min(deadline, idle_since + environment_settings.EDGE_RETRANSMISSION_REQUEST_INTERVAL_SECONDS)
+        self.timer_handles[session.session_id] = self.loop.call_later(
+            max(deadline - time.time(), 0), self.on_reception_deadline, session
+        )
+
+    def cancel_reception_timer(self, session):
+        timer_handle = self.timer_handles.pop(session.session_id, None)
+        if timer_handle is not None:
+            timer_handle.cancel()
+
+    def on_reception_deadline(self, session):
+        self.timer_handles.pop(session.session_id, None)
+        self.submit(self.check_reception_deadline, session)
+
+    def check_reception_deadline(self, session):
+        """ワーカーで実行し、最後の受信からの経過時間を確認する"""
+        # 十分なデータを受信済みの場合はsend_received_resultでNoneになっている
+        if session.latest_received_time is None:
+            return
+        elapsed_time = time.time() - session.latest_received_time
+        self.logger.debug(f"Elapsed time : {elapsed_time}")
+        if self.setting['waiting_time'] / 1000.0 <= elapsed_time:
+            try:
+                self.process_reception_timeout(session)
+            except Exception as e:
+                self.logger.exception(e)
+            session.latest_received_time = None
+        else:
+            if self.should_request_retransmission(session):
+                self.request_retransmission(session)
+            self.loop.call_soon_threadsafe(self.schedule_reception_deadline, session)
+
+if __name__ == "__main__":
+    edge_server = AsyncEdgeServer()
+    edge_server.main()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # -*- Coding: utf-8 -*-
 import base64
+import concurrent.futures
+import io
 import json
-import os
 import socket
 import sys
 import threading
@@ -12,23 +13,32 @@ import numpy as np
 from PIL import Image
 
 from src.conf import environment_settings
-from src.lib import code, command, inference, save_result
+from src.lib import code, command, fec, inference, save_result
+from src.lib.connection import ConnectionPool, MessageServer
+from src.lib.entropy_coder import EntropyCoder
 from src.lib.logger import create_logger
 from src.lib.model.request import (
     CommonRequest,
     EdgeServerInferenceResultRequest,
     EdgeServerReceivedResultRequest,
+    EdgeServerReceptionReportRequest,
     IotDeviceResultDataRequest,
     IotDeviceResultSummaryRequest,
     CloudServerSettingRequest,
-    ProcessTimeRequest
+    ProcessTimeRequest,
+    encode_sequence_bitmap,
+    is_binary_frame
 )
 from src.lib.model.response import CommonResponse
+from src.lib.packetizer import channel_major_permutation, layered_permutation
+from src.lib.sparse_codec import decode_sparse_payload
 from src.lib import compressor
 from src.lib.tc import Tc
+from src.edge_server.inference_scheduler import InferenceScheduler
+from src.edge_server.session import ReceptionSession
 
-BUFFER_NPYFILE = os.path.join(os.path.dirname(__file__), "buffer.npy")
-BUFFER_JPGFILE = os.path.join(os.path.dirname(__file__), "buffer.jpg")
+# 推論に失敗した推論対象について、推論結果の代わりにクラウドサーバーへ送る文字列(ラベルとは一致しないので不正解として数えられる)
+EDGE_INFERENCE_FAILURE = "inference failed"
 
 class EdgeServer:
     def __init__(self):
@@ -39,18 +49,29 @@ class EdgeServer:
         }
         self.logger = create_logger(__name__)
         self.is_wait = True
-        self.latest_received_time = None
         self.setting = None
         self.compressor = compressor.Compressor()
-
-        # 一回だけ推論モデルのロードを行うためのフラグ
-        self.already_load_model = False
-        self.total_received_data_size = 0
-
-        # 推論を一回だけ行うためのフラグ
-        # これがないと、推論を行なった後でも、新たなパケットを受信するたびに推論を繰り返してしまう
-        # 1つの推論対象に対する推論が完了したらTrueにし、新たな推論対象のresult_summaryを受信したらFalseに戻す
-        self.inference_completed = False
+        # IoTデバイス・クラウドサーバーとの接続は張りっぱなしにして使い回す
+        self.connection_pool = ConnectionPool(self.logger)
+        # IoTデバイスへのリクエストは、応答がない場合に早めに諦めるように別のタイムアウトで送る
+        self.iot_connection_pool = ConnectionPool(
+            self.logger, response_timeout=environment_settings.EDGE_IOT_RESPONSE_TIMEOUT_SECONDS
+        )
+        self.tcp_server = None
+        self.udp_socket = None
+
+        # 受信中の推論対象(session_id -> ReceptionSession)
+        # 複数のIoTデバイスから同時に届くresult_dataを、推論対象ごとに別々に並べ直す
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        # 推論が完了したセッションの受信バッファ((要素数, 型) -> バッファのリスト)
+        self.reception_buffers = {}
+        # IoTデバイスごとの推論対象のシーケンス番号
+        self.target_image_sequence_numbers = {}
+        # 推論の準備ができた推論対象をまとめて推論する
+        self.inference_scheduler = InferenceScheduler(self.logger)
+        # 受信報告は受信処理を止めないように別のスレッドで、送信順を保って送る
+        self.report_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         self.retry_count = 0
         self.has_network_error = False
 
@@ -76,7 +97,8 @@ class EdgeServer:
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         self.setting = json.loads(request.setting)
         self.logger.info("====== get {}======".format(self.setting))
-        self.target_image_sequence_number = 0 #cloudから設定を受け取るたびにリセットする推論対象のシーケンス番号
+        with self.sessions_lock:
+            self.target_image_sequence_numbers = {} #cloudから設定を受け取るたびにリセットする推論対象のシーケンス番号
 
         payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
         response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
@@ -85,7 +107,8 @@ class EdgeServer:
         # data waiting timeの間にudpソケットがタイムアウトしてしまったら困るので、5秒分だけ長くしておく
         waiting_time_seconds = self.setting['waiting_time'] / 1000.0
         timeout_seconds = waiting_time_seconds + 5
-        self.udp_socket.settimeout(timeout_seconds)
+        if self.udp_socket is not None:
+            self.udp_socket.settimeout(timeout_seconds)
 
         Tc.execute_tc(
             environment_settings.EDGE_NETWORK_DEVICE,
@@ -94,286 +117,617 @@ class EdgeServer:
             self.setting['edge_network_loss_rate'],
             self.setting['edge_network_band_limitation']
         )
+
+        # 最初の推論対象の処理時間にサブモデルの作成とトレースの時間が含まれないように、受信中に準備しておく
+        if not self.setting['reload']:
+            thread_warm_up = threading.Thread(target=self.warm_up_sub_model, daemon=True)
+            thread_warm_up.start()
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return response   
 
+    def warm_up_sub_model(self):
+        try:
+            model = inference.sub_model_cache.load_model(self.setting['model'])
+            inference.sub_model_cache.warm_up(self.setting['model'], self.setting['layer'] + 1, len(model.layers))
+        except Exception as e:
+            self.logger.exception(e)
+
     def process_iot_send_result_summary(self, request):
         """
         IoTデバイスから受信したresult_summaryを処理する
+        推論対象ごとに受信状態(ReceptionSession)を作成し、result_dataのsession_idで参照する
         """
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        self.latest_received_time = time.time()
-
-        self.iot_result_summary = request
-
-        self.filename = self.iot_result_summary.filename
+        with self.sessions_lock:
+            # 推論対象のシーケンス番号はIoTデバイスごとに数える
+            target_image_sequence_number = self.target_image_sequence_numbers.get(request.device_id, 0)
+            self.target_image_sequence_numbers[request.device_id] = target_image_sequence_number + 1
+        session = ReceptionSession(request, target_image_sequence_number)
 
         if self.setting['layer'] == 0:
-            self.iot_result_data = b""
+            # 画像ファイルのバイト列を、届いた順ではなくsequenceの位置に書き込む
+            session.iot_result_data = bytearray(request.num_elements)
         else:
-            self.iot_result_data = np.zeros(self.iot_result_summary.num_elements)
+            # IoTデバイスのTensorPacketizerと同じ型の受信バッファを用意する(同じ要素数と型であれば使い回す)
+            session.iot_result_data = self.acquire_reception_buffer(request.num_elements, np.dtype(request.dtype))
+            # プログレッシブ符号化の場合は、IoTデバイスと同じくレイヤーごとに並べ替える
+            layer_size = request.num_elements // request.num_layers
             if self.setting['split_mode'] == 'random':
                 # IoTデバイス側と同じシード値を使っているためIoTデバイス側と同じシャッフル列が生成され、ランダム順のパケットを元の順番に並べ直せる。
-                # np.random.seed(environment_settings.IOT_RANDOM_SEED_SHUFFLE)
-                # 結局同じことだが、受信したランダムシードを用いる方が正しいのでは？
-                np.random.seed(self.iot_result_summary.random_seed)
-                self.k = np.random.permutation(self.iot_result_summary.num_elements)
+                # 複数のセッションから同時に呼ばれるため、グローバルな乱数状態は使わない
+                session.k = np.random.RandomState(request.random_seed).permutation(layer_size)
             elif self.setting['split_mode'] == 'sequential':
-                self.k = np.arange(self.iot_result_summary.num_elements)
+                session.k = np.arange(layer_size)
+            elif self.setting['split_mode'] == 'importance':
+                # チャンネルの送信順はIoTデバイスが中間層出力ごとに決め、サマリーで送ってくる
+                session.k = channel_major_permutation(request.channel_order, layer_size)
             else:
                 raise Exception('IOT_SPLIT_MODE has invalid value.')
+            if request.num_layers > 1:
+                session.k = layered_permutation(session.k, request.num_layers)
+
+        with self.sessions_lock:
+            self.sessions[session.session_id] = session
 
-        self.iot_result_data_received_packets = 0
-        self.iot_result_data_received_elements = 0
         payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
         self.logger.info(f"IotResultSummary : {request}")
         response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
 
-        self.inference_completed = False
-        self.thread_timer = threading.Thread(target=self.reception_timer)
-        self.thread_timer.setDaemon(True)
-        self.thread_timer.start()
+        self.start_reception_timer(session)
 
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return response
 
-    def reception_timer(self):
+    def acquire_reception_buffer(self, num_elements, dtype):
+        with self.sessions_lock:
+            buffers = self.reception_buffers.get((num_elements, dtype))
+            if buffers:
+                reception_buffer = buffers.pop()
+                reception_buffer.fill(0)
+                return reception_buffer
+        return np.zeros(num_elements, dtype=dtype)
+
+    def close_session(self, session):
+        """推論が完了したセッションを削除し、受信バッファを次のセッションで使えるように戻す"""
+        with self.sessions_lock:
+            if self.sessions.pop(session.session_id, None) is None:
+                return
+            # 全てエッジで推論する場合は、受信バッファではなくデコードした画像が入っている
+            if self.setting['layer'] != 0 and isinstance(session.iot_result_data, np.ndarray):
+                key = (len(session.iot_result_data), session.iot_result_data.dtype)
+                self.reception_buffers.setdefault(key, []).append(session.iot_result_data)
+        session.iot_result_data = None
+
+    def start_reception_timer(self, session):
+        """data_waiting_timeの経過を監視するタイマーを開始する"""
+        thread_timer = threading.Thread(target=self.reception_timer, args=(session,), daemon=True)
+        thread_timer.start()
+
+    def reception_timer(self, session):
         """
-        result_summaryやresult_dataを受信した時に更新されるself.latest_received_timeと
+        result_summaryやresult_dataを受信した時に更新されるsession.latest_received_timeと
         現在時刻を比較することで経過時間を測定し、GUIで設定したdata_waiting_timeを超えたら
         IoTデバイスに時間経過したことを表すレスポンスを送信し、推論処理に移る
         """
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        # self.latest_received_timeは、process_iot_send_result_dataでも更新される
+        # session.latest_received_timeは、process_iot_send_result_dataでも更新される
 
-        while self.latest_received_time is not None:
+        while session.latest_received_time is not None:
             # 経過時間
-            elapsed_time = time.time() - self.latest_received_time
+            elapsed_time = time.time() - session.latest_received_time
             self.logger.debug(f"Elapsed time : {elapsed_time}")
 
             # GUIで設定されたwaiting_time(ms)以上経過した場合
-            if (self.setting['waiting_time'] / 1000.0 <= elapsed_time):
-                self.send_received_result("failure")
-                # 十分な受信率を達成していない場合でも、設定した待機時間経過により推論を開始する
-                if not self.inference_completed:
-                    transmission_end_time = time.time()
-                    save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission end time = {:.9f}".format(self.target_image_sequence_number, transmission_end_time) + '\n', mode='a')
-                    self.send_received_result("success")
-                    save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Data Size = {} bytes".format(self.target_image_sequence_number, self.total_received_data_size) + '\n', mode='a')
-                    save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Packets = {}".format(self.target_image_sequence_number, self.iot_result_data_received_packets) + '\n', mode='a')
-                    self.do_inference()
+            remaining_time = self.setting['waiting_time'] / 1000.0 - elapsed_time
+            if remaining_time <= 0:
+                self.process_reception_timeout(session)
                 break
-            time.sleep(0.1)
+            # 受信が途切れた場合は、届いていないパケットの再送を要求する
+            if self.should_request_retransmission(session):
+                self.request_retransmission(session)
+            # waiting_timeの期限を過ぎて待たないように、期限までの時間が短ければその時間だけ待つ
+            time.sleep(min(remaining_time, environment_settings.EDGE_RECEPTION_TIMER_INTERVAL_SECONDS))
 
-        self.latest_received_time = None
+        session.latest_received_time = None
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
+    def process_reception_timeout(self, session):
+        """
+        data_waiting_timeが経過した時の処理
+        IoTデバイスに時間経過したことを表すレスポンスを送信し、推論処理に移る
+        """
+        with session.lock:
+            # 待機中に十分なデータが届いて推論済みの場合は何もしない
+            if session.latest_received_time is None:
+                return
+            session.latest_received_time = None
+            # 十分な受信率を達成していない場合でも、設定した待機時間経過により推論を開始する
+            if not session.inference_completed:
+                self.finish_reception(session)
+            completion_pending = self.take_completion_pending(session)
+        # IoTデバイスへの送信は、他のパケットの受信を止めないようにロックを外してから行う
+        self.send_received_result("failure", session)
+        if completion_pending:
+            self.complete_reception(session)
+
+    def should_request_retransmission(self, session):
+        """UDPで受信が途切れてから一定時間経ち、届いていないパケットがある場合にTrueを返す"""
+        if not (environment_settings.UDP_RETRANSMISSION and self.setting['use_udp']):
+            return False
+        latest_received_time = session.latest_received_time
+        if latest_received_time is None or session.inference_completed:
+            return False
+        if session.retransmission_rounds >= environment_settings.MAX_RETRANSMISSION_ROUNDS:
+            return False
+        idle_since = max(latest_received_time, session.latest_retransmission_request_time or 0)
+        if time.time() - idle_since < environment_settings.EDGE_RETRANSMISSION_REQUEST_INTERVAL_SECONDS:
+            return False
+        return not session.received_sequences.all()
+
+    def request_retransmission(self, session):
+        """届いていないパケットのsequenceをビットマップにして、IoTデバイスに再送を要求する"""
+        with session.lock:
+            if session.inference_completed:
+                return
+            missing = ~session.received_sequences
+            session.retransmission_rounds += 1
+            session.latest_retransmission_request_time = time.time()
+            self.logger.info(f"request retransmission of {int(missing.sum())} packets (round {session.retransmission_rounds})")
+            req = EdgeServerReceivedResultRequest(
+                command.EDGE_SEND_RECEIVED_RESULT, code.MISSING_DATA, session_id=session.session_id, missing=encode_sequence_bitmap(missing)
+            )
+        # 受信報告と同様に、受信処理を止めないように別のスレッドで送る
+        self.report_executor.submit(self.send_request_to_iot_device, session, req)
+
+    def finish_reception(self, session):
+        """
+        受信を終了する(session.lockを取得した状態で呼ぶ)
+        以降に届いたパケットは読み捨て、IoTデバイスへの通知と推論はロックを外してからcomplete_receptionで行う
+        """
+        session.reception_end_time = time.time()
+        session.latest_received_time = None
+        session.inference_completed = True
+        session.completion_pending = True
+
+    def take_completion_pending(self, session):
+        """finish_receptionで受信を終了していればTrueを返す(session.lockを取得した状態で呼び、1回だけTrueになる)"""
+        completion_pending = session.completion_pending
+        session.completion_pending = False
+        return completion_pending
+
+    def take_base_layer_input(self, session):
+        """complete_base_layerでベースレイヤーが揃っていれば、その時の受信バッファのコピーを返す(session.lockを取得した状態で呼び、1回だけ返す)"""
+        base_layer_input = session.base_layer_input
+        session.base_layer_input = None
+        return base_layer_input
+
+    def complete_reception(self, session):
+        """受信を終了したことをIoTデバイスに伝え、推論を行う(session.lockを外した状態で呼ぶ)"""
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission end time = {:.9f}".format(session.target_image_sequence_number, session.reception_end_time) + '\n', mode='a')
+        self.send_received_result("success", session)
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Data Size = {} bytes".format(session.target_image_sequence_number, session.total_received_data_size) + '\n', mode='a')
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Packets = {}".format(session.target_image_sequence_number, session.iot_result_data_received_packets) + '\n', mode='a')
+        if session.fec_group_size:
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Recovered Packets = {}".format(session.target_image_sequence_number, session.recovered_packets) + '\n', mode='a')
+        try:
+            self.do_inference(session)
+        finally:
+            self.close_session(session)
+
+    def find_session(self, request):
+        with self.sessions_lock:
+            return self.sessions.get(request.session_id)
+
+    def count_received_data_size(self, request, size):
+        """受信したresult_dataのバイト数をセッションごとに数える"""
+        session = self.find_session(request)
+        if session is not None:
+            with session.lock:
+                session.total_received_data_size += size
+
     def process_iot_send_result_data(self, request):
         '''
         IoTデバイスから受信したresult_dataを処理する
         '''
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        self.latest_received_time = time.time()
+        payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
+        response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
+
+        session = self.find_session(request)
+        # 推論が完了したセッションに遅れて届いたパケットは読み捨てる
+        if session is None:
+            self.logger.debug(f"packet for finished session : {request.session_id}")
+            return response
+
+        with session.lock:
+            if session.inference_completed:
+                return response
+            self.receive_result_data(session, request)
+            base_layer_input = self.take_base_layer_input(session)
+            completion_pending = self.take_completion_pending(session)
+        # ベースレイヤーや十分なデータが揃った場合は、他のパケットの受信を止めないようにロックを外してから推論する
+        if base_layer_input is not None:
+            self.infer_base_layer(session, base_layer_input)
+        if completion_pending:
+            self.complete_reception(session)
+
+        self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
+        return response
+
+    def receive_result_data(self, session, request):
+        session.latest_received_time = time.time()
+
+        num_packets = session.iot_result_summary.num_packets
+        # FECのパリティパケットはデータパケットの後ろのsequenceで届く
+        if session.fec_group_size and num_packets <= request.sequence < num_packets + fec.num_groups(num_packets, session.fec_group_size):
+            group = request.sequence - num_packets
+            # パリティはバイト列なので、バイナリフレームではuint8のnp.ndarray、JSONでは生のバイト列のbase64文字列で届く
+            if isinstance(request.payload, np.ndarray):
+                session.parity_packets[group] = request.payload.tobytes()
+            else:
+                session.parity_packets[group] = base64.b64decode(request.payload.encode())
+            self.recover_lost_packet(session, group)
+            return
+
+        if not 0 <= request.sequence < num_packets:
+            self.logger.warning(f"sequence {request.sequence} is out of range")
+            return
+        # 再送などで重複して届いたパケットは数えない
+        if session.received_sequences[request.sequence]:
+            self.logger.debug(f"{request.sequence}th packet was already received.")
+            return
+
+        # 全てエッジで推論する場合は画像ファイルのバイト列、それ以外はテンソルの要素が届く
+        # バイナリフレームの場合はnp.ndarray、JSONの場合はbase64文字列で届く
+        if session.iot_result_summary.entropy_coder != EntropyCoder.ENTROPY_NONE or session.iot_result_summary.sparse_encoding:
+            # 疎な形式や可逆圧縮にしたペイロードは、バイナリフレームではuint8のnp.ndarray、JSONでは生のバイト列のbase64文字列で届く
+            if isinstance(request.payload, np.ndarray):
+                coded = request.payload.tobytes()
+            else:
+                coded = base64.b64decode(request.payload.encode())
+            payload = EntropyCoder.decode(session.iot_result_summary.entropy_coder, coded)
+            if session.iot_result_summary.sparse_encoding:
+                # 0以外の要素をパケットの元の位置にまとめて書き込み、残りを0で埋める
+                payload = decode_sparse_payload(payload, session.iot_result_data.dtype)
+            elif self.setting['layer'] != 0:
+                payload = np.frombuffer(payload, dtype=session.iot_result_data.dtype)
+        elif self.setting['layer'] == 0:
+            if isinstance(request.payload, np.ndarray):
+                payload = request.payload.tobytes()
+            else:
+                payload = base64.b64decode(request.payload.encode())
+        else:
+            # 受信したバイト列からディスクを介さずに直接デコードする
+            if isinstance(request.payload, np.ndarray):
+                payload = request.payload
+            else:
+                payload = np.load(io.BytesIO(base64.b64decode(request.payload.encode())))
+        self.store_packet(session, request.sequence, payload)
+
+        if session.fec_group_size:
+            self.recover_lost_packet(session, request.sequence // session.fec_group_size)
+
+    def packet_bytes(self, session, sequence):
+        """受信済みのsequence番目のパケットのペイロードを、受信バッファからバイト列として取り出す"""
+        start = sequence * session.iot_result_summary.packet_length
+        stop = start + session.iot_result_summary.packet_length
+        if self.setting['layer'] == 0:
+            return bytes(session.iot_result_data[start:stop])
+        return session.iot_result_data[session.k[start:stop]].tobytes()
+
+    def recover_lost_packet(self, session, group):
+        """グループで失われたデータパケットが1つだけであれば、パリティと残りのパケットのXORで復元する"""
+        parity = session.parity_packets.get(group)
+        if parity is None or session.inference_completed:
+            return
+        sequences = fec.group_range(group, session.iot_result_summary.num_packets, session.fec_group_size)
+        lost_sequences = [sequence for sequence in sequences if not session.received_sequences[sequence]]
+        if len(lost_sequences) != 1:
+            if not lost_sequences:
+                del session.parity_packets[group]
+            return
+
+        lost_sequence = lost_sequences[0]
+        recovered = fec.xor_payloads(
+            [parity] + [self.packet_bytes(session, sequence) for sequence in sequences if sequence != lost_sequence], len(parity)
+        )
+        del session.parity_packets[group]
+        # 最後のパケットは短いので、残りの要素数に合わせて切り詰める
+        start = lost_sequence * session.iot_result_summary.packet_length
+        length = min(session.iot_result_summary.packet_length, session.iot_result_summary.num_elements - start)
+        if self.setting['layer'] == 0:
+            payload = recovered[:length]
+        else:
+            payload = np.frombuffer(recovered, dtype=session.iot_result_data.dtype, count=length)
+        session.recovered_packets += 1
+        self.logger.info(f"{lost_sequence}th packet was recovered by FEC.")
+        self.store_packet(session, lost_sequence, payload)
+
+    def store_packet(self, session, sequence, payload):
+        """sequence番目のパケットのペイロードを受信バッファの元の位置に書き込み、十分なデータが揃ったら推論に移る"""
+        session.received_sequences[sequence] = True
 
         # 受信したパケットの数
-        self.iot_result_data_received_packets += 1
+        session.iot_result_data_received_packets += 1
+        session.highest_received_sequence = max(session.highest_received_sequence, sequence)
+        # UDPの場合は、IoTデバイスが送信レートを調整できるように定期的に受信状況を報告する
+        if self.setting['use_udp'] and session.iot_result_data_received_packets % environment_settings.EDGE_RECEPTION_REPORT_INTERVAL_PACKETS == 0:
+            self.send_reception_report(session)
         # パケットの受信率
-        packets_receive_rate = self.iot_result_data_received_packets / self.iot_result_summary.num_packets
+        packets_receive_rate = session.iot_result_data_received_packets / session.iot_result_summary.num_packets
 
-        self.logger.info(f"{request.sequence}th packet was received.")
+        self.logger.info(f"{sequence}th packet was received.")
         self.logger.info(
-            f"{self.iot_result_data_received_packets} of {self.iot_result_summary.num_packets} packets ({packets_receive_rate * 100} %) received."
+            f"{session.iot_result_data_received_packets} of {session.iot_result_summary.num_packets} packets ({packets_receive_rate * 100} %) received."
         )
-        self.total_received_data_size += len(request.payload)
-        payload = request.payload.encode()
         # 全てエッジで推論する場合
         if self.setting['layer'] == 0:
-            self.iot_result_data_received_elements += len(payload)
-            elements_receive_rate = self.iot_result_data_received_elements / self.iot_result_summary.num_elements
+            session.iot_result_data_received_elements += len(payload)
+            elements_receive_rate = session.iot_result_data_received_elements / session.iot_result_summary.num_elements
             self.logger.info(
-                f"{self.iot_result_data_received_elements} of {self.iot_result_summary.num_elements} elements ({elements_receive_rate * 100} %) received."
+                f"{session.iot_result_data_received_elements} of {session.iot_result_summary.num_elements} elements ({elements_receive_rate * 100} %) received."
             )
-            self.iot_result_data += base64.b64decode(payload)
-            if (
-                self.iot_result_data_received_elements == self.iot_result_summary.num_elements
-                and not self.inference_completed
-            ):
-                with open(BUFFER_JPGFILE, "wb") as f:
-                    f.write(self.iot_result_data)
-                self.iot_result_data = np.array(Image.open(BUFFER_JPGFILE))
-                transmission_end_time = time.time()
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission end time = {:.9f}".format(self.target_image_sequence_number, transmission_end_time) + '\n', mode='a')
-                self.send_received_result("success")
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Data Size = {} bytes".format(self.target_image_sequence_number, self.total_received_data_size) + '\n', mode='a')
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Packets = {}".format(self.target_image_sequence_number, self.iot_result_data_received_packets) + '\n', mode='a')
-                self.total_received_data_size = 0
-                self.do_inference()
+            start = sequence * session.iot_result_summary.packet_length
+            session.iot_result_data[start : start + len(payload)] = payload
+            if session.iot_result_data_received_elements == session.iot_result_summary.num_elements:
+                session.iot_result_data = np.array(Image.open(io.BytesIO(session.iot_result_data)))
+                self.finish_reception(session)
         else:
-            with open(BUFFER_NPYFILE, "wb") as f:
-                f.write(base64.b64decode(payload))
-            payload = np.load(BUFFER_NPYFILE)
-            self.iot_result_data_received_elements += len(payload)
-            elements_receive_rate = self.iot_result_data_received_elements / self.iot_result_summary.num_elements
+            session.iot_result_data_received_elements += len(payload)
+            elements_receive_rate = session.iot_result_data_received_elements / session.iot_result_summary.num_elements
             self.logger.info(
-                f"{self.iot_result_data_received_elements} of {self.iot_result_summary.num_elements} elements ({elements_receive_rate * 100} %) received."
+                f"{session.iot_result_data_received_elements} of {session.iot_result_summary.num_elements} elements ({elements_receive_rate * 100} %) received."
             )
-            os.remove(BUFFER_NPYFILE)
 
-            for i in range(len(payload)):
-                self.iot_result_data[
-                    self.k[request.sequence * environment_settings.IOT_SPLITTED_NUMPY_LENGTH + i]
-                ] = payload[i]
+            # パケット内の要素をまとめて元の位置に書き込む
+            start = sequence * session.iot_result_summary.packet_length
+            session.iot_result_data[session.k[start : start + len(payload)]] = payload
 
-            if (self.setting['reach_rate'] <= elements_receive_rate and not self.inference_completed):
-                print(self.iot_result_data)
-                transmission_end_time = time.time()
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission end time = {:.9f}".format(self.target_image_sequence_number, transmission_end_time) + '\n', mode='a')
-                self.send_received_result("success")
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Data Size = {} bytes".format(self.target_image_sequence_number, self.total_received_data_size) + '\n', mode='a')
-                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Received Packets = {}".format(self.target_image_sequence_number, self.iot_result_data_received_packets) + '\n', mode='a')
-                self.total_received_data_size = 0
+            # プログレッシブ符号化の場合は、ベースレイヤーが揃った時点で推論する
+            if session.num_layers > 1 and not session.base_layer_completed and session.received_sequences[: session.base_layer_packets].all():
+                self.complete_base_layer(session)
+                if session.inference_completed:
+                    return
 
-                self.do_inference()
+            if self.setting['reach_rate'] <= elements_receive_rate:
+                self.finish_reception(session)
 
-        payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
-        response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
+    def complete_base_layer(self, session):
+        """
+        ベースレイヤーが揃った時の処理(session.lockを取得した状態で呼ぶ)
+        EDGE_PROGRESSIVE_REFINEMENTがTrueの場合はベースレイヤーだけで推論してリファインメントレイヤーの受信を続け、
+        Falseの場合は受信を終了して推論する
+        """
+        session.base_layer_completed = True
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Base layer completion time = {:.9f}".format(session.target_image_sequence_number, time.time()) + '\n', mode='a')
+        if environment_settings.EDGE_PROGRESSIVE_REFINEMENT:
+            # 逆量子化やサブモデルの準備には時間がかかるので、受信バッファをコピーしておきロックを外してからinfer_base_layerで推論する
+            session.base_layer_input = session.iot_result_data.copy()
+        else:
+            self.finish_reception(session)
 
+    def infer_base_layer(self, session, base_layer_input):
+        """
+        ベースレイヤーだけで推論し、結果をsession.base_predictionに保持する(クラウドサーバーには送らない)
+        base_layer_inputはベースレイヤーが揃った時の受信バッファのコピー(session.lockを外した状態で呼ぶ)
+        """
+        self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
+        layer_size = session.iot_result_summary.num_elements // session.num_layers
+        sub_model, model_input_shape, inter_test_decomp = self.prepare_inference_input(session, np.zeros(layer_size, dtype=bool), base_layer_input)
+
+        def complete_base_layer_inference(y_pred, inference_start_time, inference_end_time):
+            session.base_prediction = (y_pred, inference_start_time, inference_end_time)
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge base layer prediction = {}, end time = {:.9f}".format(session.target_image_sequence_number, y_pred[0].argmax(axis=0), inference_end_time) + '\n', mode='a')
+
+        self.inference_scheduler.submit(
+            (self.setting['model'], self.setting['layer'], model_input_shape),
+            inter_test_decomp,
+            sub_model,
+            complete_base_layer_inference,
+        )
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
-        return response
 
-    def do_inference(self):
-        #self.send_process_time("edge:do_inference:start:{}".format(self.filename)) # 実行時間短縮のためコメントアウト中
+    def received_refinement_mask(self, session):
+        """リファインメントレイヤーの要素ごとに、その要素を含むパケットが届いたかどうかを返す"""
+        num_elements = session.iot_result_summary.num_elements
+        # 送信順での位置ごとの受信状態を、元の位置に並べ直す
+        received = np.empty(num_elements, dtype=bool)
+        received[session.k] = session.received_sequences[np.arange(num_elements) // session.iot_result_summary.packet_length]
+        return received.reshape(session.num_layers, -1)[-1]
+
+    def do_inference(self, session):
+        #self.send_process_time("edge:do_inference:start:{}".format(session.filename)) # 実行時間短縮のためコメントアウト中
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
+        refinement_mask = None
+        if session.num_layers > 1:
+            refinement_mask = self.received_refinement_mask(session)
+            # リファインメントレイヤーが1つも届いていなければ、ベースレイヤーだけでの推論結果をそのまま使う
+            if not refinement_mask.any() and session.base_prediction is not None:
+                session.inference_completed = True
+                self.complete_inference(session, *session.base_prediction)
+                self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
+                return True
+
+        sub_model, model_input_shape, inter_test_decomp = self.prepare_inference_input(session, refinement_mask)
+        np.save("./data/sample_edge.npy", inter_test_decomp)
+
+        # 推論を行なったことを表すフラグを立てる
+        # 推論はInferenceSchedulerで他のセッションの推論対象とまとめて行い、結果はcomplete_inferenceで受け取る
+        session.inference_completed = True
+        self.inference_scheduler.submit(
+            (self.setting['model'], self.setting['layer'], model_input_shape),
+            inter_test_decomp,
+            sub_model,
+            lambda y_pred, inference_start_time, inference_end_time: self.complete_inference(
+                session, y_pred, inference_start_time, inference_end_time
+            ),
+            lambda error: self.fail_inference(session, error),
+        )
+        self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
+        return True
+
+    def prepare_inference_input(self, session, refinement_mask=None, iot_result_data=None):
+        """
+        受信バッファを逆量子化してサブモデルの入力の形にし、(サブモデル, 入力の形, 入力)を返す
+        refinement_maskはプログレッシブ符号化の場合に、リファインメントレイヤーの要素が届いたかどうか
+        iot_result_dataを渡した場合は、session.iot_result_dataの代わりに使う
+        """
+        if iot_result_data is None:
+            iot_result_data = session.iot_result_data
+        quantization_params = session.iot_result_summary.quantization_params
         self.logger.info("compression attribute [PCA_rate] = {}, [Qubit_type] = {}".format(self.setting['PCA_rate'], self.setting['Qubit_type']))
         if self.setting['Qubit_type'] != compressor.Compressor.QUBIT_NON_COMPRESSION:
             if self.setting['Qubit_type'] == compressor.Compressor.QUBIT_16BIT_INT:
-                self.iot_result_data = self.compressor.extract_nparray_16bit_int(self.iot_result_data)
+                iot_result_data = self.compressor.extract_nparray_16bit_int(iot_result_data)
             elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_8BIT_INT:
-                self.iot_result_data = self.compressor.extract_nparray_8bit_int(self.iot_result_data)
-            elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_NORMALIZE_16BIT_INT:
-                self.iot_result_data = self.compressor.extract_nparray_16bit_int(self.iot_result_data)
-            elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT:
-                self.iot_result_data = self.compressor.extract_nparray_16bit_int(self.iot_result_data)
-        else:
-            self.iot_result_data = self.iot_result_data
+                iot_result_data = self.compressor.extract_nparray_8bit_int(iot_result_data)
+            elif self.setting['Qubit_type'] in [
+                compressor.Compressor.QUBIT_NORMALIZE_16BIT_INT,
+                compressor.Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT,
+            ]:
+                # IoTデバイスが正規化に使った範囲で元に戻す(範囲が送られてこない場合は以前と同じ固定のスケールで戻す)
+                if quantization_params is not None:
+                    iot_result_data = self.compressor.extract_nparray_affine_int(iot_result_data, quantization_params)
+                else:
+                    iot_result_data = self.compressor.extract_nparray_16bit_int(iot_result_data)
+            elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_PROGRESSIVE_16BIT_INT:
+                iot_result_data = self.compressor.extract_nparray_progressive_16bit_int(
+                    iot_result_data.reshape(session.num_layers, -1), refinement_mask
+                )
+            elif compressor.Compressor.packed_bits(self.setting['Qubit_type']) is not None:
+                iot_result_data = self.compressor.extract_nparray_packed_int(iot_result_data, quantization_params)
+            elif compressor.Compressor.affine_bits(self.setting['Qubit_type']) is not None:
+                iot_result_data = self.compressor.extract_nparray_affine_int(iot_result_data, quantization_params)
 
         self.logger.info('print extracted qubit compression')
-        self.logger.info(self.iot_result_data)
+        self.logger.info(iot_result_data)
 
         if self.setting['PCA_rate'] != 0 and self.setting['PCA_rate'] != 1.0:
-            self.iot_result_data = self.compressor.extract_pca(self.iot_result_data, self.setting['model'], self.setting['layer'])
+            iot_result_data = self.compressor.extract_pca(iot_result_data, self.setting['model'], self.setting['layer'])
 
-        if self.setting['reload']:
-            self.model = inference.load_model(self.setting['model'])
-        else:
-            if not self.already_load_model:
-                self.model = inference.load_model(self.setting['model'])
-                self.already_load_model = True
-        
-        self.model_input_shape = (1,) + self.model.layers[self.setting['layer']].input_shape[
-            1:
-        ]
-        self.logger.info(f"Edge model input shape : {self.model_input_shape}")
+        # layer+1層目から最後の層までのサブモデルは作成済みのものを使い回す
+        model = inference.sub_model_cache.load_model(self.setting['model'], reload=self.setting['reload'])
+        sub_model = inference.sub_model_cache.get(self.setting['model'], self.setting['layer'] + 1, len(model.layers))
+
+        model_input_shape = (1,) + sub_model.input_shape[1:]
+        self.logger.info(f"Edge model input shape : {model_input_shape}")
 
         # NOTE: この処理を通さずにいると float64 として認識されてしまうため、float32に変更する処理を行う
-        inter_test_decomp = self.iot_result_data
+        inter_test_decomp = iot_result_data
         inter_test_decomp = inference.decompression_16_to_32(inter_test_decomp)
-        inter_test_decomp = inter_test_decomp.reshape(self.model_input_shape)
+        inter_test_decomp = inter_test_decomp.reshape(model_input_shape)
+        return sub_model, model_input_shape, inter_test_decomp
 
-        np.save("./data/sample_edge.npy", inter_test_decomp)
-        inference_start_time = time.time()
-        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge processing start time = {:.9f}".format(self.target_image_sequence_number, inference_start_time) + '\n', mode='a')
-        inference_on_edge = inference.InferenceStartEndLayer(
-            self.model, self.setting['layer'] + 1, len(self.model.layers), inter_test_decomp
-        )
-        y_pred = inference_on_edge.inference()
-        inference_end_time = time.time()
-        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge processing end time = {:.9f}".format(self.target_image_sequence_number, inference_end_time) + '\n', mode='a')
-        self.target_image_sequence_number += 1
-        self.edge_result_data = y_pred[0].argmax(axis=0)
-        self.logger.info(f"Pred : {self.edge_result_data}")
-        # self.send_process_time("edge:do_inference:end:{}".format(self.filename))
-
-        # 推論を行なったことを表すフラグを立てる
-        self.inference_completed = True
-
-        while self.send_edge_inference_result() is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
+    def complete_inference(self, session, y_pred, inference_start_time, inference_end_time):
+        """InferenceSchedulerでの推論結果をクラウドサーバーに送信する"""
+        self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge processing start time = {:.9f}".format(session.target_image_sequence_number, inference_start_time) + '\n', mode='a')
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge processing end time = {:.9f}".format(session.target_image_sequence_number, inference_end_time) + '\n', mode='a')
+        edge_result_data = y_pred[0].argmax(axis=0)
+        self.logger.info(f"Pred : {edge_result_data}")
+        # self.send_process_time("edge:do_inference:end:{}".format(session.filename))
+        return self.report_inference_result(session, edge_result_data)
+
+    def fail_inference(self, session, error):
+        """推論に失敗した推論対象も、失敗したことをクラウドサーバーに送信して結果を待たせないようにする"""
+        self.logger.error(f"inference failed : {session.filename}, {error}")
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Edge inference failed = {}".format(session.target_image_sequence_number, error) + '\n', mode='a')
+        return self.report_inference_result(session, EDGE_INFERENCE_FAILURE)
+
+    def report_inference_result(self, session, edge_result_data):
+        """推論結果をクラウドサーバーに送信する(失敗した場合はMAX_RETRY_COUNT回まで再送する)"""
+        while self.send_edge_inference_result(edge_result_data, session.filename) is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
             self.retry_count += 1
             self.logger.info(f"retry count is {self.retry_count}")
         if environment_settings.MAX_RETRY_COUNT <= self.retry_count:
             self.logger.error("max retry count is over...")
+            self.stop_receiving()
             return False
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return True
 
     def get_setting_from_cloud_server(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
         req = CommonRequest(command.EDGE_GET_SETTING)
         self.logger.debug(f"Request JSON : {req.get_json()}")
-        sock.send(req.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        response = self.connection_pool.request(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, req
+        )
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload : {response.payload}")
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
         self.setting = response
 
-    def send_received_result(self, mode):
+    def send_received_result(self, mode, session):
         """
         mode == "success"が指定された場合はIoTデバイスに十分なデータが届いたことを表すレスポンスを送信し、
         mode == "failure"が指定された場合はIoTデバイスに待機時間が超過したことを表すレスポンスを送信する
+        送信先はresult_summaryを送ってきたIoTデバイス
         """
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        self.latest_received_time = None
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT))
+        session.latest_received_time = None
 
         if mode == "success":
             req = EdgeServerReceivedResultRequest(
-                command.EDGE_SEND_RECEIVED_RESULT, code.SUFFICIENT_DATA_ARRIVAL
+                command.EDGE_SEND_RECEIVED_RESULT, code.SUFFICIENT_DATA_ARRIVAL, session_id=session.session_id
             )
         elif mode == "failure":
             req = EdgeServerReceivedResultRequest(
-                command.EDGE_SEND_RECEIVED_RESULT, code.TIME_EXCEEDED
+                command.EDGE_SEND_RECEIVED_RESULT, code.TIME_EXCEEDED, session_id=session.session_id
             )
         else:
             raise Exception(f"No mode matched {mode}")
 
         self.logger.debug(f"Request JSON : {req.get_json()}")
-        sock.send(req.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        try:
+            response = self.iot_connection_pool.request(
+                session.device_id, session.device_port, req
+            )
+        except ConnectionError as e:
+            # 通知が届かなくても、受信したデータで推論は続ける
+            self.logger.warning(f"failed to send {req.command} to {session.device_id}:{session.device_port} : {e}")
+            return
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload {response.payload}")
         assert response.payload == ""
 
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
-    def send_edge_inference_result(self):
+    def send_reception_report(self, session):
+        """これまでに受信したパケット数と最大のsequenceを、result_summaryを送ってきたIoTデバイスに送る"""
+        req = EdgeServerReceptionReportRequest(
+            command.EDGE_SEND_RECEPTION_REPORT,
+            session.session_id,
+            session.iot_result_data_received_packets,
+            session.highest_received_sequence,
+        )
+        self.report_executor.submit(self.send_request_to_iot_device, session, req)
+
+    def send_request_to_iot_device(self, session, req):
+        try:
+            response = self.iot_connection_pool.request(session.device_id, session.device_port, req)
+            self.logger.debug(f"Response JSON : {response.get_json()}")
+        except Exception as e:
+            # 受信報告は届かなくても受信処理は続けられる
+            self.logger.warning(f"failed to send {req.command} to {session.device_id}:{session.device_port} : {e}")
+
+    def send_edge_inference_result(self, edge_result_data, filename):
         """
         エッジサーバーでの推論結果をクラウドサーバーに送信する
         """
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
             req = EdgeServerInferenceResultRequest(
-                command.EDGE_SEND_INFERENCE_RESULT, str(self.edge_result_data), self.filename
+                command.EDGE_SEND_INFERENCE_RESULT, str(edge_result_data), filename
             )
             self.logger.debug(f"Request JSON : {req.get_json()}")
-            sock.send(req.get_json().encode("ascii"))
-
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-            response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+            response = self.connection_pool.request(
+                environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, req
+            )
             self.logger.debug(f"Response JSON : {response.get_json()}")
             self.logger.debug(f"Response payload : {response.payload}")
         except socket.error as se:
@@ -395,6 +749,7 @@ class EdgeServer:
         # TCPソケット、およびUDPソケットが待機状態にあることを表すフラグ
         # TCPソケットが終了コマンドを受け取るとFalseになる
         self.is_wait = True
+        self.inference_scheduler.start()
 
         # TCPソケットとUDPソケットの作成を並列処理するためのスレッド
         tcp_thread = threading.Thread(target=self.receive_tcp_requests)
@@ -411,10 +766,12 @@ class EdgeServer:
         udp_thread.join()
         self.logger.info("joined udp_thread")
 
-        # ソケットを閉じる
-        if self.tcp_socket:
-            self.tcp_socket.close()
-            self.logger.debug("close tcp socket")
+        # 待ち行列に残っている推論対象の推論結果を送信してからソケットを閉じる
+        self.inference_scheduler.stop()
+        self.inference_scheduler.log_statistics()
+        self.report_executor.shutdown(wait=True)
+        self.connection_pool.close()
+        self.iot_connection_pool.close()
         if self.udp_socket:
             self.udp_socket.close()
             self.logger.debug("close udp socket")
@@ -434,45 +791,10 @@ class EdgeServer:
         # TCPソケットの受信処理
 
         try:
-            # TCPソケットの作成
-            self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.tcp_socket.bind((environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT))
-            self.tcp_socket.listen(5)
-            while self.is_wait and self.retry_count < environment_settings.MAX_RETRY_COUNT:
-                self.logger.info('wait receive...')
-                conn, addr = self.tcp_socket.accept()
-                data = conn.recv(environment_settings.BUFFER_SIZE)
-                self.logger.debug(f"Request data : {data}")
-                self.logger.debug(f"Request addr : {addr}")
-                converted_req = CommonRequest.convert_from_json(data)
-                self.logger.debug(f"Request JSON : {converted_req.get_json()}")
-
-                # 終了コマンドは個別で処理する
-                if converted_req.command == command.EDGE_END:
-                    res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
-                    conn.sendall(res.get_json().encode())
-                    conn.close()
-                    self.is_wait = False
-                    break
-
-                if converted_req.command in self.command_list:
-                    if converted_req.command == command.IOT_SEND_RESULT_SUMMARY:
-                        converted_req = IotDeviceResultSummaryRequest.convert_from_json(
-                            data
-                        )
-                    elif converted_req.command == command.IOT_SEND_RESULT_DATA:
-                        converted_req = IotDeviceResultDataRequest.convert_from_json(
-                            data
-                        )
-                    elif converted_req.command == command.CLOUD_SEND_SETTING_TO_EDGE:
-                        converted_req = (
-                            CloudServerSettingRequest.convert_from_json(data)
-                        )
-                    res = self.command_list[converted_req.command](converted_req)
-                    conn.sendall(res.get_json().encode())
-
-            conn.close()
+            self.tcp_server = MessageServer(
+                environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT, self.handle_tcp_request, self.logger
+            )
+            self.tcp_server.serve_forever()
         except socket.timeout as st:
             self.has_network_error = True
             self.logger.exception(st)
@@ -481,9 +803,58 @@ class EdgeServer:
             self.has_network_error = True
             self.logger.exception(e)
             return False
+        finally:
+            self.is_wait = False
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return True
 
+    def handle_tcp_request(self, data):
+        """TCPで受信したリクエストを処理し、レスポンスのバイト列を返す"""
+        self.logger.debug(f"Request data : {data}")
+        # バイナリフレームはIOT_SEND_RESULT_DATAのみ
+        if is_binary_frame(data):
+            converted_req = IotDeviceResultDataRequest.convert_from_bytes(data)
+            self.count_received_data_size(converted_req, len(data))
+            res = self.command_list[converted_req.command](converted_req)
+            return res.get_json().encode()
+
+        converted_req = CommonRequest.convert_from_json(data)
+        self.logger.debug(f"Request JSON : {converted_req.get_json()}")
+
+        # 終了コマンドは個別で処理する
+        if converted_req.command == command.EDGE_END:
+            res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
+            self.stop_receiving()
+            return res.get_json().encode()
+
+        if converted_req.command not in self.command_list:
+            self.command_not_found(converted_req)
+
+        if converted_req.command == command.IOT_SEND_RESULT_SUMMARY:
+            converted_req = IotDeviceResultSummaryRequest.convert_from_json(
+                data
+            )
+        elif converted_req.command == command.IOT_SEND_RESULT_DATA:
+            converted_req = IotDeviceResultDataRequest.convert_from_json(
+                data
+            )
+            self.count_received_data_size(converted_req, len(data))
+        elif converted_req.command == command.CLOUD_SEND_SETTING_TO_EDGE:
+            converted_req = (
+                CloudServerSettingRequest.convert_from_json(data)
+            )
+        res = self.command_list[converted_req.command](converted_req)
+
+        if environment_settings.MAX_RETRY_COUNT <= self.retry_count:
+            self.stop_receiving()
+        return res.get_json().encode()
+
+    def stop_receiving(self):
+        """TCP・UDPの受信待機を終了する"""
+        self.is_wait = False
+        if self.tcp_server is not None:
+            self.tcp_server.stop()
+
     def receive_udp_requests(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         # UDPソケットの受信処理
@@ -500,25 +871,13 @@ class EdgeServer:
 
             while self.is_wait and self.has_network_error is False: # TCPソケット側が終了コマンドを受信していない間繰り返す
                 try:
-                    data, addr = self.udp_socket.recvfrom(environment_settings.BUFFER_SIZE)
+                    data, addr = self.udp_socket.recvfrom(environment_settings.UDP_BUFFER_SIZE)
                 except socket.timeout:
                     self.logger.debug(f"UDP timeout")
                     continue
 
-                self.logger.debug(f"UDP Request data : {data}")
                 self.logger.debug(f"UDP Request addr : {addr}")
-                converted_req = CommonRequest.convert_from_json(data)
-                self.logger.debug(f"UDP Request JSON : {converted_req.get_json()}") 
-
-                # 受信したconverted_reqの処理
-                if converted_req.command in self.command_list:
-                    # UDPで送信されてくる可能性があるコマンドはIOT_SEND_RESULT_DATAのみ
-                    if converted_req.command == command.IOT_SEND_RESULT_DATA:
-                        converted_req = IotDeviceResultDataRequest.convert_from_json(
-                            data
-                        )
-                    res = self.command_list[converted_req.command](converted_req)
-                    # UDPの場合はレスポンスを返さない
+                self.handle_udp_request(data)
         except socket.timeout as st:
             self.logger.exception(st)
             return False
@@ -528,23 +887,39 @@ class EdgeServer:
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return True
 
+    def handle_udp_request(self, data):
+        """UDPで受信したリクエストを処理する(UDPの場合はレスポンスを返さない)"""
+        self.logger.debug(f"UDP Request data : {data}")
+        if is_binary_frame(data):
+            converted_req = IotDeviceResultDataRequest.convert_from_bytes(data)
+            self.count_received_data_size(converted_req, len(data))
+            self.command_list[converted_req.command](converted_req)
+            return
+        converted_req = CommonRequest.convert_from_json(data)
+        self.logger.debug(f"UDP Request JSON : {converted_req.get_json()}")
+
+        # 受信したconverted_reqの処理
+        if converted_req.command in self.command_list:
+            # UDPで送信されてくる可能性があるコマンドはIOT_SEND_RESULT_DATAのみ
+            if converted_req.command == command.IOT_SEND_RESULT_DATA:
+                converted_req = IotDeviceResultDataRequest.convert_from_json(
+                    data
+                )
+                self.count_received_data_size(converted_req, len(data))
+            self.command_list[converted_req.command](converted_req)
+
     def send_process_time(self, process_name):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
-
         request = ProcessTimeRequest(
             command.EDGE_SEND_PROCESS_TIME,
             process_name,
             time.time()
         )
         self.logger.debug(f"ProcessTimeRequest : {request.get_json()}")
-        sock.send(request.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        self.logger.debug(f"Received data : {rcv_data}")
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        response = self.connection_pool.request(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, request
+        )
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload : {response.payload}")
         assert response.payload == ""
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import bisect
+import collections
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+
+from src.conf import environment_settings
+
+
+class InferenceRequest:
+    '''InferenceSchedulerの待ち行列に入れる1つの推論対象'''
+    def __init__(self, key, tensor, run_batch, callback, error_callback=None):
+        # keyが同じ推論対象は同じバッチで推論できる(モデル、分割するレイヤーなど)
+        self.key = key
+        self.tensor = tensor
+        self.run_batch = run_batch
+        self.callback = callback
+        # 推論に失敗した場合にerror_callback(例外)で知らせる(Noneの場合はログに残すだけ)
+        self.error_callback = error_callback
+        self.enqueued_time = time.monotonic()
+
+
+class InferenceScheduler:
+    '''
+    推論の準備ができた推論対象をまとめて1回のpredictで推論するスケジューラ
+    同じkeyの推論対象を、最大max_batch_size個、最初の推論対象が待ち行列に入ってから最大max_queue_delay_seconds秒まで待って集める
+    推論は専用のスレッドで行い、結果は推論対象ごとにcallback(prediction, 推論開始時刻, 推論終了時刻)で返す
+    callbackではクラウドサーバーへの送信などを行うので、推論のスレッドを止めないように別のスレッドで呼び出す
+    まとめた推論に失敗した場合は1つずつ推論し直し、それでも失敗した推論対象にはerror_callback(例外)で知らせる
+    '''
+    # 待ち時間のヒストグラムの区切り(ミリ秒)
+    QUEUE_DELAY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+    def __init__(
+        self,
+        logger,
+        max_batch_size=environment_settings.EDGE_INFERENCE_MAX_BATCH_SIZE,
+        max_queue_delay_seconds=environment_settings.EDGE_INFERENCE_MAX_QUEUE_DELAY_SECONDS,
+        callback_workers=environment_settings.EDGE_INFERENCE_CALLBACK_WORKERS,
+    ):
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay_seconds = max_queue_delay_seconds
+        self.callback_workers = callback_workers
+        self.callback_executor = None
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.is_running = False
+        self.thread = None
+        # バッチサイズ -> 回数
+        self.batch_size_histogram = collections.Counter()
+        # 待ち時間のバケットの上限(ミリ秒、最後はNone) -> 推論対象の数
+        self.queue_delay_histogram = collections.Counter()
+
+    def start(self):
+        self.is_running = True
+        self.callback_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.callback_workers)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """待ち行列に残っている推論対象を推論し、結果を返し終えてからスレッドを終了する"""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.callback_executor is not None:
+            self.callback_executor.shutdown(wait=True)
+            self.callback_executor = None
+
+    def submit(self, key, tensor, run_batch, callback, error_callback=None):
+        """
+        推論対象を待ち行列に入れる
+        tensorは先頭の次元がバッチの次元(1, ...)、run_batchはまとめたtensorを受け取って推論結果を返す関数
+        """
+        with self.condition:
+            self.pending.append(InferenceRequest(key, tensor, run_batch, callback, error_callback))
+            self.condition.notify_all()
+
+    def next_batch(self):
+        """次に推論するバッチを返す(終了する場合はNone)"""
+        with self.condition:
+            while not self.pending and self.is_running:
+                self.condition.wait()
+            if not self.pending:
+                return None
+
+            first = self.pending[0]
+            deadline = first.enqueued_time + self.max_queue_delay_seconds
+            while True:
+                batch = [request for request in self.pending if request.key == first.key][:self.max_batch_size]
+                remaining_seconds = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining_seconds <= 0 or not self.is_running:
+                    break
+                self.condition.wait(remaining_seconds)
+
+            for request in batch:
+                self.pending.remove(request)
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            self.process_batch(batch)
+
+    def process_batch(self, batch):
+        now = time.monotonic()
+        self.batch_size_histogram[len(batch)] += 1
+        for request in batch:
+            queue_delay_ms = (now - request.enqueued_time) * 1000.0
+            index = bisect.bisect_left(self.QUEUE_DELAY_BUCKETS_MS, queue_delay_ms)
+            bucket = self.QUEUE_DELAY_BUCKETS_MS[index] if index < len(self.QUEUE_DELAY_BUCKETS_MS) else None
+            self.queue_delay_histogram[bucket] += 1
+        self.run_requests(batch)
+
+    def run_requests(self, batch):
+        """batchをまとめて推論し、推論対象ごとに結果を返す"""
+        inference_start_time = time.time()
+        try:
+            predictions = batch[0].run_batch(np.concatenate([request.tensor for request in batch]))
+        except Exception as e:
+            self.logger.exception(e)
+            if len(batch) > 1:
+                # 1つの推論対象が原因でバッチ全体が失敗した場合も、他の推論対象の結果は返せるように1つずつ推論し直す
+                self.logger.warning(f"batch inference failed, retry {len(batch)} requests one by one")
+                for request in batch:
+                    self.run_requests([request])
+            else:
+                self.notify_failure(batch[0], e)
+            return
+        inference_end_time = time.time()
+        self.logger.info(f"batch inference : batch size = {len(batch)}, time = {inference_end_time - inference_start_time:.6f} s")
+
+        # 推論結果を推論対象ごとに返す
+        for i, request in enumerate(batch):
+            self.callback_executor.submit(self.run_callback, request.callback, predictions[i : i + 1], inference_start_time, inference_end_time)
+
+    def notify_failure(self, request, error):
+        if request.error_callback is None:
+            return
+        self.callback_executor.submit(self.run_callback, request.error_callback, error)
+
+    def run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def log_statistics(self):
+        self.logger.info(f"batch size histogram : {dict(sorted(self.batch_size_histogram.items()))}")
+        queue_delay_histogram = {}
+        for bucket in self.QUEUE_DELAY_BUCKETS_MS + [None]:
+            if bucket in self.queue_delay_histogram:
+                label = f"<= {bucket} ms" if bucket is not None else f"> {self.QUEUE_DELAY_BUCKETS_MS[-1]} ms"
+                queue_delay_histogram[label] = self.queue_delay_histogram[bucket]
+        self.logger.info(f"queue delay histogram : {queue_delay_histogram}")
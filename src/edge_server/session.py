@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import math
+import threading
+import time
+
+import numpy as np
+
+
+class ReceptionSession:
+    '''
+    1台のIoTデバイスから届く1つの推論対象の受信状態
+    IOT_SEND_RESULT_SUMMARYを受信した時に作成し、result_dataのsession_idで参照する
+    '''
+    def __init__(self, iot_result_summary, target_image_sequence_number):
+        self.iot_result_summary = iot_result_summary
+        self.session_id = iot_result_summary.session_id
+        self.device_id = iot_result_summary.device_id
+        self.device_port = iot_result_summary.device_port
+        self.filename = iot_result_summary.filename
+        self.target_image_sequence_number = target_image_sequence_number
+
+        # 受信したresult_dataを元の順番に並べ直したもの
+        self.iot_result_data = None
+        # ランダム順に分割されたパケットの要素を元の位置に戻すためのインデックス
+        self.k = None
+        self.iot_result_data_received_packets = 0
+        # 受信したパケットの最大のsequence(受信報告に使う)
+        self.highest_received_sequence = -1
+        # sequenceごとに受信済みかどうか(再送で重複して届いたパケットを数えないため、再送要求に使う)
+        self.received_sequences = np.zeros(iot_result_summary.num_packets, dtype=bool)
+        # FECのパリティパケット1つあたりのデータパケット数(0の場合はFECを使わない)と、受信したパリティ(グループ番号 -> バイト列)
+        self.fec_group_size = iot_result_summary.fec_group_size
+        self.parity_packets = {}
+        self.recovered_packets = 0
+        # 再送要求を送った回数と最後に送った時刻
+        self.retransmission_rounds = 0
+        self.latest_retransmission_request_time = None
+        self.iot_result_data_received_elements = 0
+        self.total_received_data_size = 0
+
+        # プログレッシブ符号化のレイヤー数と、ベースレイヤーの要素を含むパケットの数
+        self.num_layers = iot_result_summary.num_layers
+        self.base_layer_packets = math.ceil(
+            iot_result_summary.num_elements // self.num_layers / iot_result_summary.packet_length
+        )
+        self.base_layer_completed = False
+        # ベースレイヤーが揃った時の受信バッファのコピー(ロックを外してからベースレイヤーだけで推論する、推論を始めたらNoneにする)
+        self.base_layer_input = None
+        # ベースレイヤーだけで推論した結果(y_pred, 推論開始時刻, 推論終了時刻)
+        self.base_prediction = None
+
+        # 推論を一回だけ行うためのフラグ
+        self.inference_completed = False
+        # 受信を終了した時刻と、ロックを外してからIoTデバイスへの通知と推論を行う必要があるかどうか
+        self.reception_end_time = None
+        self.completion_pending = False
+        # data_waiting_timeの経過を測定するための最後の受信時刻(十分なデータが届いたらNoneにする)
+        self.latest_received_time = time.time()
+
+        # TCPとUDPの受信スレッド、タイマーから同時に更新されないようにする
+        # 推論中にsend_received_resultなどを呼ぶため、同じスレッドからは再取得できるようにしておく
+        self.lock = threading.RLock()
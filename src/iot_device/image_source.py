@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+from PIL import Image
+
+from src.conf import environment_settings
+from src.lib.array_cache import ArrayLruCache
+from src.lib.dataset_store import DatasetStore
+
+
+class LoadedImage:
+    '''ImageSourceが返す、デコード済みの1枚の画像'''
+    def __init__(self, filename, array, path=None):
+        # 画像のファイル名(拡張子除く)
+        self.filename = filename
+        self.array = array
+        # 画像ファイルのパス(.npyのスタックから読み込んだ場合はNone)
+        self.path = path
+
+
+def decode_image(path):
+    with Image.open(path) as image:
+        return np.array(image)
+
+
+# 同じ画像を繰り返し推論する計測のために、プロセス内でデコード済みの画像を保持する
+decoded_image_cache = ArrayLruCache(environment_settings.IOT_IMAGE_CACHE_MAX_BYTES)
+
+
+class ImageFileSource:
+    '''
+    画像ファイルのリストを順にデコードして返す
+    次のprefetch_count枚のデコードをスレッドプールで先に進めておき、デコード済みの画像はcacheに保持する
+    '''
+    def __init__(self, paths, prefetch_count=environment_settings.IOT_IMAGE_PREFETCH_COUNT, cache=decoded_image_cache):
+        self.paths = paths
+        self.prefetch_count = prefetch_count
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self, path):
+        # ファイルが書き換えられた場合に古い画像を返さないように、更新時刻もキーに含める
+        key = (path, os.stat(path).st_mtime_ns)
+        array = self.cache.get_or_load(key, lambda: decode_image(path))
+        filename = os.path.splitext(os.path.basename(path))[0]
+        return LoadedImage(filename, array, path)
+
+    def __iter__(self):
+        if self.prefetch_count <= 0:
+            for path in self.paths:
+                yield self.load(path)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch_count) as executor:
+            futures = collections.deque()
+            for path in self.paths:
+                futures.append(executor.submit(self.load, path))
+                if len(futures) > self.prefetch_count:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+
+class NpyStackSource:
+    '''
+    データセット全体を(N, H, W)の1つの.npyにまとめたものを、メモリマップで読み込んで1枚ずつ返す
+    小さな画像ファイルを1枚ずつ開いてデコードする必要がなく、読み込んだ部分だけがメモリに載る
+    ファイル名はインデックスを5桁にしたもの(MNISTの画像ファイルの名前と同じ)
+    '''
+    def __init__(self, path, start=0, stop=None):
+        self.path = path
+        self.start = start
+        dataset = DatasetStore.for_images_path(path)
+        if dataset is not None:
+            store, split = dataset
+            self.images, _ = store.range(split, start, stop)
+        else:
+            # DatasetStoreの形式ではない(ラベルがない).npyは、画像だけを読み込む
+            self.images = np.load(path, mmap_mode='r')[start:stop]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        for index, image in enumerate(self.images, self.start):
+            yield LoadedImage(str(index).zfill(5), image)
+
+
+def open_image_source(path):
+    """推論対象のパス(ディレクトリまたは.npy)からImageSourceを作る"""
+    if os.path.isdir(path):
+        return ImageFileSource([os.path.join(path, name) for name in sorted(os.listdir(path))])
+    if path.endswith(".npy"):
+        return NpyStackSource(path)
+    return ImageFileSource([path], prefetch_count=0)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import io
+import uuid
+
+from PIL import Image
+
+
+class InferenceTarget:
+    '''
+    IoTデバイスで処理する1つの推論対象(画像)の状態
+    パイプラインでは複数の推論対象を同時に処理するため、推論対象ごとの状態はIotDeviceではなくここに持つ
+    '''
+    def __init__(self, image, target_image_sequence_number):
+        # 画像ファイルのパス(.npyのスタックから読み込んだ場合はNone)
+        self.process_target_image_file = image.path
+        # 画像のファイル名(拡張子除く)
+        self.filename = image.filename
+        self.target_image_sequence_number = target_image_sequence_number
+        # エッジサーバーが推論対象ごとに受信状態を分けられるように、推論対象ごとに異なるIDを付ける
+        self.session_id = str(uuid.uuid4())
+
+        # 画像を読み込んだnp.ndarray
+        self.process_target = image.array
+        # CNNの前半で処理した中間層出力
+        self.inter_test = None
+        # 圧縮した中間層出力(送信するデータ)
+        self.result_data = None
+        # エッジサーバーで逆量子化するためのパラメータ(Compressorが返したもの、不要な場合はNone)
+        self.quantization_params = None
+        # split_modeがimportanceの場合の、量子化する前の中間層出力から求めたチャンネルの送信順
+        self.channel_order = None
+
+        # self.pの各要素が、各パケットのペイロードになる
+        self.p = []
+        self.packetizer = None
+        self.k = None
+        self.packet_length = None
+        self.num_elements = None
+        self.num_packets = None
+
+    def image_bytes(self):
+        """画像ファイルのバイト列を返す(ファイルがない場合はPNGにエンコードする)"""
+        if self.process_target_image_file is not None:
+            with open(self.process_target_image_file, "rb") as f:
+                return f.read()
+        buffer = io.BytesIO()
+        Image.fromarray(self.process_target).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def packets(self):
+        """送信するパケットの(sequence, ペイロード)を順に返すジェネレータ"""
+        if self.packetizer is None or len(self.p) == self.num_packets:
+            yield from enumerate(self.p)
+            return
+        # ペイロードは送信時にself.packetizerから取り出しながら追加する
+        for sequence, payload in self.packetizer.packets():
+            if sequence == len(self.p):
+                self.p.append(payload)
+            yield sequence, payload
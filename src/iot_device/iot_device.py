@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 # -*- Coding: utf-8 -*-
-import base64
 import json
 import math
 from operator import ne
 import os
+import queue
 import socket
 import sys
 import threading
@@ -21,34 +21,54 @@ from tensorflow.keras.datasets import mnist
 
 from src.conf import environment_settings
 from src.lib import code, command, inference, save_result
+from src.lib.connection import ConnectionPool, MessageServer
+from src.lib.dataset_store import DatasetStore
 from src.lib.logger import create_logger
 from src.lib.model.request import (
     CommonRequest,
     EdgeServerReceivedResultRequest,
+    EdgeServerReceptionReportRequest,
     IotDeviceResultDataRequest,
     IotDeviceResultSummaryRequest,
     CloudServerSettingRequest,
-    ProcessTimeRequest
+    ProcessTimeRequest,
+    WIRE_FORMAT_BINARY,
+    decode_sequence_bitmap
 )
 from src.lib.model.response import CommonResponse
-from src.lib import compressor
+from src.lib import compressor, fec
+from src.lib.entropy_coder import EntropyCoder
+from src.lib.packetizer import TensorPacketizer, channel_order_by_energy
+from src.lib.sparse_codec import encode_sparse_payload
+from src.lib.pacing import PacingController, TokenBucket
+from src.lib.pipeline import Pipeline, PipelineStage, batched
+from src.iot_device.image_source import open_image_source
+from src.iot_device.inference_target import InferenceTarget
 from src.lib.tc import Tc
 
-BUFFER_NPYFILE = os.path.join(os.path.dirname(__file__), "buffer.npy")
-
 class IotDevice:
     def __init__(self) -> None:
         self.command_list = {
             command.EDGE_SEND_RECEIVED_RESULT: self.process_send_received_result,
             command.CLOUD_SEND_SETTING_TO_IOT: self.process_cloud_send_setting,
+            command.EDGE_SEND_RECEPTION_REPORT: self.process_send_reception_report,
         }
         self.logger = create_logger(__name__)
         self.terminate_sending_result_data_flag = True
         self.compressor = compressor.Compressor()
+        # エッジサーバー・クラウドサーバーとの接続は張りっぱなしにして使い回す
+        self.connection_pool = ConnectionPool(self.logger)
+        self.server = None
 
-        # 一回だけ推論モデルのロードを行うためのフラグ
-        self.already_load_model = False
         self.retry_count = 0
+        self.session_id = None
+        # UDPでの送信レートの調整(設定を受け取るたびに作り直す)
+        self.token_bucket = None
+        self.pacing_controller = None
+        # 送信中の推論対象に対する最後の受信報告(受信時刻, 受信報告)
+        self.reception_report = None
+        # エッジサーバーからの再送要求(届いていないパケットのビットマップ、送信を終える場合はNone)
+        self.retransmission_requests = queue.Queue()
 
     def main(self):
         self.download_and_save_mnist_images()
@@ -58,30 +78,60 @@ class IotDevice:
     def set_dummy_result_data(self):
         self.result_data = np.random.randint(0, 255, (32, 32, 128))
 
-    def do_inference(self):
-        #self.send_process_time("iot:do_inference:start:{}".format(os.path.splitext(os.path.basename(self.process_target_image_file))[0])) # 実行時間短縮のためコメントアウト中
-        """X_testをCNNの前半で処理し圧縮したものをself.result_dataに入れる"""
-
+    def do_inference(self, target):
+        """X_testをCNNの前半で処理し圧縮したものをtarget.result_dataに入れる"""
+        self.infer_head(target)
+        self.compress_result(target)
+
+    def infer_head(self, target):
+        #self.send_process_time("iot:do_inference:start:{}".format(target.filename)) # 実行時間短縮のためコメントアウト中
+        """X_testをCNNの前半で処理したものをtarget.inter_testに入れる"""
+        self.infer_head_batch([target])
+
+    def infer_head_batch(self, targets):
+        """
+        複数の推論対象をまとめて1回でCNNの前半で処理し、それぞれのtarget.inter_testに入れる
+        condition.txtには推論対象ごとに、まとめて処理した時の開始・終了時刻を書き込む
+        """
         if self.setting['reload']:
-            self.model = inference.load_model(self.setting['model'])
-        else:
-            if not self.already_load_model:
-                self.model = inference.load_model(self.setting['model'])
-                self.already_load_model = True
+            inference.sub_model_cache.load_model(self.setting['model'], reload=True)
+        # 1層目からlayer層目までのサブモデルは作成済みのものを使い回す
+        sub_model = inference.sub_model_cache.get(self.setting['model'], 1, self.setting['layer'])
 
+        #中間層出力を得る(画像の入力サイズを(28, 28)から(28, 28, 1)にする必要がある)
+        X_test = np.stack([np.expand_dims(target.process_target, axis=-1) for target in targets])
         inference_start_time = time.time()
-        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, IoT processing start time = {:.9f}".format(self.target_image_sequence_number, inference_start_time) + '\n', mode='a')
-        inference_on_IoTdevice = inference.InferenceStartEndLayer(self.model, 1, self.setting['layer'], np.expand_dims(self.process_target, axis=-1)) # 画像の入力サイズを(28, 28)から(28, 28, 1)にする必要がある
-        inter_test  = inference_on_IoTdevice.inference()    #中間層出力を得る
+        inter_test = sub_model(X_test)
         inference_end_time = time.time()
-        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, IoT processing end time = {:.9f}".format(self.target_image_sequence_number, inference_end_time) + '\n', mode='a')
+
+        for i, target in enumerate(targets):
+            # 1枚ずつ処理した場合と同じ(1, ...)の形にする
+            target.inter_test = inter_test[i : i + 1]
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, IoT processing start time = {:.9f}".format(target.target_image_sequence_number, inference_start_time) + '\n', mode='a')
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, IoT processing end time = {:.9f}".format(target.target_image_sequence_number, inference_end_time) + '\n', mode='a')
+
+    def compress_result(self, target):
+        """target.inter_testを圧縮したものをtarget.result_dataに入れる"""
+        inter_test = target.inter_test
 
         # NOTE: 2022/3版では16bit float圧縮を行っていたが、圧縮は選択式にしたため、コメントアウト
         # inter_test_comp = inference.compression_32_to_16(inter_test)    #圧縮
         inter_test_comp = None
+        # キャリブレーションした範囲があれば、推論対象ごとに統計量を求めずに量子化する
+        calibration = None
+        if environment_settings.IOT_USE_CALIBRATION_TABLE:
+            calibration = self.compressor.load_calibration(self.setting['model'], self.setting['layer'])
 
         if self.setting['PCA_rate'] != 0 and self.setting['PCA_rate'] != 1.0:
             inter_test = self.compressor.compress_pca(inter_test, self.setting['PCA_rate'], self.setting['model'], self.setting['layer'])
+            # PCA圧縮後の値の範囲は中間層出力とは異なる
+            calibration = None
+
+        if self.setting['split_mode'] == TensorPacketizer.SPLIT_MODE_IMPORTANCE:
+            # 量子化した値(プログレッシブ符号化のリファインメントレイヤーや、4bit・2bitで詰めたバイト列)ではなく、
+            # 量子化する前の値からチャンネルの重要度を求める
+            bits = compressor.Compressor.packed_bits(self.setting['Qubit_type'])
+            target.channel_order = channel_order_by_energy(inter_test, 8 // bits if bits is not None else 1)
 
         self.logger.info("compression attribute [PCA_rate] = {}, [Qubit_type] = {}".format(self.setting['PCA_rate'], self.setting['Qubit_type']))
         if self.setting['Qubit_type'] != compressor.Compressor.QUBIT_NON_COMPRESSION:
@@ -90,45 +140,64 @@ class IotDevice:
             elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_8BIT_INT:
                 inter_test_comp = self.compressor.compress_nparray_8bit_int(inter_test)
             elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_NORMALIZE_16BIT_INT:
-                inter_test_comp = self.compressor.compress_nparray_normalize_16bit_int(inter_test)
+                # 正規化に使った範囲はエッジサーバーでの逆量子化に必要なので、サマリーで送る
+                target.quantization_params = {}
+                inter_test_comp = self.compressor.compress_nparray_normalize_16bit_int(inter_test, params=target.quantization_params, calibration=calibration)
             elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT:
-                inter_test_comp = self.compressor.compress_nparray_normalize2sigma_16bit_int(inter_test)
+                target.quantization_params = {}
+                inter_test_comp = self.compressor.compress_nparray_normalize2sigma_16bit_int(inter_test, params=target.quantization_params, calibration=calibration)
+            elif self.setting['Qubit_type'] == compressor.Compressor.QUBIT_PROGRESSIVE_16BIT_INT:
+                inter_test_comp = self.compressor.compress_nparray_progressive_16bit_int(inter_test)
+            elif compressor.Compressor.packed_bits(self.setting['Qubit_type']) is not None:
+                inter_test_comp, target.quantization_params = self.compressor.compress_nparray_packed_int(
+                    inter_test,
+                    compressor.Compressor.packed_bits(self.setting['Qubit_type']),
+                    environment_settings.IOT_QUANTIZATION_PER_CHANNEL,
+                    environment_settings.IOT_QUANTIZATION_SYMMETRIC,
+                    calibration,
+                    environment_settings.IOT_CALIBRATION_CLIP_PERCENTILE,
+                )
+            elif compressor.Compressor.affine_bits(self.setting['Qubit_type']) is not None:
+                inter_test_comp, target.quantization_params = self.compressor.compress_nparray_affine_int(
+                    inter_test,
+                    compressor.Compressor.affine_bits(self.setting['Qubit_type']),
+                    environment_settings.IOT_QUANTIZATION_PER_CHANNEL,
+                    environment_settings.IOT_QUANTIZATION_SYMMETRIC,
+                    calibration,
+                    environment_settings.IOT_CALIBRATION_CLIP_PERCENTILE,
+                )
         else:
             inter_test_comp = inter_test
 
-        self.result_data = inter_test_comp
-        np.save("./data/sample_iot.npy", self.result_data)
-        save_result.save_inter_or_image(self.setting['current_time_str'], "middle_layers", self.target_image_sequence_number, self.result_data, is_inter=True)
+        target.result_data = inter_test_comp
+        target.inter_test = None
+        np.save("./data/sample_iot.npy", target.result_data)
+        save_result.save_inter_or_image(self.setting['current_time_str'], "middle_layers", target.target_image_sequence_number, target.result_data, is_inter=True)
 
-        #self.send_process_time("iot:do_inference:end:{}".format(os.path.splitext(os.path.basename(self.process_target_image_file))[0])) # 実行時間短縮のためコメントアウト中
+        #self.send_process_time("iot:do_inference:end:{}".format(target.filename)) # 実行時間短縮のためコメントアウト中
 
     def download_and_save_mnist_images(self, extensions=["png", "jpg"]):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        if os.path.exists("./data/mnist"):
+        # 画像とラベルは分割ごとに1つの.npyにまとめて保存し、推論時はメモリマップで読み込む
+        # (ディレクトリモードでは./data/mnist/X_test.npyなどをimg_pathに指定する)
+        store = DatasetStore(environment_settings.IOT_MNIST_DATA_PATH)
+        if store.exists():
             self.logger.info(f"MNIST data already exists.")
             return
 
         (X_train, y_train), (X_test, y_test) = mnist.load_data()
-
-        for extension in extensions:
-            os.makedirs(f"./data/mnist/X_train/{extension}", exist_ok=True)
-            os.makedirs(f"./data/mnist/X_test/{extension}", exist_ok=True)
-
-        for i, X in enumerate([X_train, X_test]):
-            for j, numpy_image in enumerate(X):
+        store.save("train", X_train, y_train)
+        store.save("test", X_test, y_test)
+
+        # GUIで1枚ずつ選択できるように、先頭のIOT_MNIST_SAMPLE_IMAGE_COUNT枚は画像ファイルとしても保存する
+        for split, X in [("train", X_train), ("test", X_test)]:
+            for extension in extensions:
+                os.makedirs(os.path.join(environment_settings.IOT_MNIST_DATA_PATH, f"X_{split}", extension), exist_ok=True)
+            for j, numpy_image in enumerate(X[:environment_settings.IOT_MNIST_SAMPLE_IMAGE_COUNT]):
                 pil_image = Image.fromarray(numpy_image)
-
                 for extension in extensions:
-                    if i == 0:
-                        image_filename = f"./data/mnist/X_train/{extension}/{str(j).zfill(5)}.{extension}"
-                    elif i == 1:
-                        image_filename = f"./data/mnist/X_test/{extension}/{str(j).zfill(5)}.{extension}"
+                    image_filename = os.path.join(environment_settings.IOT_MNIST_DATA_PATH, f"X_{split}", extension, f"{str(j).zfill(5)}.{extension}")
                     pil_image.save(image_filename)  # , quality=95)
-                    if j > 10:
-                        break
-
-        np.save("./data/mnist/y_train.npy", np.array(y_train))
-        np.save("./data/mnist/y_test.npy", np.array(y_test))
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
     def process_cloud_send_setting(self, request):
@@ -138,6 +207,7 @@ class IotDevice:
 
         self.inference_target_path = self.setting['img_path']
         self.target_image_sequence_number = 0 #cloudから設定を受け取るたびにリセットする推論対象のシーケンス番号
+        self.create_pacing()
         payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
         response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
         Tc.execute_tc(
@@ -151,36 +221,40 @@ class IotDevice:
         return response
 
     def process_do_inference(self):
-        # ディレクトリモード
-        if os.path.isdir(self.inference_target_path):
+        # 最初の推論対象の処理時間にサブモデルの作成とトレースの時間が含まれないようにする
+        if self.setting['layer'] != 0 and not self.setting['reload']:
+            inference.sub_model_cache.warm_up(self.setting['model'], 1, self.setting['layer'])
+            if environment_settings.IOT_HEAD_INFERENCE_BATCH_SIZE > 1:
+                inference.sub_model_cache.warm_up(self.setting['model'], 1, self.setting['layer'], environment_settings.IOT_HEAD_INFERENCE_BATCH_SIZE)
+
+        # ディレクトリモード(画像をまとめた.npyも同様に扱う)
+        if os.path.isdir(self.inference_target_path) or self.inference_target_path.endswith(".npy"):
             self.logger.debug('DIRECTORY MODE')
-            process_target_image_dir = self.inference_target_path
-            img_files = sorted(os.listdir(process_target_image_dir))
-            for img_file in img_files:
-                self.process_target_image_file = os.path.join(process_target_image_dir, img_file)
-                save_result.save_inter_or_image(self.setting['current_time_str'], "input/images", self.target_image_sequence_number, self.process_target_image_file)
-                process_target_image = Image.open(self.process_target_image_file)
-                self.process_target = np.array(process_target_image)
-
-                self.inference_and_send_result()
-                self.target_image_sequence_number += 1
+            # 次の画像のデコードを先に進めながら、1枚ずつ読み込む
+            image_source = open_image_source(self.inference_target_path)
+            # IOT_HEAD_INFERENCE_BATCH_SIZE枚ずつまとめてCNNの前半で処理する
+            batches = batched(image_source, environment_settings.IOT_HEAD_INFERENCE_BATCH_SIZE)
+            if environment_settings.IOT_USE_PIPELINE:
+                self.process_directory_with_pipeline(batches)
+            else:
+                for batch in batches:
+                    targets = self.load_targets(batch)
+                    self.inference_and_send_results(targets)
         # 通常モード
         else:    
             self.logger.debug('SINGLE MODE')
-            self.process_target_image_file = self.inference_target_path
+            process_target_image_file = self.inference_target_path
 
             destination_dir = environment_settings.IOT_VISUALIZE_TARGET_PATH
             if os.path.exists(destination_dir):
                 shutil.rmtree(destination_dir)
             os.makedirs(destination_dir)
             # 中間層可視化用に解析対象画像をpngに変換
-            self.convert_jpg_to_png(destination_dir)
+            self.convert_jpg_to_png(process_target_image_file, destination_dir)
 
-            save_result.save_inter_or_image(self.setting['current_time_str'], "input/images", self.target_image_sequence_number, self.process_target_image_file)
-            process_target_image = Image.open(self.process_target_image_file)
-            self.process_target = np.array(process_target_image)
-            self.inference_and_send_result()
-            self.target_image_sequence_number += 1
+            (image,) = open_image_source(process_target_image_file)
+            target = self.load_target(image)
+            self.inference_and_send_result(target)
 
         Tc.reset_tc(
             environment_settings.IOT_NETWORK_DEVICE,
@@ -191,25 +265,91 @@ class IotDevice:
         )
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
-    def inference_and_send_result(self):
-        if self.setting['layer'] == 0:
-            self.split_image_into_packets()
+    def load_target(self, image):
+        """デコード済みの画像にシーケンス番号を割り当てた推論対象を返す"""
+        target = InferenceTarget(image, self.target_image_sequence_number)
+        self.target_image_sequence_number += 1
+        if target.process_target_image_file is not None:
+            save_result.save_inter_or_image(self.setting['current_time_str'], "input/images", target.target_image_sequence_number, target.process_target_image_file)
         else:
+            save_result.save_inter_or_image(self.setting['current_time_str'], "input/images", target.target_image_sequence_number, target.process_target, is_inter=True)
+        return target
+
+    def load_targets(self, images):
+        return [self.load_target(image) for image in images]
+
+    def process_directory_with_pipeline(self, batches):
+        """
+        画像の読み込み、CNNの前半での推論、圧縮・パケット分割、送信をそれぞれ別のスレッドで行い、
+        ある画像の送信中に次の画像の推論を進める
+        パイプラインにはIOT_HEAD_INFERENCE_BATCH_SIZE枚ごとの推論対象のリストを流す
+        """
+        self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
+
+        def infer(targets):
+            if self.setting['layer'] != 0:
+                self.infer_head_batch(targets)
+            return targets
+
+        def packetize(targets):
+            for target in targets:
+                self.split_into_packets(target)
+            return targets
+
+        def send(targets):
+            for target in targets:
+                self.send_target(target)
+
+        pipeline = Pipeline(
+            [
+                PipelineStage("load", self.load_targets),
+                PipelineStage("inference", infer),
+                PipelineStage("packetize", packetize),
+                PipelineStage("send", send),
+            ],
+            environment_settings.IOT_PIPELINE_QUEUE_DEPTH,
+            self.logger,
+        )
+        pipeline.run(batches)
+
+        for line in pipeline.statistics():
+            self.logger.info(line)
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", line + '\n', mode='a')
+        self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
+
+    def inference_and_send_result(self, target):
+        if self.setting['layer'] != 0:
             # self.set_dummy_result_data()
-            self.do_inference()
-            self.split_tensor_into_packets()
+            self.infer_head(target)
+        self.split_into_packets(target)
+        return self.send_target(target)
+
+    def inference_and_send_results(self, targets):
+        if self.setting['layer'] != 0:
+            self.infer_head_batch(targets)
+        for target in targets:
+            self.split_into_packets(target)
+            self.send_target(target)
+
+    def split_into_packets(self, target):
+        if self.setting['layer'] == 0:
+            self.split_image_into_packets(target)
+        else:
+            self.compress_result(target)
+            self.split_tensor_into_packets(target)
+
+    def send_target(self, target):
+        # self.send_result_summary(target)
+        # self.send_result_data(target)
 
-        # self.send_result_summary()
-        # self.send_result_data()
-        
-        while self.send_result_summary() is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
+        while self.send_result_summary(target) is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
             self.retry_count += 1
             self.logger.info(f"retry count is {self.retry_count}")
         if environment_settings.MAX_RETRY_COUNT <= self.retry_count:
             self.logger.error("max retry count is over...")
             return False
 
-        while self.send_result_data() is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
+        while self.send_result_data(target) is False and self.retry_count < environment_settings.MAX_RETRY_COUNT:
             self.retry_count += 1
             self.logger.info(f"retry count is {self.retry_count}")
         if environment_settings.MAX_RETRY_COUNT <= self.retry_count:
@@ -219,14 +359,11 @@ class IotDevice:
 
     def get_setting_from_cloud_server(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
         req = CommonRequest(command.IOT_GET_SETTING)
         self.logger.debug(f"Request JSON : {req.get_json()}")
-        sock.send(req.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        response = self.connection_pool.request(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, req
+        )
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload : {response.payload}")
 
@@ -235,14 +372,11 @@ class IotDevice:
 
     def get_inference_target_from_cloud_server(self):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
         req = CommonRequest(command.IOT_GET_INFERENCE_TARGET)
         self.logger.debug(f"Request JSON : {req.get_json()}")
-        sock.send(req.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        response = self.connection_pool.request(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, req
+        )
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload : {response.payload}")
 
@@ -253,89 +387,70 @@ class IotDevice:
         self.process_target = np.array(process_target_image)
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
-    def split_image_into_packets(self):
+    def split_image_into_packets(self, target):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        with open(
-            self.process_target_image_file,
-            "rb",
-        ) as f:
-            binary_str = f.read()
-            empty_str_size = sys.getsizeof(b"")
-            each_str_len = self.setting['split_size'] - empty_str_size
-
-            self.p = []
-            for i in range(math.ceil(len(binary_str) / each_str_len)):
-                self.p.append(
-                    base64.b64encode(
-                        binary_str[i * each_str_len : (i + 1) * each_str_len]
-                    ).decode()
-                )
-
-        self.num_elements = len("".join(self.p))
-        self.num_packets = len(self.p)
+        binary_str = target.image_bytes()
+        empty_str_size = sys.getsizeof(b"")
+        each_str_len = self.setting['split_size'] - empty_str_size
+
+        # 各パケットは画像ファイルのバイト列をそのまま分割したもの
+        # base64エンコードはJSON形式で送信する場合のみ送信時に行う
+        target.p = []
+        for i in range(math.ceil(len(binary_str) / each_str_len)):
+            target.p.append(binary_str[i * each_str_len : (i + 1) * each_str_len])
+
+        target.packetizer = None
+        target.packet_length = each_str_len
+        target.num_elements = len(binary_str)
+        target.num_packets = len(target.p)
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
-    def split_tensor_into_packets(self):
+    def split_tensor_into_packets(self, target):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
-        # xは中間層出力を平坦化したもの
-        x = self.result_data.flatten()
-        n = len(x)
-        if self.setting['split_mode'] == 'random':
-            # self.kはパケットをランダムに並べ替えるためのインデックス
-            # 受信側でも同じシード値を用いるので、元の順番に並べ直すことができる
-            np.random.seed(environment_settings.IOT_RANDOM_SEED_SHUFFLE)
-            self.k = np.random.permutation(n)
-        elif self.setting['split_mode'] == 'sequential':
-            self.k = np.arange(n)
-        else:
-            raise Exception('IOT_SPLIT_MODE has invalid value.')
-
-        s = environment_settings.IOT_SPLITTED_NUMPY_LENGTH
-
-        self.num_elements = 0
-
-        # self.pの各要素が、各パケットのペイロードになる
-        self.p = []
-        for i in range(0, n, s):
-            p_i = []
-            for j in range(i, min(i + s, n)):
-                p_i.append(x[self.k[j]])
-            p_i = np.array(p_i, dtype=np.float16)
-
-            self.num_elements += len(p_i)
-
-            np.save(BUFFER_NPYFILE, p_i)
-            with open(BUFFER_NPYFILE, "rb") as f:
-                p_i = f.read()
-            p_i = base64.b64encode(p_i).decode()
-            self.p.append(p_i)
-
-        self.num_packets = len(self.p)
+        target.packetizer = TensorPacketizer(
+            target.result_data,
+            self.setting['split_mode'],
+            num_layers=compressor.Compressor.num_layers(self.setting['Qubit_type']),
+            channel_order=target.channel_order,
+        )
+        target.k = target.packetizer.k
+        target.packet_length = target.packetizer.packet_length
+        target.num_elements = target.packetizer.num_elements
+        target.num_packets = target.packetizer.num_packets
 
-        os.remove(BUFFER_NPYFILE)
+        # target.pの各要素が、各パケットのペイロードになる
+        # ペイロードは送信時にtarget.packetizerから取り出しながら追加する
+        target.p = []
 
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
-    def send_result_summary(self):
+    def send_result_summary(self, target):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT))
-
-            filename = os.path.splitext(os.path.basename(self.process_target_image_file))[0]
+            # エッジサーバーからのreceived_resultは送信中の推論対象のものだけを受け付ける
+            self.session_id = target.session_id
             request = IotDeviceResultSummaryRequest(
                 command.IOT_SEND_RESULT_SUMMARY,
-                self.num_packets,
-                self.num_elements,
+                target.num_packets,
+                target.num_elements,
                 environment_settings.IOT_RANDOM_SEED_SHUFFLE,
-                filename, # 画像のファイル名(拡張子除く)
+                target.filename, # 画像のファイル名(拡張子除く)
+                wire_format=environment_settings.IOT_WIRE_FORMAT,
+                packet_length=target.packet_length,
+                session_id=target.session_id,
+                fec_group_size=self.get_fec_group_size(),
+                channel_order=target.packetizer.channel_order if target.packetizer is not None else None,
+                num_layers=target.packetizer.num_layers if target.packetizer is not None else 1,
+                quantization_params=target.quantization_params,
+                # 全てエッジで推論する場合は画像ファイルのバイト列
+                dtype=target.packetizer.dtype.name if target.packetizer is not None else "uint8",
+                entropy_coder=self.get_entropy_coder(),
+                sparse_encoding=self.use_sparse_encoding(target),
             )
             self.logger.info(f"IotDeviceResultSummaryRequest : {request.get_json()}")
-            sock.send(request.get_json().encode("ascii"))
-
-            rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-            self.logger.debug(f"Received data : {rcv_data}")
-            response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+            response = self.connection_pool.request(
+                environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT, request
+            )
             self.logger.debug(f"Response JSON : {response.get_json()}")
             self.logger.debug(f"Response payload : {response.payload}")
             assert response.payload == ""
@@ -350,60 +465,64 @@ class IotDevice:
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return True
 
-    def send_result_data(self):
+    def create_pacing(self):
+        """設定した帯域制限と損失率から、送信レートの初期値と下げ始める損失率を決める"""
+        initial_rate = environment_settings.IOT_PACING_INITIAL_RATE
+        if self.setting['network_band_limitation'] > 0:
+            # network_band_limitationの単位はMbit/s
+            initial_rate = self.setting['network_band_limitation'] * 10**6 / 8
+        self.pacing_controller = PacingController(
+            initial_rate,
+            environment_settings.IOT_PACING_MIN_RATE,
+            environment_settings.IOT_PACING_MAX_RATE,
+            self.setting['network_loss_rate'] + environment_settings.IOT_PACING_LOSS_MARGIN,
+        )
+        self.token_bucket = TokenBucket(initial_rate, environment_settings.IOT_PACING_BURST_BYTES)
+
+    def send_result_data(self, target):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
+        udp_socket = None
         try:
             self.terminate_sending_result_data_flag = False
+            self.retransmission_requests = queue.Queue()
+            use_pacing = self.setting['use_udp'] and environment_settings.IOT_USE_PACING
+            if use_pacing:
+                # 推論対象ごとにsequenceが0から始まるので、受信報告の数え方だけリセットし、送信レートは引き継ぐ
+                self.pacing_controller.reset_counters()
+                self.reception_report = None
             np.random.seed(environment_settings.IOT_RANDOM_SEED_TRANSMISSION_PROBABILITY)
             transmission_start_time = time.time()
-            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission start time = {:.9f}".format(self.target_image_sequence_number, transmission_start_time) + '\n', mode='a')
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Transmission start time = {:.9f}".format(target.target_image_sequence_number, transmission_start_time) + '\n', mode='a')
             
             self.logger.info('use udp = ' + str(self.setting['use_udp']))
-            for i in range(len(self.p)):
+            self.logger.info('wire format = ' + environment_settings.IOT_WIRE_FORMAT)
+            self.logger.info('entropy coder = ' + self.get_entropy_coder())
+            if self.setting['use_udp']:
+                # UDPはコネクションレスなので、1回の送信で1つのソケットを使い回す
+                udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            total_send_data_size = 0
+            sent_packets = 0
+            fec_group_size = self.get_fec_group_size()
+            for i, payload in target.packets():
                 if self.terminate_sending_result_data_flag:
                     break
-                
-                if self.setting['use_udp']:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDPを用いる
-                    #sock.bind((environment_settings.IOT_HOSTNAME, environment_settings.IOT_UDP_PORT))
-                    # UDPはコネクションレス
-                else:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # TCPを用いる
-                    sock.connect((environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT)) # 接続
-
-                self.logger.debug(f"{i}th packet is sent.")
-                payload = self.p[i]
-                sequence = i
-                request = IotDeviceResultDataRequest(
-                    command.IOT_SEND_RESULT_DATA, payload, sequence
-                )
-                self.logger.debug(f"IotDeviceResultDataRequest : {request.get_json()}")
-
-                if self.setting['use_udp']:
-                    # UDPでは接続を確立していないので、宛先を指定して送信する
-                    self.logger.debug("send via UDP")
-                    sock.sendto(request.get_json().encode("ascii"), (environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_UDP_PORT))
-
-                    '''
-                    # UDPの場合はレスポンスを待たない
-                    # 以下の行は、UDPで送られてくるレスポンスを受信するためのコード
-                    # rcv_data, addr = sock.recvfrom(environment_settings.BUFFER_SIZE)
-                    '''
-
-                else:
-                    # TCPでは接続を確立している状態で送信する
-                    sock.send(request.get_json().encode("ascii"))
-                    rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-
-                    self.logger.debug(f"Received data : {rcv_data}")
-                    response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
-                    self.logger.debug(f"Response JSON : {response.get_json()}")
-                    self.logger.debug(f"Response payload : {response.payload}")
-                    assert response.payload == ""
-            
-            total_send_data_size = sum([len(packet) for packet in self.p])
-            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Send Data Size = {} bytes".format(self.target_image_sequence_number, total_send_data_size) + '\n', mode='a')
-            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Send Packets = {}".format(self.target_image_sequence_number, len(self.p)) + '\n', mode='a')
+                total_send_data_size += self.send_packet(target, i, payload, udp_socket, use_pacing)
+                sent_packets += 1
+                # グループの最後のデータパケットを送ったら、そのグループのパリティパケットを送る
+                if fec_group_size and ((i + 1) % fec_group_size == 0 or i + 1 == target.num_packets):
+                    total_send_data_size += self.send_parity_packet(target, i // fec_group_size, fec_group_size, udp_socket, use_pacing)
+
+            # UDPで失われたパケットは、エッジサーバーから再送要求があったものだけを再送する
+            if self.setting['use_udp'] and environment_settings.UDP_RETRANSMISSION:
+                retransmitted_data_size, retransmitted_packets = self.retransmit_missing_packets(target, udp_socket, use_pacing)
+                total_send_data_size += retransmitted_data_size
+                sent_packets += retransmitted_packets
+                save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Retransmitted Packets = {}".format(target.target_image_sequence_number, retransmitted_packets) + '\n', mode='a')
+
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Send Data Size = {} bytes".format(target.target_image_sequence_number, total_send_data_size) + '\n', mode='a')
+            save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", "{}, Total Send Packets = {}".format(target.target_image_sequence_number, target.num_packets) + '\n', mode='a')
+            if use_pacing and sent_packets > 0:
+                self.save_pacing_statistics(target, transmission_start_time, total_send_data_size, sent_packets)
         except socket.error as se:
             self.logger.exception(se)
             self.logger.error(f"===== error {sys._getframe().f_code.co_name} , return False =====")
@@ -412,18 +531,137 @@ class IotDevice:
             self.logger.exception(e)
             self.logger.error(f"===== error {sys._getframe().f_code.co_name} , return False =====")
             return False
+        finally:
+            if udp_socket is not None:
+                udp_socket.close()
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
         return True
 
+    def send_packet(self, target, sequence, payload, udp_socket, use_pacing):
+        """1つのパケットを送信し、送信したバイト数を返す"""
+        self.logger.debug(f"{sequence}th packet is sent.")
+        # データパケットだけをパケットごとに疎な形式にして可逆圧縮する(パリティは変換前のペイロードのXORなのでそのまま送る)
+        if sequence < target.num_packets:
+            if self.use_sparse_encoding(target):
+                payload = encode_sparse_payload(payload)
+            payload = EntropyCoder.encode(self.get_entropy_coder(), payload)
+        request = IotDeviceResultDataRequest(
+            command.IOT_SEND_RESULT_DATA, payload, sequence, session_id=target.session_id
+        )
+        if environment_settings.IOT_WIRE_FORMAT == WIRE_FORMAT_BINARY:
+            message = request.get_bytes()
+        else:
+            message = request.get_json().encode("ascii")
+
+        if self.setting['use_udp']:
+            # UDPでは接続を確立していないので、宛先を指定して送信する
+            self.logger.debug("send via UDP")
+            if use_pacing:
+                # 送信レートを超えないように送信の間隔を空ける
+                self.token_bucket.consume(len(message))
+            udp_socket.sendto(message, (environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_UDP_PORT))
+
+            '''
+            # UDPの場合はレスポンスを待たない
+            # 以下の行は、UDPで送られてくるレスポンスを受信するためのコード
+            # rcv_data, addr = sock.recvfrom(environment_settings.BUFFER_SIZE)
+            '''
+
+        else:
+            # TCPでは張りっぱなしの接続で送信し、レスポンスを待つ
+            response = self.connection_pool.request(
+                environment_settings.EDGE_HOSTNAME, environment_settings.EDGE_PORT, request, message
+            )
+            self.logger.debug(f"Response JSON : {response.get_json()}")
+            self.logger.debug(f"Response payload : {response.payload}")
+            assert response.payload == ""
+        return len(message)
+
+    def get_entropy_coder(self):
+        """パケットごとの可逆圧縮の方式(entropy_coderがない以前の設定の場合は圧縮しない)"""
+        return self.setting.get('entropy_coder', EntropyCoder.ENTROPY_NONE)
+
+    def use_sparse_encoding(self, target):
+        """テンソルを送る場合に、0以外の要素だけを送る形式を使うか(全てエッジで推論する場合の画像ファイルには使わない)"""
+        return environment_settings.IOT_SPARSE_ENCODING and target.packetizer is not None
+
+    def get_fec_group_size(self):
+        """FECのパリティパケット1つあたりのデータパケット数(UDPの場合のみ使う)"""
+        return environment_settings.IOT_FEC_GROUP_SIZE if self.setting['use_udp'] else 0
+
+    def send_parity_packet(self, target, group, fec_group_size, udp_socket, use_pacing):
+        """groupに含まれるデータパケットのXORを、sequence = num_packets + groupのパケットとして送信する"""
+        sequences = fec.group_range(group, target.num_packets, fec_group_size)
+        parity = fec.xor_payloads([target.p[sequence] for sequence in sequences], memoryview(target.p[0]).nbytes)
+        return self.send_packet(target, target.num_packets + group, parity, udp_socket, use_pacing)
+
+    def retransmit_missing_packets(self, target, udp_socket, use_pacing):
+        """
+        エッジサーバーからの再送要求を待ち、届いていないパケットだけをtarget.pから再送する
+        再送はMAX_RETRANSMISSION_ROUNDS回まで、再送要求をIOT_RETRANSMISSION_WAIT_SECONDS秒待っても届かなければ終わる
+        再送したバイト数とパケット数を返す
+        """
+        send_data_size = 0
+        sent_packets = 0
+        for retransmission_round in range(environment_settings.MAX_RETRANSMISSION_ROUNDS):
+            if self.terminate_sending_result_data_flag:
+                break
+            try:
+                missing = self.retransmission_requests.get(timeout=environment_settings.IOT_RETRANSMISSION_WAIT_SECONDS)
+            except queue.Empty:
+                break
+            # 十分なデータが届いた場合などはNoneで起こされる
+            if missing is None:
+                break
+            missing_sequences = decode_sequence_bitmap(missing, target.num_packets)
+            self.logger.info(f"retransmit {len(missing_sequences)} packets (round {retransmission_round + 1})")
+            for sequence in missing_sequences:
+                if self.terminate_sending_result_data_flag:
+                    break
+                send_data_size += self.send_packet(target, int(sequence), target.p[sequence], udp_socket, use_pacing)
+                sent_packets += 1
+        return send_data_size, sent_packets
+
+    def save_pacing_statistics(self, target, transmission_start_time, total_send_data_size, sent_packets):
+        """最後の受信報告から、送信レート・グッドプット・損失率をcondition.txtに書き込む"""
+        line = "{}, Pacing rate = {:.0f} bytes/s".format(target.target_image_sequence_number, self.pacing_controller.rate)
+        if self.reception_report is not None:
+            report_time, report = self.reception_report
+            # 受信報告の時点で届いているはずのパケットのうち、実際に届いた割合から求める
+            reported_sent_packets = report.highest_sequence + 1
+            goodput = report.received_packets * (total_send_data_size / sent_packets) / max(report_time - transmission_start_time, 1e-9)
+            loss_rate = 1.0 - report.received_packets / reported_sent_packets
+            line += ", goodput = {:.0f} bytes/s, loss rate = {:.4f}".format(goodput, loss_rate)
+        self.logger.info(line)
+        save_result.save_json_or_txt(self.setting['current_time_str'], "output", "condition.txt", line + '\n', mode='a')
+
+    def process_send_reception_report(self, request):
+        """エッジサーバーからの受信報告で送信レートを調整する"""
+        # 以前の推論対象に対する受信報告は使わない
+        if request.session_id == self.session_id and self.pacing_controller is not None:
+            self.reception_report = (time.time(), request)
+            rate = self.pacing_controller.on_report(request.highest_sequence + 1, request.received_packets)
+            self.token_bucket.set_rate(rate)
+            self.logger.debug(f"pacing rate = {rate:.0f} bytes/s, loss rate = {self.pacing_controller.last_loss_rate:.4f}")
+        return CommonResponse(code.SUCCESS, request.request_id, "", "")
+
     def process_send_received_result(self, request):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        if request.code == code.SUFFICIENT_DATA_ARRIVAL:
+        # 以前の推論対象に対するreceived_resultで、送信中の推論対象の送信を止めないようにする
+        if request.session_id is not None and request.session_id != self.session_id:
+            self.logger.info(f"received result for previous session : {request.session_id}")
+        elif request.code == code.SUFFICIENT_DATA_ARRIVAL:
             self.logger.info("SUFFICIENT_DATA_ARRIVAL")
             self.terminate_sending_result_data_flag = True
+            self.retransmission_requests.put(None)
         elif request.code == code.TIME_EXCEEDED:
             self.logger.info("WAITING_TIME_EXCEEDED")
             self.terminate_sending_result_data_flag = True
+            self.retransmission_requests.put(None)
+        elif request.code == code.MISSING_DATA:
+            self.logger.info("MISSING_DATA")
+            self.retransmission_requests.put(request.missing)
 
         payload = ""  # 正常に受信できた場合は、「共通レスポンスデータ」のpayloadを空文字列を格納する。
         response = CommonResponse(code.SUCCESS, request.request_id, "", payload)
@@ -437,46 +675,11 @@ class IotDevice:
             if os.path.exists('./data/numpy'):
                 shutil.rmtree('./data/numpy')
             os.makedirs('./data/numpy', exist_ok=True)
-            is_wait = True
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind((environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT))
-                s.listen(5)
-                while is_wait and self.retry_count < environment_settings.MAX_RETRY_COUNT:
-                    self.logger.info('wait receive...')
-                    conn, addr = s.accept()
-                    data = conn.recv(environment_settings.BUFFER_SIZE)
-                    self.logger.debug(f"Request data : {data}")
-                    self.logger.debug(f"Request addr : {addr}")
-                    converted_req = CommonRequest.convert_from_json(data)
-                    self.logger.debug(f"Request JSON : {converted_req.get_json()}")
-
-                    # 終了コマンドは個別で処理する
-                    if converted_req.command == command.IOT_END:
-                        res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
-                        conn.sendall(res.get_json().encode())
-                        conn.close()
-                        is_wait = False
-                        break
-
-                    if converted_req.command in self.command_list:
-                        if converted_req.command == command.EDGE_SEND_RECEIVED_RESULT:
-                            converted_req = (
-                                EdgeServerReceivedResultRequest.convert_from_json(data)
-                            )
-                        elif converted_req.command == command.CLOUD_SEND_SETTING_TO_IOT:
-                            converted_req = (
-                                CloudServerSettingRequest.convert_from_json(data)
-                            )
-                        res = self.command_list[converted_req.command](converted_req)
-                        conn.sendall(res.get_json().encode())
-                    else:
-                        self.command_not_found(converted_req)
-
-                    if converted_req.command == command.CLOUD_SEND_SETTING_TO_IOT:
-                        thread_process = threading.Thread(target=self.process_do_inference)
-                        thread_process.setDaemon(True)
-                        thread_process.start()
+            self.server = MessageServer(
+                environment_settings.IOT_HOSTNAME, environment_settings.IOT_PORT, self.handle_request, self.logger
+            )
+            self.server.serve_forever()
+            self.connection_pool.close()
 
             Tc.reset_tc(
                 environment_settings.IOT_NETWORK_DEVICE,
@@ -495,12 +698,47 @@ class IotDevice:
             )
         self.logger.info(f"====== end {sys._getframe().f_code.co_name} ======")
 
+    def handle_request(self, data):
+        """受信したリクエストを処理し、レスポンスのバイト列を返す"""
+        self.logger.debug(f"Request data : {data}")
+        converted_req = CommonRequest.convert_from_json(data)
+        self.logger.debug(f"Request JSON : {converted_req.get_json()}")
+
+        # 終了コマンドは個別で処理する
+        if converted_req.command == command.IOT_END:
+            res = CommonResponse(code.SUCCESS, converted_req.request_id, "", "")
+            self.server.stop()
+            return res.get_json().encode()
+
+        if converted_req.command not in self.command_list:
+            self.command_not_found(converted_req)
+
+        if converted_req.command == command.EDGE_SEND_RECEIVED_RESULT:
+            converted_req = (
+                EdgeServerReceivedResultRequest.convert_from_json(data)
+            )
+        elif converted_req.command == command.EDGE_SEND_RECEPTION_REPORT:
+            converted_req = (
+                EdgeServerReceptionReportRequest.convert_from_json(data)
+            )
+        elif converted_req.command == command.CLOUD_SEND_SETTING_TO_IOT:
+            converted_req = (
+                CloudServerSettingRequest.convert_from_json(data)
+            )
+        res = self.command_list[converted_req.command](converted_req)
+
+        if converted_req.command == command.CLOUD_SEND_SETTING_TO_IOT:
+            thread_process = threading.Thread(target=self.process_do_inference)
+            thread_process.setDaemon(True)
+            thread_process.start()
+
+        if environment_settings.MAX_RETRY_COUNT <= self.retry_count:
+            self.server.stop()
+        return res.get_json().encode()
+
     def send_process_time(self, process_name):
         self.logger.info(f"===== start {sys._getframe().f_code.co_name} =====")
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT))
-
         request = ProcessTimeRequest(
             command.IOT_SEND_PROCESS_TIME,
             process_name,
@@ -508,11 +746,9 @@ class IotDevice:
             time.time()
         )
         self.logger.debug(f"ProcessTimeRequest : {request.get_json()}")
-        sock.send(request.get_json().encode("ascii"))
-
-        rcv_data = sock.recv(environment_settings.BUFFER_SIZE)
-        self.logger.debug(f"Received data : {rcv_data}")
-        response = CommonResponse.convert_from_json(str(rcv_data, "utf-8"))
+        response = self.connection_pool.request(
+            environment_settings.CLOUD_HOSTNAME, environment_settings.CLOUD_PORT, request
+        )
         self.logger.debug(f"Response JSON : {response.get_json()}")
         self.logger.debug(f"Response payload : {response.payload}")
         assert response.payload == ""
@@ -521,10 +757,10 @@ class IotDevice:
     def command_not_found(self, request):
         raise Exception("command not found")
 
-    def convert_jpg_to_png(self, destination_dir):
-        image = Image.open(self.process_target_image_file)
+    def convert_jpg_to_png(self, process_target_image_file, destination_dir):
+        image = Image.open(process_target_image_file)
         # jpgファイルの名前を取得（拡張子を除く）
-        file_name_without_ext = os.path.splitext(os.path.basename(self.process_target_image_file))[0]
+        file_name_without_ext = os.path.splitext(os.path.basename(process_target_image_file))[0]
         # pngとして保存するパスを指定
         png_path = os.path.join(destination_dir, file_name_without_ext + '.png')
         image.save(png_path)
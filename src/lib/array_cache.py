@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import collections
+import threading
+
+
+class ArrayLruCache:
+    '''
+    np.ndarrayを保持するLRUキャッシュ
+    要素数ではなく保持している配列の合計バイト数がmax_bytesを超えないように、古いものから捨てる
+    キャッシュした配列は呼び出し側で書き換えられないように読み込み専用にする
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.arrays = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            array = self.arrays.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self.arrays.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def put(self, key, array):
+        array.setflags(write=False)
+        # max_bytesより大きい配列はキャッシュしない
+        if array.nbytes > self.max_bytes:
+            return array
+        with self.lock:
+            old_array = self.arrays.pop(key, None)
+            if old_array is not None:
+                self.total_bytes -= old_array.nbytes
+            self.arrays[key] = array
+            self.total_bytes += array.nbytes
+            while self.total_bytes > self.max_bytes:
+                _, evicted_array = self.arrays.popitem(last=False)
+                self.total_bytes -= evicted_array.nbytes
+        return array
+
+    def get_or_load(self, key, load):
+        """キャッシュにない場合はload()の結果をキャッシュして返す"""
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, load())
+        return array
+
+    def clear(self):
+        with self.lock:
+            self.arrays.clear()
+            self.total_bytes = 0
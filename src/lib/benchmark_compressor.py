@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+# Compressorの量子化・逆量子化について、要素ごとの処理(np.frompyfunc)と配列演算の処理時間を比較する
+import sys
+import timeit
+
+import numpy as np
+from src.lib import compressor
+from src.lib.logger import create_logger
+logger = create_logger(__name__)
+
+# model_COMtuneの13層目の出力サイズ(14 x 14 x 64)を含むテンソルサイズ
+TENSOR_SHAPES = [(1, 7, 7, 32), (1, 14, 14, 64), (1, 28, 28, 128)]
+REPEAT = 5
+
+comp = compressor.Compressor()
+
+# 配列演算に置き換える前の要素ごとの処理
+legacy_funcs = {
+    compressor.Compressor.QUBIT_16BIT_INT: (
+        lambda x: np.frompyfunc(comp.compress_16bit_int, 1, 1)(x),
+        lambda x: np.frompyfunc(comp.extract_16bit_int, 1, 1)(x),
+    ),
+    compressor.Compressor.QUBIT_8BIT_INT: (
+        lambda x: np.frompyfunc(comp.compress_8bit_int, 1, 1)(x),
+        lambda x: np.frompyfunc(comp.extract_8bit_int, 1, 1)(x),
+    ),
+    compressor.Compressor.QUBIT_NORMALIZE_16BIT_INT: (
+        lambda x: np.frompyfunc(comp.compress_normalize_16bit_int, 3, 1)(x, x.max(), x.min()),
+        lambda x: np.frompyfunc(comp.extract_16bit_int, 1, 1)(x),
+    ),
+    compressor.Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT: (
+        lambda x: np.frompyfunc(comp.compress_normalize2sigma_16bit_int, 3, 1)(
+            x, np.median(x), x.std()
+        ),
+        lambda x: np.frompyfunc(comp.extract_16bit_int, 1, 1)(x),
+    ),
+}
+vectorized_funcs = {
+    compressor.Compressor.QUBIT_16BIT_INT: (comp.compress_nparray_16bit_int, comp.extract_nparray_16bit_int),
+    compressor.Compressor.QUBIT_8BIT_INT: (comp.compress_nparray_8bit_int, comp.extract_nparray_8bit_int),
+    compressor.Compressor.QUBIT_NORMALIZE_16BIT_INT: (comp.compress_nparray_normalize_16bit_int, comp.extract_nparray_16bit_int),
+    compressor.Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT: (comp.compress_nparray_normalize2sigma_16bit_int, comp.extract_nparray_16bit_int),
+}
+
+def measure(func, val):
+    return min(timeit.repeat(lambda: func(val), number=1, repeat=REPEAT))
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    for shape in TENSOR_SHAPES:
+        # ReLU後の中間層出力を想定した非負の値
+        val = np.maximum(np.random.normal(0.5, 1.0, shape), 0).astype(np.float32)
+        for qubit_type, (legacy_compress, legacy_extract) in legacy_funcs.items():
+            compress, extract = vectorized_funcs[qubit_type]
+            legacy_compressed = legacy_compress(val)
+            compressed = compress(val)
+            if not np.array_equal(legacy_compressed.astype(compressed.dtype), compressed):
+                logger.error("compressed result not matched : {}, {}".format(qubit_type, shape))
+                sys.exit(1)
+            if not np.array_equal(legacy_extract(compressed).astype(np.float32), extract(compressed)):
+                logger.error("extracted result not matched : {}, {}".format(qubit_type, shape))
+                sys.exit(1)
+
+            logger.info(
+                "{}, shape = {}, compress legacy = {:.6f} s, vectorized = {:.6f} s, extract legacy = {:.6f} s, vectorized = {:.6f} s".format(
+                    qubit_type,
+                    shape,
+                    measure(legacy_compress, val),
+                    measure(compress, val),
+                    measure(legacy_extract, compressed),
+                    measure(extract, compressed),
+                )
+            )
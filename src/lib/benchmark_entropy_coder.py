@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+# 各モデルの分割レイヤーごとに、量子化した中間層出力をパケットに分割してEntropyCoderで符号化し、
+# 方式ごと(0以外の要素だけを送る形式にした場合を含む)の圧縮率と符号化・復号の処理時間を比較する
+# 使い方: python benchmark_entropy_coder.py [画像のディレクトリまたはX_*.npy]
+import sys
+import timeit
+
+import numpy as np
+from src.lib import compressor, inference
+from src.lib.create_calibration_table import CALIBRATION_RANDOM_SEED, inference_models, load_calibration_images
+from src.lib.entropy_coder import EntropyCoder
+from src.lib.logger import create_logger
+from src.lib.packetizer import TensorPacketizer
+from src.lib.sparse_codec import decode_sparse_payload, encode_sparse_payload
+logger = create_logger(__name__)
+
+# 下記はcreate_pca_model.pyと同じく、src/libからの相対パス指定
+BENCHMARK_IMAGES_PATH = '../iot_device/data/mnist/X_test.npy'
+BENCHMARK_IMAGE_COUNT = 20
+REPEAT = 3
+
+comp = compressor.Compressor()
+
+# 符号化する前の量子化(IoTデバイスのcompress_resultと同じ関数で、スケールとゼロ点はテンソルごとに求める)
+quantizers = {
+    compressor.Compressor.QUBIT_NON_COMPRESSION: lambda x: x,
+    compressor.Compressor.QUBIT_AFFINE_16BIT_INT: lambda x: comp.compress_nparray_affine_int(x, 16)[0],
+    compressor.Compressor.QUBIT_AFFINE_8BIT_INT: lambda x: comp.compress_nparray_affine_int(x, 8)[0],
+    compressor.Compressor.QUBIT_PACKED_4BIT_INT: lambda x: comp.compress_nparray_packed_int(x, 4)[0],
+}
+
+def measure(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEAT))
+
+def encode_packet(coder_type, sparse, payload):
+    """IoTデバイスのsend_packetと同じ順に、疎な形式にしてから可逆圧縮する"""
+    if sparse:
+        payload = encode_sparse_payload(payload)
+    return EntropyCoder.encode(coder_type, payload)
+
+def decode_packet(coder_type, sparse, coded_payload, dtype):
+    """エッジサーバーのreceive_result_dataと同じ順に復号する"""
+    decoded = EntropyCoder.decode(coder_type, coded_payload)
+    if sparse:
+        return decode_sparse_payload(decoded, dtype)
+    return np.frombuffer(decoded, dtype=dtype)
+
+def benchmark_packets(coder_type, sparse, payloads):
+    """全パケットを符号化した後の合計バイト数と、符号化・復号の処理時間(秒)を返す"""
+    dtype = payloads[0].dtype
+    coded = [encode_packet(coder_type, sparse, payload) for payload in payloads]
+    for payload, coded_payload in zip(payloads, coded):
+        if not np.array_equal(decode_packet(coder_type, sparse, coded_payload, dtype), payload):
+            raise ValueError(f"decoded payload not matched : {coder_type}, sparse = {sparse}")
+    encode_time = measure(lambda: [encode_packet(coder_type, sparse, payload) for payload in payloads])
+    decode_time = measure(lambda: [decode_packet(coder_type, sparse, coded_payload, dtype) for coded_payload in coded])
+    # ENTROPY_NONEで疎な形式にしない場合はnp.ndarrayのまま返るので、バイト数で数える
+    return sum(memoryview(coded_payload).nbytes for coded_payload in coded), encode_time, decode_time
+
+
+if __name__ == "__main__":
+    images_path = sys.argv[1] if len(sys.argv) > 1 else BENCHMARK_IMAGES_PATH
+    X_benchmark = np.expand_dims(load_calibration_images(images_path, BENCHMARK_IMAGE_COUNT, CALIBRATION_RANDOM_SEED), axis=-1)
+    logger.info("benchmark images : {}, {}, coders : {}".format(images_path, X_benchmark.shape, EntropyCoder.coder_pattern()))
+
+    for inference_model in inference_models:
+        for layer in range(1, inference_model['layers']):
+            try:
+                sub_model = inference.sub_model_cache.get(inference_model['model'], 1, layer)
+                activations = np.asarray(sub_model(X_benchmark))
+            except Exception as e:
+                logger.error("Exception model = {}, layer = {}".format(inference_model['name'], layer))
+                logger.exception(e)
+                continue
+
+            for qubit_type, quantize in quantizers.items():
+                # 推論対象ごとに、IoTデバイスと同じようにパケットに分割したペイロード
+                payloads = []
+                for activation in activations:
+                    packetizer = TensorPacketizer(quantize(activation[np.newaxis]), TensorPacketizer.SPLIT_MODE_RANDOM)
+                    payloads.extend(payload for _, payload in packetizer.packets())
+                raw_size = sum(payload.nbytes for payload in payloads)
+                zero_rate = sum(payload.size - np.count_nonzero(payload) for payload in payloads) / sum(payload.size for payload in payloads)
+
+                for sparse in [False, True]:
+                    for coder_type in EntropyCoder.coder_pattern():
+                        coded_size, encode_time, decode_time = benchmark_packets(coder_type, sparse, payloads)
+                        logger.info(
+                            "model = {}, layer = {}, {}, zero rate = {:.3f}, sparse = {}, {}, packets = {}, ratio = {:.3f}, encode = {:.6f} s, decode = {:.6f} s".format(
+                                inference_model['name'],
+                                layer,
+                                qubit_type,
+                                zero_rate,
+                                sparse,
+                                coder_type,
+                                len(payloads),
+                                raw_size / coded_size,
+                                encode_time,
+                                decode_time,
+                            )
+                        )
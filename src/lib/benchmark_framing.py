@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+# パケットサイズ(IOT_SPLITTED_NUMPY_LENGTH)ごとに、ループバックでのresult_dataの送信速度を計測する
+# 使い方 : python -m src.lib.benchmark_framing
+import socket
+import threading
+import time
+
+import numpy as np
+from src.lib import code
+from src.lib import command
+from src.lib.connection import ConnectionPool, MessageServer
+from src.lib.model.request import IotDeviceResultDataRequest
+from src.lib.model.response import CommonResponse
+from src.lib.packetizer import TensorPacketizer
+from src.lib.logger import create_logger
+logger = create_logger(__name__)
+
+HOSTNAME = "127.0.0.1"
+# model_COMtuneの13層目の出力サイズ
+TENSOR_SHAPE = (1, 14, 14, 64)
+PACKET_LENGTHS = [2 ** 7, 2 ** 9, 2 ** 11, 2 ** 13, 2 ** 15]
+REPEAT = 5
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((HOSTNAME, 0))
+        return s.getsockname()[1]
+
+def handle_request(data):
+    request = IotDeviceResultDataRequest.convert_from_bytes(data)
+    return CommonResponse(code.SUCCESS, request.request_id, "", "").get_json().encode("ascii")
+
+def send_all_packets(connection_pool, port, packetizer):
+    sent_bytes = 0
+    for sequence, payload in packetizer.packets():
+        request = IotDeviceResultDataRequest(command.IOT_SEND_RESULT_DATA, payload, sequence)
+        message = request.get_bytes()
+        connection_pool.request(HOSTNAME, port, request, message)
+        sent_bytes += len(message)
+    return sent_bytes
+
+if __name__ == "__main__":
+    port = find_free_port()
+    server = MessageServer(HOSTNAME, port, handle_request, logger)
+    thread_server = threading.Thread(target=server.serve_forever, daemon=True)
+    thread_server.start()
+    time.sleep(0.5)
+
+    connection_pool = ConnectionPool(logger)
+    np.random.seed(0)
+    tensor = np.random.rand(*TENSOR_SHAPE).astype(np.float32)
+    try:
+        for packet_length in PACKET_LENGTHS:
+            packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=packet_length, dtype=np.float16)
+            elapsed_times = []
+            for _ in range(REPEAT):
+                start_time = time.perf_counter()
+                sent_bytes = send_all_packets(connection_pool, port, packetizer)
+                elapsed_times.append(time.perf_counter() - start_time)
+            elapsed_time = min(elapsed_times)
+            logger.info(
+                "packet_length = {}, packets = {}, bytes = {}, time = {:.6f} s, throughput = {:.2f} MB/s".format(
+                    packet_length,
+                    packetizer.num_packets,
+                    sent_bytes,
+                    elapsed_time,
+                    sent_bytes / elapsed_time / 1e6,
+                )
+            )
+    finally:
+        connection_pool.close()
+        server.stop()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import numpy as np
+
+# 記録するパーセンタイル(range()でクリップに使えるのはこの中の値)
+DEFAULT_PERCENTILES = [0.01, 0.1, 1.0, 50.0, 99.0, 99.9, 99.99]
+DEFAULT_HISTOGRAM_BINS = 256
+
+
+class LayerCalibration:
+    '''
+    1つのモデルの1つの分割レイヤーについて、キャリブレーション用の画像で求めた中間層出力の統計量
+    チャンネルは中間層出力の最後の次元(Compressorのper_channelと同じ)
+    '''
+    def __init__(self, statistics):
+        # 統計量の名前 -> np.ndarray
+        self.statistics = statistics
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["statistics"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def range(self, per_channel=True, percentile=None):
+        """
+        量子化に使う(最小値, 最大値)を返す(per_channelがTrueの場合はチャンネルごとの配列、Falseの場合は長さ1の配列)
+        percentileを指定した場合は、(100 - percentile)パーセンタイルからpercentileパーセンタイルまでにクリップした範囲を返す
+        """
+        if percentile is None:
+            if per_channel:
+                return self.channel_min, self.channel_max
+            return np.atleast_1d(self.min), np.atleast_1d(self.max)
+
+        lower, upper = self.percentile_index(100.0 - percentile), self.percentile_index(percentile)
+        if per_channel:
+            return self.channel_percentiles[lower], self.channel_percentiles[upper]
+        return self.tensor_percentiles[lower : lower + 1], self.tensor_percentiles[upper : upper + 1]
+
+    def percentile_index(self, percentile):
+        """記録したパーセンタイルの中からpercentileの位置を返す"""
+        index = int(np.argmin(np.abs(self.percentiles - percentile)))
+        if not np.isclose(self.percentiles[index], percentile):
+            raise ValueError(f"percentile {percentile} is not recorded")
+        return index
+
+
+def compute_layer_calibration(activations, percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_HISTOGRAM_BINS):
+    """キャリブレーション用の画像をまとめて処理した中間層出力(N, ...)から、LayerCalibrationを作る"""
+    x = np.asarray(activations, dtype=np.float32)
+    channels = x.reshape(-1, x.shape[-1])
+    min_val, max_val = float(x.min()), float(x.max())
+    histogram, histogram_edges = np.histogram(x, bins=bins, range=(min_val, max(max_val, min_val + 1e-6)))
+    return LayerCalibration({
+        "channel_min": channels.min(axis=0),
+        "channel_max": channels.max(axis=0),
+        "percentiles": np.asarray(percentiles, dtype=np.float32),
+        # (パーセンタイルの数, チャンネル数)
+        "channel_percentiles": np.percentile(channels, percentiles, axis=0).astype(np.float32),
+        "tensor_percentiles": np.percentile(x, percentiles).astype(np.float32),
+        "min": np.float32(min_val),
+        "max": np.float32(max_val),
+        "median": np.float32(np.median(x)),
+        "std": np.float32(x.std()),
+        "histogram": histogram,
+        "histogram_edges": histogram_edges.astype(np.float32),
+    })
+
+
+class CalibrationTable:
+    '''
+    (モデル名, 分割レイヤー)ごとのLayerCalibrationをまとめたもの
+    1つの.npzに「モデル名/レイヤー/統計量の名前」をキーとして保存し、読み込みは最初の1回だけ行う
+    '''
+    def __init__(self):
+        self.layers = {}
+
+    def set(self, model_name, layer, calibration):
+        self.layers[(model_name, int(layer))] = calibration
+
+    def get(self, model_name, layer):
+        """キャリブレーションしていないレイヤーの場合はNoneを返す"""
+        return self.layers.get((model_name, int(layer)))
+
+    def save(self, path):
+        arrays = {}
+        for (model_name, layer), calibration in self.layers.items():
+            for name, value in calibration.statistics.items():
+                arrays[f"{model_name}/{layer}/{name}"] = value
+        np.savez_compressed(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        table = CalibrationTable()
+        statistics = {}
+        with np.load(path) as npz:
+            for key in npz.files:
+                model_name, layer, name = key.rsplit("/", 2)
+                statistics.setdefault((model_name, int(layer)), {})[name] = npz[key]
+        for (model_name, layer), layer_statistics in statistics.items():
+            table.set(model_name, layer, LayerCalibration(layer_statistics))
+        return table
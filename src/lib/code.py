@@ -5,6 +5,7 @@ class _code:
     SUCCESS = 0
     SUFFICIENT_DATA_ARRIVAL = 1
     TIME_EXCEEDED = 2
+    MISSING_DATA = 3
     ERROR_JSON_FORMAT = 100
 
     class ConstError(TypeError):
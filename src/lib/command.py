@@ -23,6 +23,7 @@ class _command:
     # IoTデバイスへのリクエストコマンド群
     EDGE_SEND_RECEIVED_RESULT = 3000
     CLOUD_SEND_SETTING_TO_IOT = 3001
+    EDGE_SEND_RECEPTION_REPORT = 3002
     IOT_SEND_PROCESS_TIME = 3211
     IOT_END = 3999
 
@@ -5,6 +5,7 @@ import os
 import pickle
 import numpy as np
 from src.conf import environment_settings
+from src.lib.calibration_table import CalibrationTable
 
 class Compressor:
     QUBIT_NON_COMPRESSION = 'Non compression'
@@ -12,15 +13,20 @@ class Compressor:
     QUBIT_8BIT_INT = '8bit'
     QUBIT_NORMALIZE_16BIT_INT = 'Normalize 16bit'
     QUBIT_NORMALIZE2SIGMA_16BIT_INT = 'Normalize 2Sigma 16bit'
+    # 16bit intの上位8bit(ベースレイヤー)を全て送ってから、下位8bit(リファインメントレイヤー)を送る
+    QUBIT_PROGRESSIVE_16BIT_INT = 'Progressive 16bit'
+    # 4bit、2bitに量子化した値を1バイトに2個、4個詰めて送る
+    QUBIT_PACKED_4BIT_INT = 'Packed 4bit'
+    QUBIT_PACKED_2BIT_INT = 'Packed 2bit'
+    # スケールとゼロ点をIoTデバイスで求め、サマリーで送るアフィン量子化
+    QUBIT_AFFINE_8BIT_INT = 'Affine 8bit'
+    QUBIT_AFFINE_16BIT_INT = 'Affine 16bit'
 
     def __init__(self):
-        self.compress_16bit_int_func = np.frompyfunc(self.compress_16bit_int, 1, 1)
-        self.compress_normalize_16bit_int_func = np.frompyfunc(self.compress_normalize_16bit_int, 3, 1)
-        self.compress_normalize2sigma_16bit_int_func = np.frompyfunc(self.compress_normalize2sigma_16bit_int, 3, 1)
-        self.extract_16bit_int_func = np.frompyfunc(self.extract_16bit_int, 1, 1)
-        self.compress_8bit_int_func = np.frompyfunc(self.compress_8bit_int, 1, 1)
-        self.extract_8bit_int_func = np.frompyfunc(self.extract_8bit_int, 1, 1)
-        # NOTE: 4bit int 以下はPython、numpy両方に型がないため実装する場合は独自実装が必要
+        # 量子化・逆量子化はnumpyの配列演算でまとめて行う
+        # キャリブレーションテーブルは最初に使う時に1回だけ読み込む
+        self.calibration_table = None
+        # NOTE: 4bit int 以下はPython、numpy両方に型がないため、uint8に詰めて扱う(compress_nparray_packed_int)
 
     @staticmethod
     def qubit_pattern():
@@ -30,8 +36,36 @@ class Compressor:
             Compressor.QUBIT_8BIT_INT,
             Compressor.QUBIT_NORMALIZE_16BIT_INT,
             Compressor.QUBIT_NORMALIZE2SIGMA_16BIT_INT,
+            Compressor.QUBIT_PROGRESSIVE_16BIT_INT,
+            Compressor.QUBIT_PACKED_4BIT_INT,
+            Compressor.QUBIT_PACKED_2BIT_INT,
+            Compressor.QUBIT_AFFINE_8BIT_INT,
+            Compressor.QUBIT_AFFINE_16BIT_INT,
         ]
 
+    @staticmethod
+    def packed_bits(qubit_type):
+        """1バイトに詰めて送る量子化の場合は1つの値のビット数を、それ以外の場合はNoneを返す"""
+        return {
+            Compressor.QUBIT_PACKED_4BIT_INT: 4,
+            Compressor.QUBIT_PACKED_2BIT_INT: 2,
+        }.get(qubit_type)
+
+    @staticmethod
+    def affine_bits(qubit_type):
+        """アフィン量子化の場合は1つの値のビット数を、それ以外の場合はNoneを返す"""
+        return {
+            Compressor.QUBIT_AFFINE_8BIT_INT: 8,
+            Compressor.QUBIT_AFFINE_16BIT_INT: 16,
+        }.get(qubit_type)
+
+    @staticmethod
+    def num_layers(qubit_type):
+        """圧縮したテンソルを何段階のレイヤーに分けて送るか(先頭の次元がレイヤーの次元になる)"""
+        if qubit_type == Compressor.QUBIT_PROGRESSIVE_16BIT_INT:
+            return 2
+        return 1
+
 
     def compress_16bit_int(self, val):
         compressed = np.array([(val * environment_settings.DEFAULT_16BIT_SCALE)], dtype=np.uint16)
@@ -39,8 +73,12 @@ class Compressor:
             return 0
         return compressed[0]
 
-    def compress_nparray_16bit_int(self, nparray_val):
-        return self.compress_16bit_int_func(nparray_val)
+    def compress_nparray_16bit_int(self, nparray_val, out=None):
+        work = self.get_work_buffer(nparray_val)
+        np.multiply(work, environment_settings.DEFAULT_16BIT_SCALE, out=work)
+        # 範囲外の値は桁あふれさせずに、マイナスの値は0、uint16の最大値を超える値は最大値にする
+        np.clip(work, 0, np.iinfo(np.uint16).max, out=work)
+        return self.cast(work, np.uint16, out)
 
     def compress_normalize_16bit_int(self, val, max, min):
         # 正規化
@@ -52,8 +90,25 @@ class Compressor:
         #     return 0
         return compressed[0]
 
-    def compress_nparray_normalize_16bit_int(self, nparray_val):
-        return self.compress_normalize_16bit_int_func(nparray_val, nparray_val.max(), nparray_val.min())
+    def compress_nparray_normalize_16bit_int(self, nparray_val, out=None, params=None, calibration=None):
+        """
+        paramsに辞書を渡した場合は、エッジサーバーで逆量子化するためのスケールとゼロ点を書き込む
+        calibration(LayerCalibration)を渡した場合は、最大値と最小値を求めずにキャリブレーションした値を使う
+        """
+        if calibration is not None:
+            max = float(calibration.max)
+            min = float(calibration.min)
+        else:
+            max = float(nparray_val.max())
+            min = float(nparray_val.min())
+        if params is not None:
+            params.update(self.normalize_params(max - min))
+        # 正規化
+        work = self.get_work_buffer(nparray_val)
+        np.multiply(1 / (max - min), work, out=work)
+        np.multiply(work, environment_settings.DEFAULT_NORMALIZE_16BIT_SCALE, out=work)
+        # PCA圧縮時にマイナスが発生するためクリップしない
+        return self.cast(work, np.uint16, out)
 
     def compress_normalize2sigma_16bit_int(self, val, median, std):
         # 正規化
@@ -71,11 +126,42 @@ class Compressor:
         #     return 0
         return compressed[0]
 
-    def compress_nparray_normalize2sigma_16bit_int(self, nparray_val):
-        # 1次元にして中央値を算出する
-        reshaped = np.sort(nparray_val.reshape(1, np.prod(nparray_val.shape)))
-        print("max = {}, min = {}, median = {}, std = {}".format(nparray_val.max(), nparray_val.min(), np.median(reshaped), nparray_val.std()))
-        return self.compress_normalize2sigma_16bit_int_func(nparray_val, np.median(reshaped), nparray_val.std())
+    def compress_nparray_normalize2sigma_16bit_int(self, nparray_val, out=None, params=None, calibration=None):
+        """
+        paramsに辞書を渡した場合は、エッジサーバーで逆量子化するためのスケールとゼロ点を書き込む
+        calibration(LayerCalibration)を渡した場合は、中央値と標準偏差を求めずにキャリブレーションした値を使う
+        """
+        if calibration is not None:
+            median = float(calibration.median)
+            std = float(calibration.std)
+        else:
+            # np.medianは全体をソートせずに中央値を求める
+            median = float(np.median(nparray_val))
+            std = float(nparray_val.std())
+            print("median = {}, std = {}".format(median, std))
+        # 正規化
+        lower = 0
+        if 0 < median - (2 * std):
+            lower = median - (2 * std)
+        upper = median + (2 * std)
+        if params is not None:
+            params.update(self.normalize_params(upper - lower))
+        work = self.get_work_buffer(nparray_val)
+        np.multiply(1 / (upper - lower), work, out=work)
+        np.multiply(work, environment_settings.DEFAULT_NORMALIZE_16BIT_SCALE, out=work)
+        # 範囲外の値は0にする
+        work[(nparray_val < lower) | (upper < nparray_val)] = 0
+        return self.cast(work, np.uint16, out)
+
+    @staticmethod
+    def normalize_params(value_range):
+        """正規化した値を元に戻すためのアフィン量子化のパラメータ(extract_nparray_affine_intで使う)"""
+        return {
+            "bits": 16,
+            "scale": [value_range / environment_settings.DEFAULT_NORMALIZE_16BIT_SCALE],
+            "zero_point": [0],
+            "symmetric": False,
+        }
 
     def extract_int(self, val, scale):
         extract_raw = (np.array(val)).astype(np.float32)
@@ -84,8 +170,16 @@ class Compressor:
     def extract_16bit_int(self, val):
         return self.extract_int(val, environment_settings.DEFAULT_16BIT_SCALE)
     
-    def extract_nparray_16bit_int(self, nparray_val):
-        return self.extract_16bit_int_func(nparray_val)
+    def extract_nparray_int(self, nparray_val, scale, out=None):
+        # 先にfloat32に変換してから割ることで要素ごとの処理と同じ結果にする
+        if out is None:
+            out = np.empty(nparray_val.shape, dtype=np.float32)
+        np.copyto(out, nparray_val, casting='unsafe')
+        np.divide(out, scale, out=out)
+        return out
+
+    def extract_nparray_16bit_int(self, nparray_val, out=None):
+        return self.extract_nparray_int(nparray_val, environment_settings.DEFAULT_16BIT_SCALE, out)
 
 
     def compress_8bit_int(self, val):
@@ -94,14 +188,152 @@ class Compressor:
             return 0
         return compressed[0]
 
-    def compress_nparray_8bit_int(self, nparray_val):
-        return self.compress_8bit_int_func(nparray_val)
+    def compress_nparray_8bit_int(self, nparray_val, out=None):
+        work = self.get_work_buffer(nparray_val)
+        np.multiply(work, environment_settings.DEFAULT_8BIT_SCALE, out=work)
+        # 範囲外の値は桁あふれさせずに、マイナスの値は0、uint8の最大値を超える値は最大値にする
+        np.clip(work, 0, np.iinfo(np.uint8).max, out=work)
+        return self.cast(work, np.uint8, out)
 
     def extract_8bit_int(self, val):
         return self.extract_int(val, environment_settings.DEFAULT_8BIT_SCALE)
     
-    def extract_nparray_8bit_int(self, nparray_val):
-        return self.extract_8bit_int_func(nparray_val)
+    def extract_nparray_8bit_int(self, nparray_val, out=None):
+        return self.extract_nparray_int(nparray_val, environment_settings.DEFAULT_8BIT_SCALE, out)
+
+    def compress_nparray_progressive_16bit_int(self, nparray_val):
+        """
+        16bit intに量子化した値を上位8bitと下位8bitに分け、(2, ...)のuint8の配列として返す
+        [0]がベースレイヤー、[1]がリファインメントレイヤー
+        """
+        compressed = self.compress_nparray_16bit_int(nparray_val)
+        return np.stack([compressed >> 8, compressed & 0xFF]).astype(np.uint8)
+
+    def extract_nparray_progressive_16bit_int(self, layers, refinement_mask=None, out=None):
+        """
+        compress_nparray_progressive_16bit_intの逆変換
+        refinement_maskがFalseの要素は下位8bitが届いていないものとして、上位8bitの刻み幅の中央の値にする
+        """
+        layers = np.asarray(layers)
+        base = layers[0].astype(np.uint16)
+        refinement = layers[1].astype(np.uint16)
+        if refinement_mask is not None:
+            refinement = np.where(refinement_mask, refinement, 1 << 7).astype(np.uint16)
+        return self.extract_nparray_16bit_int((base << 8) | refinement, out)
+
+    def compress_nparray_affine_int(self, nparray_val, bits, per_channel=True, symmetric=False, calibration=None, percentile=None):
+        """
+        bitsビットにアフィン量子化(q = round(x / scale) + zero_point)した配列と、
+        逆量子化のためのパラメータ(ビット数、スケール、ゼロ点、対称かどうか、元の形)の辞書を返す
+        per_channelがTrueの場合、スケールとゼロ点は最後の次元(チャンネル)ごとに求める
+        symmetricがTrueの場合はゼロ点を0とした符号付き整数、Falseの場合は最小値から最大値までを使う符号なし整数にする
+        calibration(LayerCalibration)を渡した場合は、範囲を求めずにキャリブレーションした範囲(percentileでクリップしたもの)を使う
+        """
+        nparray_val = np.asarray(nparray_val, dtype=np.float32)
+        num_channels = nparray_val.shape[-1] if per_channel and nparray_val.ndim >= 2 else 1
+        x = nparray_val.reshape(-1, num_channels)
+        calibrated_range = None
+        if calibration is not None:
+            calibrated_range = calibration.range(num_channels > 1, percentile)
+            # チャンネル数が合わない場合(PCA圧縮後など)はキャリブレーションした範囲を使わない
+            if len(calibrated_range[0]) != num_channels:
+                calibrated_range = None
+        if calibrated_range is not None:
+            channel_min, channel_max = calibrated_range
+        else:
+            channel_min, channel_max = x.min(axis=0), x.max(axis=0)
+
+        if symmetric:
+            levels = (1 << (bits - 1)) - 1
+            max_abs = np.maximum(np.abs(channel_min), np.abs(channel_max))
+            scale = np.where(max_abs > 0, max_abs / levels, 1.0).astype(np.float32)
+            zero_point = np.zeros(num_channels, dtype=np.int32)
+            q_min, q_max = -levels, levels
+            dtype = np.int8 if bits <= 8 else np.int16
+        else:
+            levels = (1 << bits) - 1
+            # 0.0を誤差なく表せるように範囲には必ず0を含める
+            # 負の値がなければゼロ点は0になり、届かなかったパケットの値(0)は0.0に戻る
+            min_val = np.minimum(channel_min, 0)
+            max_val = np.maximum(channel_max, 0)
+            scale = np.where(max_val > min_val, (max_val - min_val) / levels, 1.0).astype(np.float32)
+            zero_point = np.clip(np.round(-min_val / scale), 0, levels).astype(np.int32)
+            q_min, q_max = 0, levels
+            dtype = np.uint8 if bits <= 8 else np.uint16
+
+        quantized = np.clip(np.round(x / scale) + zero_point, q_min, q_max).astype(dtype)
+        params = {
+            "bits": bits,
+            "scale": scale.tolist(),
+            "zero_point": zero_point.tolist(),
+            "symmetric": symmetric,
+            "shape": list(nparray_val.shape),
+        }
+        return quantized.reshape(nparray_val.shape), params
+
+    def extract_nparray_affine_int(self, quantized, params):
+        """
+        アフィン量子化の逆変換(x = (q - zero_point) * scale)
+        paramsはスケールとゼロ点を含む辞書で、スケールが複数の場合は最後の次元(チャンネル)ごとの値
+        """
+        quantized = np.asarray(quantized)
+        scale = np.asarray(params["scale"], dtype=np.float32)
+        zero_point = np.asarray(params["zero_point"], dtype=np.float32)
+        x = quantized.reshape(-1, len(scale)).astype(np.float32)
+        x -= zero_point
+        x *= scale
+        return x.reshape(quantized.shape)
+
+    def compress_nparray_packed_int(self, nparray_val, bits, per_channel=True, symmetric=False, calibration=None, percentile=None):
+        """
+        bitsビットにアフィン量子化して1バイトに8 // bits個ずつ詰めたuint8の1次元配列と、
+        逆量子化のためのパラメータの辞書(compress_nparray_affine_intと同じ)を返す
+        """
+        quantized, params = self.compress_nparray_affine_int(nparray_val, bits, per_channel, symmetric, calibration, percentile)
+        # 符号付きの場合は2の補数の下位bitsビットを詰める
+        values = quantized.reshape(-1).view(np.uint8) & ((1 << bits) - 1)
+        return self.pack_bits(values, bits), params
+
+    def extract_nparray_packed_int(self, packed, params):
+        """compress_nparray_packed_intの逆変換(paramsはcompress_nparray_packed_intが返した辞書)"""
+        shape = tuple(params["shape"])
+        bits = params["bits"]
+        quantized = self.unpack_bits(np.asarray(packed).astype(np.uint8), bits, int(np.prod(shape)))
+        if params.get("symmetric", False):
+            quantized = quantized.astype(np.int16)
+            quantized[quantized >= 1 << (bits - 1)] -= 1 << bits
+        return self.extract_nparray_affine_int(quantized.reshape(shape), params)
+
+    @staticmethod
+    def pack_bits(values, bits):
+        """bitsビットの値(uint8)を、1バイトに8 // bits個ずつ下位のビットから詰める"""
+        per_byte = 8 // bits
+        padded = np.zeros(-(-len(values) // per_byte) * per_byte, dtype=np.uint8)
+        padded[: len(values)] = values
+        shifts = np.arange(per_byte, dtype=np.uint8) * bits
+        return (padded.reshape(-1, per_byte) << shifts).sum(axis=1, dtype=np.uint8)
+
+    @staticmethod
+    def unpack_bits(packed, bits, count):
+        """pack_bitsの逆変換で、先頭からcount個の値を返す"""
+        per_byte = 8 // bits
+        shifts = np.arange(per_byte, dtype=np.uint8) * bits
+        return ((packed[:, np.newaxis] >> shifts) & ((1 << bits) - 1)).reshape(-1)[:count]
+
+    def get_work_buffer(self, nparray_val):
+        """
+        nparray_valをコピーした作業用バッファを返す
+        要素ごとの処理ではPythonのfloatで計算していたため、同じ結果になるようにfloat64で計算する
+        パイプラインなど複数のスレッドから同時に呼ばれるため、呼び出しごとに確保する
+        """
+        return np.array(nparray_val, dtype=np.float64)
+
+    def cast(self, work, dtype, out=None):
+        """作業用バッファの値をdtypeに変換する(outが指定された場合はoutに書き込む)"""
+        if out is None:
+            return work.astype(dtype)
+        np.copyto(out, work, casting='unsafe')
+        return out
 
 
     def compress_pca(self, val, rate, model, layer):
@@ -120,6 +352,19 @@ class Compressor:
         print('============================')
         return inversed
 
+    def load_calibration(self, model, layer):
+        """
+        create_calibration_table.pyで作成したテーブルから、モデルと分割レイヤーのLayerCalibrationを返す
+        テーブルがない場合や、キャリブレーションしていないレイヤーの場合はNoneを返す
+        """
+        if self.calibration_table is None:
+            calibration_table_path = os.path.dirname(__file__) + '/saved_model/calibration/calibration_table.npz'
+            if os.path.isfile(calibration_table_path):
+                self.calibration_table = CalibrationTable.load(calibration_table_path)
+            else:
+                self.calibration_table = CalibrationTable()
+        return self.calibration_table.get(os.path.basename(os.path.normpath(model)), layer)
+
     def load_pca_model(self, model, layer):
         loaded_model = None
         try:
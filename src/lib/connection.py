@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import socket
+import threading
+
+from src.conf import environment_settings
+from src.lib.framing import MessageReader, MessageWriter
+from src.lib.model.response import CommonResponse
+
+
+class Connection:
+    '''
+    他ノードとの間で張りっぱなしにするTCPコネクション
+    複数のスレッドから同時にリクエストを送信でき、レスポンスはrequest_idで送信元に振り分ける
+    '''
+    def __init__(self, host, port, logger, response_timeout=environment_settings.CONNECTION_RESPONSE_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.response_timeout = response_timeout
+        self.sock = None
+        self.writer = None
+        # self.lockはソケットとレスポンス待ちの管理用、self.send_lockは送信の排他用
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        # request_id -> [レスポンス到着を通知するEvent, レスポンス, 送信したソケット]
+        self.pending = {}
+
+    def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(environment_settings.CONNECTION_CONNECT_TIMEOUT_SECONDS)
+        try:
+            sock.connect((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        # レスポンスの待ち時間はrequestで管理するので、受信はブロックしたまま待つ
+        sock.settimeout(None)
+        self.sock = sock
+        self.writer = MessageWriter(sock)
+        thread_reader = threading.Thread(target=self.receive_responses, args=(sock,), daemon=True)
+        thread_reader.start()
+
+    def close(self):
+        with self.lock:
+            self.close_socket(self.sock)
+
+    def close_socket(self, sock):
+        if sock is None:
+            return
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if self.sock is sock:
+            self.sock = None
+            self.writer = None
+
+    def receive_responses(self, sock):
+        """受信したレスポンスを待っているリクエストに振り分ける"""
+        reader = MessageReader(sock)
+        try:
+            while True:
+                data = reader.read_message()
+                if data is None:
+                    break
+                response = CommonResponse.convert_from_json(str(data, "utf-8"))
+                with self.lock:
+                    waiter = self.pending.get(response.request_id)
+                if waiter is None:
+                    self.logger.warning(f"response for unknown request_id : {response.request_id}")
+                    continue
+                waiter[1] = response
+                waiter[0].set()
+        except OSError as e:
+            self.logger.debug(f"connection to {self.host}:{self.port} closed : {e}")
+        finally:
+            # 切断されたらこのソケットで送ったレスポンス待ちのリクエストを全て起こす
+            with self.lock:
+                self.close_socket(sock)
+                for waiter in self.pending.values():
+                    if waiter[2] is sock:
+                        waiter[0].set()
+
+    def request(self, request, message=None):
+        """
+        リクエストを送信し、同じrequest_idのレスポンスを返す
+        接続できない場合や、メッセージを最後まで送れなかった場合は、相手はリクエストを処理していないので
+        接続を張り直してMAX_RETRY_COUNT回まで送り直す
+        送信した後にresponse_timeout秒待ってもレスポンスが届かない場合や、レスポンスの前に切断された場合は、
+        相手がリクエストを処理したかどうか分からないので送り直さない(いずれの場合もConnectionErrorを送出する)
+        """
+        if message is None:
+            message = request.get_json().encode("ascii")
+        for retry_count in range(environment_settings.MAX_RETRY_COUNT):
+            waiter = [threading.Event(), None, None]
+            sock = None
+            try:
+                with self.lock:
+                    if self.sock is None:
+                        self.connect()
+                    sock = self.sock
+                    waiter[2] = sock
+                    self.pending[request.request_id] = waiter
+                    writer = self.writer
+                with self.send_lock:
+                    writer.write_message(message)
+                break
+            except OSError as e:
+                self.logger.warning(f"failed to send to {self.host}:{self.port} ({retry_count + 1}) : {e}")
+                # 他のスレッドが張り直した接続を閉じないように、このリクエストで使ったソケットだけを閉じる
+                with self.lock:
+                    self.pending.pop(request.request_id, None)
+                    self.close_socket(sock)
+        else:
+            raise ConnectionError(f"could not send to {self.host}:{self.port}")
+
+        responded = waiter[0].wait(self.response_timeout)
+        with self.lock:
+            self.pending.pop(request.request_id, None)
+            if not responded:
+                # レスポンスを返さない相手との接続は切断し、次の送信で張り直す
+                self.close_socket(sock)
+        if waiter[1] is not None:
+            return waiter[1]
+        if responded:
+            raise ConnectionError(f"connection to {self.host}:{self.port} closed before response")
+        raise ConnectionError(f"no response from {self.host}:{self.port} in {self.response_timeout} s")
+
+
+class ConnectionPool:
+    '''宛先(ホスト, ポート)ごとにConnectionを1本ずつ保持する'''
+    def __init__(self, logger, response_timeout=environment_settings.CONNECTION_RESPONSE_TIMEOUT_SECONDS):
+        self.logger = logger
+        self.response_timeout = response_timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, port):
+        with self.lock:
+            if (host, port) not in self.connections:
+                self.connections[(host, port)] = Connection(host, port, self.logger, self.response_timeout)
+            return self.connections[(host, port)]
+
+    def request(self, host, port, request, message=None):
+        return self.get(host, port).request(request, message)
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections = {}
+
+
+class MessageServer:
+    '''
+    長さ付きメッセージを受け付けるTCPサーバー
+    接続ごとにスレッドを立て、1つの接続で届く複数のメッセージを順に処理する
+    handlerは受信したメッセージを受け取り、レスポンスのバイト列(返さない場合はNone)を返す
+    '''
+    ACCEPT_TIMEOUT_SECONDS = 1.0
+
+    def __init__(self, host, port, handler, logger):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.logger = logger
+        self.is_running = False
+
+    def serve_forever(self):
+        self.is_running = True
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((self.host, self.port))
+            s.listen(5)
+            # 終了フラグを確認するためにタイムアウトを設定しておく
+            s.settimeout(self.ACCEPT_TIMEOUT_SECONDS)
+            self.logger.info('wait receive...')
+            while self.is_running:
+                try:
+                    conn, addr = s.accept()
+                except socket.timeout:
+                    continue
+                self.logger.debug(f"Connected from : {addr}")
+                conn.settimeout(None)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                thread_connection = threading.Thread(target=self.serve_connection, args=(conn, addr), daemon=True)
+                thread_connection.start()
+
+    def serve_connection(self, conn, addr):
+        reader = MessageReader(conn)
+        writer = MessageWriter(conn)
+        with conn:
+            try:
+                while self.is_running:
+                    data = reader.read_message()
+                    if data is None:
+                        break
+                    response = self.handler(data)
+                    if response is not None:
+                        writer.write_message(response)
+            except Exception as e:
+                self.logger.exception(e)
+        self.logger.debug(f"Disconnected from : {addr}")
+
+    def stop(self):
+        self.is_running = False
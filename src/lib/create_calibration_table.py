@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+# 各モデルの分割レイヤーごとに、キャリブレーション用の画像での中間層出力の範囲・パーセンタイル・ヒストグラムを求めて保存する
+# 使い方: python create_calibration_table.py [画像のディレクトリまたはX_*.npy]
+import itertools
+import sys
+from pathlib import Path
+
+import numpy as np
+from src.iot_device.image_source import open_image_source
+from src.lib import inference
+from src.lib.calibration_table import CalibrationTable, compute_layer_calibration
+from src.lib.logger import create_logger
+logger = create_logger(__name__)
+
+# 下記はcreate_pca_model.pyと同じく、src/libからの相対パス指定
+CALIBRATION_IMAGES_PATH = '../iot_device/data/mnist/X_train.npy'
+CALIBRATION_IMAGE_COUNT = 1000
+CALIBRATION_RANDOM_SEED = 0
+BATCH_SIZE = 100
+OUTPUT_PATH = '../lib/saved_model/calibration/calibration_table.npz'
+
+inference_models = [
+    { 'name': 'my_model', 'model': '../lib/saved_model/my_model', 'layers': 7 }, # Flattenは除外と思われる
+    { 'name': 'model_COMtune', 'model': '../lib/saved_model/model_COMtune', 'layers': 41 }
+]
+
+
+def load_calibration_images(path, count, seed):
+    """キャリブレーションに使う画像を(N, H, W)で返す(.npyの場合はランダムに選び、ディレクトリの場合は先頭から選ぶ)"""
+    if path.endswith('.npy'):
+        images = np.load(path, mmap_mode='r')
+        indices = np.random.RandomState(seed).choice(len(images), size=min(count, len(images)), replace=False)
+        return np.asarray(images[np.sort(indices)])
+    return np.stack([image.array for image in itertools.islice(open_image_source(path), count)])
+
+
+if __name__ == "__main__":
+    images_path = sys.argv[1] if len(sys.argv) > 1 else CALIBRATION_IMAGES_PATH
+    # IoTデバイスと同じく、画像の入力サイズを(28, 28)から(28, 28, 1)にする
+    X_calibration = np.expand_dims(load_calibration_images(images_path, CALIBRATION_IMAGE_COUNT, CALIBRATION_RANDOM_SEED), axis=-1)
+    logger.info("calibration images : {}, {}".format(images_path, X_calibration.shape))
+
+    calibration_table = CalibrationTable()
+    for inference_model in inference_models:
+        logger.info("{}, {}".format(inference_model['model'], inference_model['layers']))
+        for layer in range(1, inference_model['layers']):
+            try:
+                sub_model = inference.sub_model_cache.get(inference_model['model'], 1, layer)
+                activations = np.concatenate([
+                    np.asarray(sub_model(X_calibration[start : start + BATCH_SIZE]))
+                    for start in range(0, len(X_calibration), BATCH_SIZE)
+                ])
+                calibration = compute_layer_calibration(activations)
+                logger.info("model = {}, layer = {}, min = {}, max = {}, median = {}, std = {}".format(
+                    inference_model['name'], layer, calibration.min, calibration.max, calibration.median, calibration.std
+                ))
+                calibration_table.set(inference_model['name'], layer, calibration)
+            except Exception as e:
+                logger.error("Exception model = {}, layer = {}".format(inference_model['name'], layer))
+                logger.exception(e)
+
+    Path(OUTPUT_PATH).parent.mkdir(parents=True, exist_ok=True)
+    calibration_table.save(OUTPUT_PATH)
+    logger.info(OUTPUT_PATH)
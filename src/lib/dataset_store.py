@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import os
+
+import numpy as np
+
+
+class DatasetStore:
+    '''
+    データセットの画像とラベルを、分割(train, test)ごとに連続した1つの.npyとして保存・参照する
+    X_{split}.npyは(N, H, W)、y_{split}.npyは(N,)で、読み込みはnp.load(mmap_mode='r')で行う
+    画像1枚ずつのファイルを開いてデコードする必要がなく、参照した部分だけがメモリに載る
+    '''
+    SPLITS = ["train", "test"]
+
+    def __init__(self, root):
+        self.root = root
+
+    def images_path(self, split):
+        return os.path.join(self.root, f"X_{split}.npy")
+
+    def labels_path(self, split):
+        return os.path.join(self.root, f"y_{split}.npy")
+
+    def exists(self):
+        return all(
+            os.path.isfile(self.images_path(split)) and os.path.isfile(self.labels_path(split))
+            for split in self.SPLITS
+        )
+
+    def save(self, split, images, labels):
+        if len(images) != len(labels):
+            raise ValueError(f"number of images ({len(images)}) and labels ({len(labels)}) differ")
+        os.makedirs(self.root, exist_ok=True)
+        np.save(self.images_path(split), np.ascontiguousarray(images))
+        np.save(self.labels_path(split), np.ascontiguousarray(labels))
+
+    def images(self, split):
+        return np.load(self.images_path(split), mmap_mode='r')
+
+    def labels(self, split):
+        return np.load(self.labels_path(split), mmap_mode='r')
+
+    def range(self, split, start, stop):
+        """start番目からstop番目の手前までの(画像, ラベル)を返す(コピーせずメモリマップのまま返す)"""
+        return self.images(split)[start:stop], self.labels(split)[start:stop]
+
+    def sample(self, split, count, seed=None):
+        """重複しないcount個のインデックスを昇順で返す"""
+        num_images = len(self.labels(split))
+        indices = np.random.RandomState(seed).choice(num_images, size=min(count, num_images), replace=False)
+        return np.sort(indices)
+
+    @staticmethod
+    def labels_path_for(images_path):
+        """X_{split}.npyのパスから、同じディレクトリのy_{split}.npyのパスを返す(対応するものがない場合はNone)"""
+        directory, name = os.path.split(images_path)
+        if not (name.startswith("X_") and name.endswith(".npy")):
+            return None
+        return os.path.join(directory, "y_" + name[len("X_"):])
+
+    @classmethod
+    def for_images_path(cls, images_path):
+        """X_{split}.npyのパスから(DatasetStore, split)を返す(対応するy_{split}.npyがない場合はNone)"""
+        labels_path = cls.labels_path_for(images_path)
+        if labels_path is None or not os.path.isfile(labels_path):
+            return None
+        directory, name = os.path.split(images_path)
+        return cls(directory), name[len("X_") : -len(".npy")]
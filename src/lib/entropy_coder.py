@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import heapq
+import struct
+import zlib
+
+import numpy as np
+from src.conf import environment_settings
+
+# lz4、zstdはインストールされている場合のみ選択できる
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 符号化したパケットの先頭に付けるヘッダ(方式(1) 元のバイト数(4))
+# 方式は、符号化した方が大きくなったパケットをそのまま送るためのもの
+ENCODED_HEADER = struct.Struct("<BI")
+METHOD_STORED = 0
+METHOD_CODED = 1
+
+# ハフマン符号の最大の符号長(復号のテーブルは2 ** HUFFMAN_MAX_CODE_LENGTH要素)
+HUFFMAN_MAX_CODE_LENGTH = 12
+# ハフマン符号の表(使ったシンボル数(2) (シンボル(1) 符号長(1))の組)
+HUFFMAN_TABLE_SIZE = struct.Struct("<H")
+
+
+def huffman_code_lengths(frequencies, max_code_length=HUFFMAN_MAX_CODE_LENGTH):
+    """シンボルごとの出現回数から、符号長の配列を返す(出現しないシンボルは0)"""
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    while True:
+        lengths = np.zeros(len(frequencies), dtype=np.uint8)
+        symbols = np.flatnonzero(frequencies)
+        if len(symbols) == 1:
+            lengths[symbols] = 1
+            return lengths
+        # (出現回数, 同じ回数の場合の順番, 含まれるシンボル)を、出現回数の少ないものから2つずつまとめる
+        heap = [(int(frequencies[symbol]), int(symbol), [int(symbol)]) for symbol in symbols]
+        heapq.heapify(heap)
+        while len(heap) > 1:
+            frequency1, order1, symbols1 = heapq.heappop(heap)
+            frequency2, order2, symbols2 = heapq.heappop(heap)
+            lengths[symbols1 + symbols2] += 1
+            heapq.heappush(heap, (frequency1 + frequency2, min(order1, order2), symbols1 + symbols2))
+        if lengths.max() <= max_code_length:
+            return lengths
+        # 符号が長くなりすぎた場合は、出現回数の差を縮めて作り直す
+        frequencies = np.where(frequencies > 0, (frequencies >> 1) | 1, 0)
+
+
+def canonical_codes(lengths):
+    """符号長から、(符号長, シンボル)の順に割り当てた正準ハフマン符号を返す"""
+    codes = np.zeros(len(lengths), dtype=np.uint32)
+    code = 0
+    previous_length = 0
+    for symbol in np.lexsort((np.arange(len(lengths)), lengths)):
+        length = int(lengths[symbol])
+        if length == 0:
+            continue
+        code <<= length - previous_length
+        codes[symbol] = code
+        code += 1
+        previous_length = length
+    return codes
+
+
+def huffman_encode(data):
+    """バイト列をバイト単位のシンボルとしてハフマン符号化する(符号の表を先頭に付ける)"""
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    lengths = huffman_code_lengths(np.bincount(symbols, minlength=256))
+    codes = canonical_codes(lengths)
+    used = np.flatnonzero(lengths).astype(np.uint8)
+    table = HUFFMAN_TABLE_SIZE.pack(len(used)) + np.stack([used, lengths[used]], axis=1).tobytes()
+    if len(symbols) == 0:
+        return table
+
+    # シンボルごとの符号を1ビットずつに展開し、先頭のビットから順に並べる
+    symbol_lengths = lengths[symbols].astype(np.int64)
+    owners = np.repeat(np.arange(len(symbols)), symbol_lengths)
+    starts = np.cumsum(symbol_lengths) - symbol_lengths
+    shifts = (symbol_lengths[owners] - 1 - (np.arange(len(owners)) - starts[owners])).astype(np.uint32)
+    bits = ((codes[symbols][owners] >> shifts) & 1).astype(np.uint8)
+    return table + np.packbits(bits).tobytes()
+
+
+def huffman_decode(data, size):
+    """huffman_encodeで符号化したバイト列から、size個のシンボルを復号する"""
+    (num_used,) = HUFFMAN_TABLE_SIZE.unpack_from(data)
+    table_end = HUFFMAN_TABLE_SIZE.size + 2 * num_used
+    used_lengths = np.frombuffer(data, dtype=np.uint8, count=2 * num_used, offset=HUFFMAN_TABLE_SIZE.size).reshape(-1, 2)
+    lengths = np.zeros(256, dtype=np.uint8)
+    lengths[used_lengths[:, 0]] = used_lengths[:, 1]
+    codes = canonical_codes(lengths)
+    if size == 0:
+        return b""
+
+    # 先頭のmax_length bitから、符号のシンボルと符号長を引くテーブル
+    max_length = int(lengths.max())
+    table_symbols = np.zeros(1 << max_length, dtype=np.uint8)
+    table_lengths = np.zeros(1 << max_length, dtype=np.int64)
+    for symbol in np.flatnonzero(lengths):
+        shift = max_length - int(lengths[symbol])
+        table_symbols[codes[symbol] << shift : (codes[symbol] + 1) << shift] = symbol
+        table_lengths[codes[symbol] << shift : (codes[symbol] + 1) << shift] = lengths[symbol]
+
+    # 全てのビット位置について、その位置から始まる符号を読んだ場合のシンボルと次の符号の位置を求める
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=table_end))
+    num_bits = len(bits)
+    padded = np.concatenate([bits, np.zeros(max_length, dtype=np.uint8)]).astype(np.int64)
+    windows = np.zeros(num_bits + 1, dtype=np.int64)
+    for i in range(max_length):
+        windows = (windows << 1) | padded[i : i + num_bits + 1]
+    jump = np.minimum(np.arange(num_bits + 1) + table_lengths[windows], num_bits)
+
+    # i番目のシンボルの位置はjumpをi回たどった位置なので、jumpを2倍ずつ合成してまとめて求める
+    positions = np.zeros(size, dtype=np.int64)
+    indices = np.arange(size)
+    step = 0
+    while (1 << step) < size:
+        selected = (indices >> step) & 1 == 1
+        positions[selected] = jump[positions[selected]]
+        jump = jump[jump]
+        step += 1
+    return table_symbols[windows[positions]].tobytes()
+
+
+class EntropyCoder:
+    '''
+    量子化した後のパケットのペイロードを可逆圧縮する
+    パケットごとに独立して符号化するので、UDPで失われたパケットは他のパケットの復号に影響しない
+    '''
+    ENTROPY_NONE = 'None'
+    ENTROPY_ZLIB = 'zlib'
+    ENTROPY_LZ4 = 'lz4'
+    ENTROPY_ZSTD = 'zstd'
+    # バイト単位のシンボルに対する正準ハフマン符号(符号化・復号ともnumpyの配列演算で行う)
+    ENTROPY_HUFFMAN = 'Huffman'
+
+    @staticmethod
+    def coder_pattern():
+        """選択できる方式(インストールされていないライブラリの方式は含めない)"""
+        pattern = [EntropyCoder.ENTROPY_NONE, EntropyCoder.ENTROPY_ZLIB]
+        if lz4 is not None:
+            pattern.append(EntropyCoder.ENTROPY_LZ4)
+        if zstandard is not None:
+            pattern.append(EntropyCoder.ENTROPY_ZSTD)
+        pattern.append(EntropyCoder.ENTROPY_HUFFMAN)
+        return pattern
+
+    @staticmethod
+    def encode(coder_type, payload):
+        """
+        パケットのペイロード(np.ndarrayまたはバイト列)を符号化したバイト列を返す
+        coder_typeがNoneの場合はそのまま返す
+        """
+        if coder_type == EntropyCoder.ENTROPY_NONE:
+            return payload
+        data = payload.tobytes() if isinstance(payload, np.ndarray) else bytes(payload)
+        if coder_type == EntropyCoder.ENTROPY_ZLIB:
+            coded = zlib.compress(data, environment_settings.ENTROPY_CODER_ZLIB_LEVEL)
+        elif coder_type == EntropyCoder.ENTROPY_LZ4:
+            coded = lz4.block.compress(data, store_size=False)
+        elif coder_type == EntropyCoder.ENTROPY_ZSTD:
+            coded = zstandard.ZstdCompressor(level=environment_settings.ENTROPY_CODER_ZSTD_LEVEL).compress(data)
+        elif coder_type == EntropyCoder.ENTROPY_HUFFMAN:
+            coded = huffman_encode(data)
+        else:
+            raise ValueError(f"entropy coder {coder_type} is not supported")
+        # 小さくならなかったパケットはそのまま送る
+        if len(coded) >= len(data):
+            return ENCODED_HEADER.pack(METHOD_STORED, len(data)) + data
+        return ENCODED_HEADER.pack(METHOD_CODED, len(data)) + coded
+
+    @staticmethod
+    def decode(coder_type, data):
+        """encodeで符号化したバイト列から、元のペイロードのバイト列を返す"""
+        if coder_type == EntropyCoder.ENTROPY_NONE:
+            return data
+        data = bytes(data)
+        method, size = ENCODED_HEADER.unpack_from(data)
+        coded = data[ENCODED_HEADER.size:]
+        if method == METHOD_STORED:
+            decoded = coded
+        elif coder_type == EntropyCoder.ENTROPY_ZLIB:
+            decoded = zlib.decompress(coded)
+        elif coder_type == EntropyCoder.ENTROPY_LZ4:
+            decoded = lz4.block.decompress(coded, uncompressed_size=size)
+        elif coder_type == EntropyCoder.ENTROPY_ZSTD:
+            decoded = zstandard.ZstdDecompressor().decompress(coded, max_output_size=size)
+        elif coder_type == EntropyCoder.ENTROPY_HUFFMAN:
+            decoded = huffman_decode(coded, size)
+        else:
+            raise ValueError(f"entropy coder {coder_type} is not supported")
+        if len(decoded) != size:
+            raise ValueError(f"decoded size {len(decoded)} not matched {size}")
+        return decoded
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import math
+
+import numpy as np
+
+# UDPで失われたパケットを再送せずに復元するための前方誤り訂正(FEC)
+# データパケットをgroup_size個ずつのグループに分け、グループごとに全パケットのXORを1つのパリティパケットとして送る
+# パリティパケットのsequenceはデータパケットの後ろ(num_packets + グループ番号)にする
+# 1つのグループで失われたデータパケットが1つだけであれば、残りのパケットとパリティのXORで復元できる
+
+
+def num_groups(num_packets, group_size):
+    return math.ceil(num_packets / group_size)
+
+
+def group_range(group, num_packets, group_size):
+    """グループに含まれるデータパケットのsequenceの範囲を返す"""
+    return range(group * group_size, min((group + 1) * group_size, num_packets))
+
+
+def xor_payloads(payloads, length):
+    """
+    ペイロード(np.ndarrayまたはバイト列)のバイト列のXORを返す
+    lengthより短いペイロードは後ろを0で埋めたものとして扱う
+    """
+    parity = np.zeros(length, dtype=np.uint8)
+    for payload in payloads:
+        if isinstance(payload, np.ndarray):
+            data = np.ascontiguousarray(payload).view(np.uint8).reshape(-1)
+        else:
+            data = np.frombuffer(payload, dtype=np.uint8)
+        parity[: len(data)] ^= data
+    return parity.tobytes()
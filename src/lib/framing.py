@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import struct
+
+from src.conf import environment_settings
+
+# メッセージの先頭に付ける長さ(ビッグエンディアンの4バイト符号なし整数)
+MESSAGE_LENGTH = struct.Struct(">I")
+
+
+class MessageTooLargeError(ValueError):
+    pass
+
+
+class MessageWriter:
+    '''TCPストリームに長さ付きメッセージを書き込むクラス'''
+    def __init__(self, sock, max_message_size=environment_settings.MAX_MESSAGE_SIZE):
+        self.sock = sock
+        self.max_message_size = max_message_size
+
+    def write_message(self, data):
+        if len(data) > self.max_message_size:
+            raise MessageTooLargeError(f"message size {len(data)} exceeds {self.max_message_size}")
+        self.sock.sendall(MESSAGE_LENGTH.pack(len(data)) + data)
+
+
+class MessageReader:
+    '''
+    TCPストリームから長さ付きメッセージを1つずつ取り出すクラス
+    1回のrecvで届いたデータに複数のメッセージや途中までのメッセージが含まれていても、
+    内部のバッファに貯めて完全なメッセージだけを返す
+    '''
+    def __init__(
+        self,
+        sock,
+        max_message_size=environment_settings.MAX_MESSAGE_SIZE,
+        chunk_size=environment_settings.BUFFER_SIZE,
+    ):
+        self.sock = sock
+        self.max_message_size = max_message_size
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def next_message_size(self):
+        """バッファ内の次のメッセージの長さを返す(長さがまだ届いていない場合はNone)"""
+        if len(self.buffer) < MESSAGE_LENGTH.size:
+            return None
+        (length,) = MESSAGE_LENGTH.unpack_from(self.buffer)
+        # 壊れた長さで巨大なバッファを確保しないように上限を設ける
+        if length > self.max_message_size:
+            raise MessageTooLargeError(f"message size {length} exceeds {self.max_message_size}")
+        return length
+
+    def read_message(self):
+        """メッセージを1つ返す(メッセージの区切りで切断された場合はNoneを返す)"""
+        while True:
+            length = self.next_message_size()
+            if length is not None and MESSAGE_LENGTH.size + length <= len(self.buffer):
+                end = MESSAGE_LENGTH.size + length
+                message = bytes(self.buffer[MESSAGE_LENGTH.size:end])
+                del self.buffer[:end]
+                return message
+
+            # 残りのサイズが分かっている場合はまとめて受信する
+            recv_size = self.chunk_size
+            if length is not None:
+                recv_size = max(recv_size, MESSAGE_LENGTH.size + length - len(self.buffer))
+            chunk = self.sock.recv(recv_size)
+            if not chunk:
+                if self.buffer:
+                    raise ConnectionError("connection closed in the middle of a message")
+                return None
+            self.buffer += chunk
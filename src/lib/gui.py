@@ -5,7 +5,9 @@ from io import BytesIO
 from pathlib import Path
 import random
 import re
-from src.lib import compressor, settings_json
+import numpy as np
+from src.lib import compressor, entropy_coder, settings_json
+from src.lib.dataset_store import DatasetStore
 
 import time
 
@@ -61,13 +63,15 @@ class Gui:
             [sg.Text('Splitting layer:', size=(30, 1))],
             [sg.InputText(key='layer', size=(30, 1), default_text=self.settings.overall['layer'])],
             [sg.Text('Splitting mode:', size=(30, 1))],
-            [sg.Combo(['random', 'sequential'], default_value=self.settings.overall['mode'], readonly=True, size=(30, 1), key='mode')],
+            [sg.Combo(['random', 'sequential', 'importance'], default_value=self.settings.overall['mode'], readonly=True, size=(30, 1), key='mode')],
             [sg.Text('Splitting size:', size=(30, 1))],
             [sg.InputText(key='size', size=(30, 1), default_text=self.settings.overall['split_size'])],
             [sg.Text('PCA compression rate:', size=(30, 1))],
             [sg.InputText(key='PCArate', size=(30, 1), default_text=self.settings.overall['PCA_rate'])],
             [sg.Text('Qubit compression type:', size=(30, 1))],
             [sg.Combo(compressor.Compressor.qubit_pattern(), readonly=True, default_value=self.settings.overall['Qubit_type'], size=(30, 5), key='Qubittype')],
+            [sg.Text('Entropy coder:', size=(30, 1))],
+            [sg.Combo(entropy_coder.EntropyCoder.coder_pattern(), readonly=True, default_value=self.settings.overall.get('entropy_coder', entropy_coder.EntropyCoder.ENTROPY_NONE), size=(30, 5), key='EntropyCoder')],
             [sg.Text('Load Model:', size=(30, 1))],
             [sg.Checkbox('Every Time', size=(30, 1), key='reload', default=self.settings.overall['reload'])],
             [sg.Text('', size=(30,1))],
@@ -120,14 +124,14 @@ class Gui:
 
         self.default_values = {
             'model': 'Choose model', 'layer': '', 'mode': 'Choose mode', 'reload':'',
-            'size': '', 'PCArate': '', 'Qubittype': 'Choose type', 
+            'size': '', 'PCArate': '', 'Qubittype': 'Choose type', 'EntropyCoder': 'Choose type',
             'latency': '', 'variation': '', 'loss': '', 'band_limitation': '', 'arrival_rate': '', 'wait_time': '',
             'edge_latency': '', 'edge_variation': '', 'edge_loss': '', 'edge_band_limitation': ''
         }
 
         # 必須入力にしたい項目のkeyをcheck_keysに入れておく
         self.check_keys = [
-            'model', 'layer', 'mode', 'size', 'PCArate', 'Qubittype',
+            'model', 'layer', 'mode', 'size', 'PCArate', 'Qubittype', 'EntropyCoder',
             'latency', 'variation', 'loss', 'band_limitation', 'arrival_rate', 'wait_time',
             'edge_latency', 'edge_variation', 'edge_loss', 'edge_band_limitation'
         ]
@@ -146,6 +150,7 @@ class Gui:
             [sg.Text(f"Splitting size:\t{self.default_values['size']}", size=(30, 1), key='size')],
             [sg.Text(f"PCA compression rate:\t{self.default_values['PCArate']}", size=(30, 1), key='PCArate')],
             [sg.Text(f"Qubit compression type:\t{self.default_values['Qubittype']}", size=(40, 1), key='Qubittype')],
+            [sg.Text(f"Entropy coder:\t{self.default_values['EntropyCoder']}", size=(40, 1), key='EntropyCoder')],
             [sg.Text(f"Load Model Every Time:\t{self.default_values['reload']}", size=(40, 1), key='reload')],
             [sg.Text(f"Data transmission protocol:\t", size=(30, 1), key='protocol')],
         ]
@@ -238,6 +243,23 @@ class Gui:
             self.window1['img_area'].update(data=None)
             return None
         
+        # 画像をまとめた.npyの場合は、メモリマップで開きランダムに選んだ1枚を表示する
+        if img_file.endswith('.npy'):
+            try:
+                dataset = DatasetStore.for_images_path(img_path)
+                if dataset is not None:
+                    store, split = dataset
+                    (index,) = store.sample(split, 1)
+                    images = store.images(split)
+                else:
+                    images = np.load(img_path, mmap_mode='r')
+                    index = random.randrange(len(images))
+                return Image.fromarray(np.array(images[index]))
+            except (ValueError, TypeError):
+                self.window1['img_status'].update("Error: Cannot identify image stack !")
+                self.window1['img_area'].update(data=None)
+                return None
+
         # 画像ファイルを読み込む
         try:
             img_obj = Image.open(img_path)
@@ -365,6 +387,7 @@ class Gui:
                         self.values['size'],
                         self.values['PCArate'],
                         self.values['Qubittype'],
+                        self.values['EntropyCoder'],
                         self.values['reload'],
                         self.values['use_udp']
                     )
@@ -390,6 +413,7 @@ class Gui:
                     self.window2['size'].update(f"Splitting size:\t{self.values['size']}")
                     self.window2['PCArate'].update(f"PCA compression rate:\t{self.values['PCArate']}")
                     self.window2['Qubittype'].update(f"Qubit compression type:\t{self.values['Qubittype']}")
+                    self.window2['EntropyCoder'].update(f"Entropy coder:\t{self.values['EntropyCoder']}")
                     self.window2['reload'].update(f"do_reload_model:\t{self.values['reload']}")
                     self.window2['protocol'].update(f"Data transmission protocol:\t{'UDP' if self.values['use_udp'] else 'TCP'}")
                     self.window2['latency'].update(f"Network latency:\t{self.values['latency']}")
@@ -463,7 +487,7 @@ class Gui:
 
     def get_params(self):
 
-        model, layer, mode, size, PCArate, Qubittype, reload, use_udp = self.overall_param
+        model, layer, mode, size, PCArate, Qubittype, EntropyCoder, reload, use_udp = self.overall_param
         latency, variation, loss, band_limitation = self.iot_param
         arrival_rate, wait_time, edge_latency, edge_variation, edge_loss, edge_band_limitation = self.edge_param
 
@@ -494,7 +518,7 @@ class Gui:
         # TODO: GUI上の変数名と、コード上の変数名が異なる
         # →GUIの方を他に揃える
 
-        return (model, layer, mode, size, PCArate, Qubittype, reload, use_udp), \
+        return (model, layer, mode, size, PCArate, Qubittype, EntropyCoder, reload, use_udp), \
                 (latency, variation, loss, band_limitation), \
                 (arrival_rate, wait_time, edge_latency, edge_variation, edge_loss, edge_band_limitation), \
                 img_path
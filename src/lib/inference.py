@@ -1,10 +1,16 @@
 from re import A
+import collections
+import threading
 
+import numpy as np
+import tensorflow as tf
 from tensorflow.keras.datasets import mnist
 from tensorflow.keras.layers import Activation, Conv2D, Dense, Flatten, MaxPooling2D
 from tensorflow.keras.models import Model, Sequential, load_model
 from tensorflow.keras.utils import to_categorical
 
+from src.conf import environment_settings
+
 def load_data():
     """MNISTデータをロードして、Xは正規化、yはone-hotエンコーディング"""
     (X_train, y_train), (X_test, y_test) = mnist.load_data()
@@ -212,3 +218,70 @@ def inference_start_end_layer(path, start_layer_id, end_layer_id, X_test):
         sub_model.summary()
         return sub_model.predict(X_test)
 """
+
+
+class SubModel:
+    '''
+    start_layer_idからend_layer_idまでのmodelのレイヤーを、入力の形を固定したtf.functionで実行するクラス
+    バッチの次元以外の形を固定しているため、トレースは最初の呼び出しの1回だけで済む
+    '''
+    def __init__(self, model, start_layer_id, end_layer_id):
+        inputs = model.layers[start_layer_id - 1].input
+        outputs = model.layers[end_layer_id - 1].output
+        self.model = Model(inputs=inputs, outputs=outputs, name="sub_model")
+        self.input_shape = (None,) + tuple(self.model.input_shape[1:])
+        self.function = tf.function(
+            lambda X: self.model(X, training=False),
+            input_signature=[tf.TensorSpec(shape=self.input_shape, dtype=tf.float32)],
+        )
+
+    def __call__(self, X_test):
+        """推論結果を返す(バッチの次元がない入力は1個のバッチとして扱う)"""
+        X_test = np.asarray(X_test, dtype=np.float32)
+        if X_test.ndim == len(self.input_shape) - 1:
+            X_test = X_test[np.newaxis]
+        return self.function(X_test).numpy()
+
+
+class SubModelCache:
+    '''
+    (モデルのパス, start_layer_id, end_layer_id)ごとにSubModelを保持するLRUキャッシュ
+    推論対象ごとにModelを作り直したり、predictでトレースし直したりしないようにする
+    '''
+    def __init__(self, max_size=environment_settings.SUB_MODEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.models = {}
+        self.sub_models = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+    def load_model(self, path, reload=False):
+        """モデルを読み込む(読み込み済みの場合はreload=Trueの時だけ読み込み直す)"""
+        with self.lock:
+            if reload or path not in self.models:
+                self.models[path] = load_model(path)
+                # 読み込み直したモデルのサブモデルは作り直す
+                for key in [key for key in self.sub_models if key[0] == path]:
+                    del self.sub_models[key]
+            return self.models[path]
+
+    def get(self, path, start_layer_id, end_layer_id):
+        key = (path, start_layer_id, end_layer_id)
+        with self.lock:
+            if key in self.sub_models:
+                self.sub_models.move_to_end(key)
+                return self.sub_models[key]
+            sub_model = SubModel(self.load_model(path), start_layer_id, end_layer_id)
+            self.sub_models[key] = sub_model
+            while len(self.sub_models) > self.max_size:
+                self.sub_models.popitem(last=False)
+            return sub_model
+
+    def warm_up(self, path, start_layer_id, end_layer_id, batch_size=1):
+        """サブモデルを作成し、ダミーの入力で1回実行してトレースを済ませておく"""
+        sub_model = self.get(path, start_layer_id, end_layer_id)
+        sub_model(np.zeros((batch_size,) + sub_model.input_shape[1:], dtype=np.float32))
+        return sub_model
+
+
+# プロセス内で共有するサブモデルのキャッシュ
+sub_model_cache = SubModelCache()
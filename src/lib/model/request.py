@@ -1,15 +1,73 @@
 #!/usr/bin/env python3
 # -*- Coding: utf-8 -*-
+import base64
+import io
 import json
+import struct
 import uuid
 import datetime
+
+import numpy as np
+
+from src.conf import environment_settings
+
 T_DELTA = datetime.timedelta(hours=9)
 
+# result_dataの送信形式
+# JSON形式(base64エンコードした.npy)は互換用のフォールバックとして残している
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary"
+
+# バイナリフレームの固定長ヘッダ(リトルエンディアン)
+# magic(2) version(1) flags(1) command(2) request_id(16) session_id(16) sequence(4) dtype(1) num_elements(4)
+# ヘッダの後ろにnum_elements個のテンソル要素が生のリトルエンディアンバイト列で続く
+# session_idはエッジサーバーが受信中の推論対象を区別するためのID(ない場合は全て0)
+BINARY_FRAME_MAGIC = b"SC"
+BINARY_FRAME_VERSION = 2
+BINARY_FRAME_HEADER = struct.Struct("<2sBBH16s16sIBI")
+BINARY_FRAME_DTYPES = {
+    1: np.dtype("<u1"),
+    2: np.dtype("<u2"),
+    3: np.dtype("<f2"),
+    4: np.dtype("<f4"),
+    5: np.dtype("<f8"),
+    6: np.dtype("<i8"),
+    7: np.dtype("<i1"),
+    8: np.dtype("<i2"),
+}
+BINARY_FRAME_DTYPE_CODES = {dtype: dtype_code for dtype_code, dtype in BINARY_FRAME_DTYPES.items()}
+
+def is_binary_frame(data):
+    """受信データがバイナリフレームかどうかを返す(JSONは必ず'{'で始まる)"""
+    return bytes(data[:len(BINARY_FRAME_MAGIC)]) == BINARY_FRAME_MAGIC
+
+def encode_json_payload(payload):
+    """result_dataのpayloadをJSONに格納できるbase64文字列に変換する"""
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        # 画像を分割したバイト列はそのままbase64エンコードする
+        return base64.b64encode(payload).decode()
+    # テンソルは.npy形式にしてからbase64エンコードする
+    with io.BytesIO() as f:
+        np.save(f, payload)
+        return base64.b64encode(f.getvalue()).decode()
+
+def encode_sequence_bitmap(mask):
+    """パケットごとのTrue/Falseを1パケット1ビットに詰めたbase64文字列に変換する"""
+    return base64.b64encode(np.packbits(np.asarray(mask, dtype=bool)).tobytes()).decode()
+
+def decode_sequence_bitmap(bitmap, num_packets):
+    """encode_sequence_bitmapで変換した文字列から、Trueだったsequenceの配列を返す"""
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(bitmap), dtype=np.uint8), count=num_packets)
+    return np.flatnonzero(bits)
+
 class CommonRequest:
-    def __init__(self, command, request_id=str(uuid.uuid4())):
+    def __init__(self, command, request_id=None):
         self.data = None
         self.__command = command
-        self.__request_id = request_id
+        # レスポンスをrequest_idで振り分けるため、リクエストごとに異なるIDを割り当てる
+        self.__request_id = request_id if request_id is not None else str(uuid.uuid4())
 
     @property
     def request_id(self):
@@ -40,7 +98,7 @@ class CommonRequest:
         return self.get_json()
 
 class CnnModelRequest(CommonRequest):
-    def __init__(self, command, model, request_id=str(uuid.uuid4())):
+    def __init__(self, command, model, request_id=None):
         super(CnnModelRequest, self).__init__(command, request_id)
         self.__model = model
 
@@ -65,7 +123,19 @@ class IotDeviceResultSummaryRequest(CommonRequest):
         random_seed,
         filename='',
         shape=None,
-        request_id=str(uuid.uuid4()),
+        request_id=None,
+        wire_format=WIRE_FORMAT_JSON,
+        packet_length=environment_settings.IOT_SPLITTED_NUMPY_LENGTH,
+        session_id=None,
+        device_id=environment_settings.IOT_HOSTNAME,
+        device_port=environment_settings.IOT_PORT,
+        fec_group_size=0,
+        channel_order=None,
+        num_layers=1,
+        quantization_params=None,
+        dtype="float16",
+        entropy_coder="None",
+        sparse_encoding=False,
     ):
         super(IotDeviceResultSummaryRequest, self).__init__(command, request_id)
         self.__num_packets = num_packets
@@ -73,6 +143,27 @@ class IotDeviceResultSummaryRequest(CommonRequest):
         self.__random_seed = random_seed
         self.__filename = filename
         self.__shape = shape
+        self.__wire_format = wire_format
+        self.__packet_length = packet_length
+        # 推論対象ごとに異なるIDを割り当て、result_dataにも同じIDを付ける
+        self.__session_id = session_id if session_id is not None else str(uuid.uuid4())
+        # エッジサーバーがreceived_resultを返す宛先
+        self.__device_id = device_id
+        self.__device_port = device_port
+        # FECのパリティパケット1つあたりのデータパケット数(0の場合はFECを使わない)
+        self.__fec_group_size = fec_group_size
+        # split_modeがimportanceの場合の、チャンネルの送信順(それ以外の場合はNone)
+        self.__channel_order = channel_order
+        # プログレッシブ符号化のレイヤー数(num_elementsは全てのレイヤーの要素数の合計)
+        self.__num_layers = num_layers
+        # 逆量子化に必要なパラメータ(スケール、ゼロ点など、Compressorが返した辞書)
+        self.__quantization_params = quantization_params
+        # result_dataの要素の型(IoTデバイスが圧縮したテンソルの型のまま送る)
+        self.__dtype = dtype
+        # 各データパケットのペイロードを可逆圧縮した方式(EntropyCoderの方式名の文字列で、"None"の場合は圧縮しない。パリティパケットは圧縮しない)
+        self.__entropy_coder = entropy_coder
+        # 各データパケットを、0以外の要素だけを送る形式(sparse_codec.py)にしたかどうか(可逆圧縮はその後に行う)
+        self.__sparse_encoding = sparse_encoding
 
     @property
     def num_packets(self):
@@ -94,6 +185,54 @@ class IotDeviceResultSummaryRequest(CommonRequest):
     def shape(self):
         return self.__shape
 
+    @property
+    def wire_format(self):
+        return self.__wire_format
+
+    @property
+    def packet_length(self):
+        return self.__packet_length
+
+    @property
+    def session_id(self):
+        return self.__session_id
+
+    @property
+    def device_id(self):
+        return self.__device_id
+
+    @property
+    def device_port(self):
+        return self.__device_port
+
+    @property
+    def fec_group_size(self):
+        return self.__fec_group_size
+
+    @property
+    def channel_order(self):
+        return self.__channel_order
+
+    @property
+    def num_layers(self):
+        return self.__num_layers
+
+    @property
+    def quantization_params(self):
+        return self.__quantization_params
+
+    @property
+    def dtype(self):
+        return self.__dtype
+
+    @property
+    def entropy_coder(self):
+        return self.__entropy_coder
+
+    @property
+    def sparse_encoding(self):
+        return self.__sparse_encoding
+
     def get_json(self):
         self.data = {
             "command": self.command,
@@ -102,7 +241,19 @@ class IotDeviceResultSummaryRequest(CommonRequest):
             "num_elements": self.num_elements,
             "random_seed": self.random_seed,
             "filename": self.filename,
-            "shape": self.shape
+            "shape": self.shape,
+            "wire_format": self.wire_format,
+            "packet_length": self.packet_length,
+            "session_id": self.session_id,
+            "device_id": self.device_id,
+            "device_port": self.device_port,
+            "fec_group_size": self.fec_group_size,
+            "channel_order": self.channel_order,
+            "num_layers": self.num_layers,
+            "quantization_params": self.quantization_params,
+            "dtype": self.dtype,
+            "entropy_coder": self.entropy_coder,
+            "sparse_encoding": self.sparse_encoding,
         }
         return super(IotDeviceResultSummaryRequest, self).get_json()
 
@@ -117,7 +268,20 @@ class IotDeviceResultSummaryRequest(CommonRequest):
                 data["random_seed"],
                 data["filename"],
                 data["shape"],
-                data["request_id"]
+                data["request_id"],
+                data.get("wire_format", WIRE_FORMAT_JSON),
+                data.get("packet_length", environment_settings.IOT_SPLITTED_NUMPY_LENGTH),
+                data.get("session_id"),
+                data.get("device_id", environment_settings.IOT_HOSTNAME),
+                data.get("device_port", environment_settings.IOT_PORT),
+                data.get("fec_group_size", 0),
+                data.get("channel_order"),
+                data.get("num_layers", 1),
+                data.get("quantization_params"),
+                # 以前のIoTデバイスは全てfloat16に変換して送っていた
+                data.get("dtype", "float16"),
+                data.get("entropy_coder", "None"),
+                data.get("sparse_encoding", False),
             )
         except Exception as e:
             raise AttributeError(e)
@@ -125,10 +289,11 @@ class IotDeviceResultSummaryRequest(CommonRequest):
 
 #
 class IotDeviceResultDataRequest(CommonRequest):
-    def __init__(self, command, payload, sequence, request_id=str(uuid.uuid4())):
+    def __init__(self, command, payload, sequence, request_id=None, session_id=None):
         super(IotDeviceResultDataRequest, self).__init__(command, request_id)
         self.__payload = payload
         self.__sequence = sequence
+        self.__session_id = session_id
 
     @property
     def payload(self):
@@ -138,40 +303,106 @@ class IotDeviceResultDataRequest(CommonRequest):
     def sequence(self):
         return self.__sequence
 
+    @property
+    def session_id(self):
+        return self.__session_id
+
     def get_json(self):
         self.data = {
             "command": self.command,
             "request_id": self.request_id,
-            "payload": self.payload,
+            "payload": encode_json_payload(self.payload),
             "sequence": self.sequence,
+            "session_id": self.session_id,
         }
         return super(IotDeviceResultDataRequest, self).get_json()
 
+    def get_bytes(self):
+        """バイナリフレームに変換する(payloadはnp.ndarrayまたはbytes)"""
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = np.frombuffer(payload, dtype=np.uint8)
+        payload = np.ascontiguousarray(payload, dtype=payload.dtype.newbyteorder("<"))
+        if payload.dtype not in BINARY_FRAME_DTYPE_CODES:
+            raise ValueError(f"dtype {payload.dtype} is not supported in binary frame")
+        header = BINARY_FRAME_HEADER.pack(
+            BINARY_FRAME_MAGIC,
+            BINARY_FRAME_VERSION,
+            0,
+            self.command,
+            uuid.UUID(self.request_id).bytes,
+            uuid.UUID(self.session_id).bytes if self.session_id is not None else bytes(16),
+            self.sequence,
+            BINARY_FRAME_DTYPE_CODES[payload.dtype],
+            payload.size,
+        )
+        return b"".join((header, memoryview(payload).cast("B")))
+
+    @staticmethod
+    def convert_from_bytes(data):
+        if len(data) < BINARY_FRAME_HEADER.size:
+            raise ValueError("binary frame is shorter than header")
+        (
+            magic, version, _, command, request_id, session_id, sequence, dtype_code, num_elements
+        ) = BINARY_FRAME_HEADER.unpack_from(data)
+        if magic != BINARY_FRAME_MAGIC:
+            raise ValueError("binary frame magic not matched")
+        if version != BINARY_FRAME_VERSION:
+            raise ValueError(f"binary frame version {version} is not supported")
+        if dtype_code not in BINARY_FRAME_DTYPES:
+            raise ValueError(f"binary frame dtype {dtype_code} is not supported")
+        dtype = BINARY_FRAME_DTYPES[dtype_code]
+        if len(data) != BINARY_FRAME_HEADER.size + num_elements * dtype.itemsize:
+            raise ValueError("binary frame length not matched")
+        # 受信バッファをコピーせずにそのままnp.ndarrayとして参照する
+        payload = np.frombuffer(data, dtype=dtype, count=num_elements, offset=BINARY_FRAME_HEADER.size)
+        return IotDeviceResultDataRequest(
+            command,
+            payload,
+            sequence,
+            str(uuid.UUID(bytes=request_id)),
+            str(uuid.UUID(bytes=session_id)) if any(session_id) else None,
+        )
+
     @staticmethod
     def convert_from_json(json_str):
         data = json.loads(json_str)
         try:
             return IotDeviceResultDataRequest(
-                data["command"], data["payload"], data["sequence"], data["request_id"]
+                data["command"], data["payload"], data["sequence"], data["request_id"], data.get("session_id")
             )
         except Exception as e:
             raise AttributeError(e)
 
 class EdgeServerReceivedResultRequest(CommonRequest):
-    def __init__(self, command, code, request_id=str(uuid.uuid4())):
+    def __init__(self, command, code, request_id=None, session_id=None, missing=None):
         super(EdgeServerReceivedResultRequest, self).__init__(command, request_id)
         self.__code = code
+        self.__session_id = session_id
+        # code == MISSING_DATAの場合に、届いていないパケットをencode_sequence_bitmapで表したもの
+        self.__missing = missing
 
     @property
     def code(self):
         return self.__code
 
+    @property
+    def session_id(self):
+        return self.__session_id
+
+    @property
+    def missing(self):
+        return self.__missing
+
     def get_json(self):
         self.data = {
             "command": self.command,
             "request_id": self.request_id,
             "code": self.code,
+            "session_id": self.session_id,
         }
+        if self.missing is not None:
+            self.data["missing"] = self.missing
         return super(EdgeServerReceivedResultRequest, self).get_json()
 
     @staticmethod
@@ -179,14 +410,62 @@ class EdgeServerReceivedResultRequest(CommonRequest):
         data = json.loads(json_str)
         try:
             return EdgeServerReceivedResultRequest(
-                data["command"], data["code"], data["request_id"]
+                data["command"], data["code"], data["request_id"], data.get("session_id"), data.get("missing")
+            )
+        except Exception as e:
+            raise AttributeError(e)
+
+
+class EdgeServerReceptionReportRequest(CommonRequest):
+    '''
+    エッジサーバーがresult_dataの受信中に定期的にIoTデバイスへ送る受信報告
+    received_packetsはこれまでに受信したパケット数、highest_sequenceは受信したパケットの最大のsequence
+    '''
+    def __init__(self, command, session_id, received_packets, highest_sequence, request_id=None):
+        super(EdgeServerReceptionReportRequest, self).__init__(command, request_id)
+        self.__session_id = session_id
+        self.__received_packets = received_packets
+        self.__highest_sequence = highest_sequence
+
+    @property
+    def session_id(self):
+        return self.__session_id
+
+    @property
+    def received_packets(self):
+        return self.__received_packets
+
+    @property
+    def highest_sequence(self):
+        return self.__highest_sequence
+
+    def get_json(self):
+        self.data = {
+            "command": self.command,
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "received_packets": self.received_packets,
+            "highest_sequence": self.highest_sequence,
+        }
+        return super(EdgeServerReceptionReportRequest, self).get_json()
+
+    @staticmethod
+    def convert_from_json(json_str):
+        data = json.loads(json_str)
+        try:
+            return EdgeServerReceptionReportRequest(
+                data["command"],
+                data["session_id"],
+                data["received_packets"],
+                data["highest_sequence"],
+                data["request_id"],
             )
         except Exception as e:
             raise AttributeError(e)
 
 
 class EdgeServerInferenceResultRequest(CommonRequest):
-    def __init__(self, command, result, filename, request_id=str(uuid.uuid4())):
+    def __init__(self, command, result, filename, request_id=None):
         super(EdgeServerInferenceResultRequest, self).__init__(command, request_id)
         self.__result = result
         self.__filename = filename
@@ -219,7 +498,7 @@ class EdgeServerInferenceResultRequest(CommonRequest):
             raise AttributeError(e)
 
 class CloudServerSettingRequest(CommonRequest):
-    def __init__(self, command, setting, request_id=str(uuid.uuid4())):
+    def __init__(self, command, setting, request_id=None):
         super(CloudServerSettingRequest, self).__init__(command, request_id)
         self.__setting = setting
 
@@ -251,7 +530,7 @@ class ProcessTimeRequest(CommonRequest):
         command,
         process_name,
         process_time = (datetime.datetime.now(datetime.timezone(T_DELTA, 'JST'))).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3],
-        request_id=str(uuid.uuid4())
+        request_id=None
     ):
         super(ProcessTimeRequest, self).__init__(command, request_id)
         self.__process_name = process_name
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import threading
+import time
+
+
+class TokenBucket:
+    '''
+    送信レート(バイト/秒)を守るためのトークンバケット
+    rateでトークンが溜まり、burstまでは続けて送信できる
+    受信報告を処理するスレッドがset_rateを呼ぶ間も送信スレッドがconsumeを呼ぶため、状態はself.lockで守る
+    '''
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.last_time = clock()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+
+    def refill(self):
+        """経過時間分のトークンを溜める(self.lockを取得した状態で呼ぶ)"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def consume(self, nbytes):
+        """nbytesを送信できるまで待つ"""
+        with self.lock:
+            self.refill()
+            # 足りないトークンは前借りし、溜まるまでの時間だけ待つ
+            self.tokens -= nbytes
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+        # 待っている間もset_rateを呼べるように、ロックを外してから待つ
+        if wait_time > 0:
+            self.sleep(wait_time)
+
+
+class PacingController:
+    '''
+    受信側からの受信報告をもとに送信レートを調整する(AIMDに近い方式)
+    報告の間に失われたパケットの割合がloss_thresholdを超えた場合は輻輳とみなしてレートを下げ、
+    それ以外の場合はincrease_factor倍ずつレートを上げる
+    tcなどでランダムに失われる分はloss_thresholdに含めておく
+    '''
+    def __init__(self, initial_rate, min_rate, max_rate, loss_threshold, increase_factor=1.1):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.loss_threshold = loss_threshold
+        self.increase_factor = increase_factor
+        self.reported_sent_packets = 0
+        self.reported_received_packets = 0
+        self.last_loss_rate = 0.0
+
+    def reset_counters(self):
+        """新しい送信を始める時に、受信報告の数え方をリセットする(レートは引き継ぐ)"""
+        self.reported_sent_packets = 0
+        self.reported_received_packets = 0
+
+    def on_report(self, sent_packets, received_packets):
+        """
+        sent_packetsは受信報告の時点で受信側に届いているはずのパケット数、received_packetsは実際に受信したパケット数
+        調整後のレートを返す
+        """
+        sent = sent_packets - self.reported_sent_packets
+        received = received_packets - self.reported_received_packets
+        if sent <= 0:
+            return self.rate
+        self.reported_sent_packets = sent_packets
+        self.reported_received_packets = received_packets
+
+        self.last_loss_rate = min(max(1.0 - received / sent, 0.0), 1.0)
+        if self.last_loss_rate > self.loss_threshold:
+            self.rate = max(self.min_rate, self.rate * (1.0 - self.last_loss_rate / 2))
+        else:
+            self.rate = min(self.max_rate, self.rate * self.increase_factor)
+        return self.rate
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import math
+
+import numpy as np
+from src.conf import environment_settings
+
+
+def channel_order_by_energy(tensor, values_per_element=1):
+    """
+    最後の次元をチャンネルとみなし、チャンネルごとの二乗和が大きい順にチャンネル番号を並べたリストを返す
+    tensorには量子化する前の中間層出力を渡す(量子化した値やリファインメントレイヤーでは重要度を正しく求められない)
+    values_per_elementは送信する1要素に詰める値の数(4bit・2bitで詰める場合は8 // bits)で、
+    連続するvalues_per_element個のチャンネルを1つのチャンネルとしてまとめた順番を返す
+    """
+    x = np.asarray(tensor, dtype=np.float32)
+    num_channels = x.shape[-1] if x.ndim >= 2 else 1
+    if num_channels % values_per_element != 0:
+        # 1要素に異なるチャンネルの組が入るため、チャンネルごとに並べ替えずに先頭から送る
+        return [0]
+    energy = np.square(x.reshape(-1, num_channels)).sum(axis=0)
+    energy = energy.reshape(-1, values_per_element).sum(axis=1)
+    # 同じ値のチャンネルは番号の小さい順にする
+    return np.argsort(-energy, kind="stable").tolist()
+
+
+def channel_major_permutation(channel_order, num_elements):
+    """
+    channel_orderのチャンネル順に、各チャンネルの要素を(チャンネル以外の)元の順番で並べるインデックスを返す
+    平坦化したテンソルのi番目の要素のチャンネルはi % チャンネル数
+    """
+    num_channels = len(channel_order)
+    positions = np.arange(num_elements // num_channels) * num_channels
+    return (np.asarray(channel_order)[:, np.newaxis] + positions[np.newaxis, :]).reshape(-1)
+
+
+def transport_dtype(dtype):
+    """テンソルを送る時の型(float64はPCA圧縮などで生じるものなので、モデルと同じfloat32にする)"""
+    dtype = np.dtype(dtype)
+    return np.dtype(np.float32) if dtype == np.float64 else dtype
+
+
+def layered_permutation(k, num_layers):
+    """
+    1つのレイヤー内の並べ替えkを、先頭の次元で分けたnum_layers個のレイヤーに順に適用するインデックスを返す
+    前のレイヤーの要素を全て送ってから、次のレイヤーの要素を送る
+    """
+    return np.concatenate([k + layer * len(k) for layer in range(num_layers)])
+
+
+class TensorPacketizer:
+    '''中間層出力を送信順に並べ替え、パケットごとのペイロードに分割するクラス'''
+    SPLIT_MODE_RANDOM = 'random'
+    SPLIT_MODE_SEQUENTIAL = 'sequential'
+    # 重要度(チャンネルごとの二乗和)の大きいチャンネルから送る
+    # reach_rateやwaiting_timeで受信を打ち切った場合も、重要なチャンネルが先に揃う
+    SPLIT_MODE_IMPORTANCE = 'importance'
+
+    def __init__(
+        self,
+        tensor,
+        split_mode,
+        packet_length=environment_settings.IOT_SPLITTED_NUMPY_LENGTH,
+        random_seed=environment_settings.IOT_RANDOM_SEED_SHUFFLE,
+        dtype=None,
+        num_layers=1,
+        channel_order=None,
+    ):
+        # xは中間層出力を平坦化したもの(連続したメモリであればコピーしない)
+        x = np.ravel(tensor)
+        n = len(x)
+        # dtypeを指定しない場合は、圧縮したテンソルの型のまま送る
+        self.dtype = np.dtype(dtype) if dtype is not None else transport_dtype(x.dtype)
+        dtype = self.dtype
+        # num_layersが2以上の場合、tensorの先頭の次元はプログレッシブ符号化のレイヤーで、並べ替えはレイヤーごとに行う
+        layer_size = n // num_layers
+        # 受信側で並べ替えに使うチャンネルの送信順(importanceの場合のみ)
+        self.channel_order = None
+        if split_mode == self.SPLIT_MODE_RANDOM:
+            # self.kはパケットをランダムに並べ替えるためのインデックス
+            # 受信側でも同じシード値を用いるので、元の順番に並べ直すことができる
+            # パイプラインの他のステージと乱数の状態を共有しないように、np.random.seedと同じ列を生成するRandomStateを使う
+            self.k = np.random.RandomState(random_seed).permutation(layer_size)
+        elif split_mode == self.SPLIT_MODE_IMPORTANCE:
+            # 要素ごとの順番ではなくチャンネルの順番だけを送ればよいので、サマリーに載せる情報が小さい
+            # 量子化やプログレッシブ符号化をしたtensorの場合は、量子化する前の中間層出力から求めたchannel_orderを渡す
+            self.channel_order = list(channel_order) if channel_order is not None else channel_order_by_energy(tensor)
+            self.k = channel_major_permutation(self.channel_order, layer_size)
+        elif split_mode == self.SPLIT_MODE_SEQUENTIAL:
+            self.k = np.arange(layer_size)
+        else:
+            raise Exception('IOT_SPLIT_MODE has invalid value.')
+        if num_layers > 1:
+            self.k = layered_permutation(self.k, num_layers)
+
+        if split_mode == self.SPLIT_MODE_SEQUENTIAL:
+            self.permuted = np.ascontiguousarray(x, dtype=dtype)
+        else:
+            # 並べ替えと型変換はテンソル全体に対して一度だけ行う
+            self.permuted = np.take(x, self.k).astype(dtype, copy=False)
+
+        self.packet_length = packet_length
+        self.num_layers = num_layers
+        self.num_elements = n
+        self.num_packets = math.ceil(n / packet_length)
+
+    def packet(self, sequence):
+        """sequence番目のパケットのペイロードを返す(並べ替え済み配列のビューでありコピーしない)"""
+        start = sequence * self.packet_length
+        return self.permuted[start : start + self.packet_length]
+
+    def packets(self):
+        """
+        (sequence, ペイロード)を先頭のパケットから順に返すジェネレータ
+        送信側は全パケットの作成を待たずに送信を開始できる
+        """
+        for sequence in range(self.num_packets):
+            yield sequence, self.packet(sequence)
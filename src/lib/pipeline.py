@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import itertools
+import queue
+import threading
+import time
+
+
+def batched(items, batch_size):
+    """itemsをbatch_size個ずつのリストにして順に返す(itemsは必要な分だけ読み進める)"""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class PipelineStage:
+    '''パイプラインの1つのステージ(funcは受け取った要素を処理し、次のステージに渡す要素を返す)'''
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.num_items = 0
+        # funcを実行していた時間の合計
+        self.busy_seconds = 0.0
+        # 要素が入力キューで待っていた時間
+        self.total_queue_wait_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def occupancy(self, elapsed_seconds):
+        return self.busy_seconds / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+    def average_queue_wait_seconds(self):
+        return self.total_queue_wait_seconds / self.num_items if self.num_items > 0 else 0.0
+
+
+class Pipeline:
+    '''
+    各ステージを専用のスレッドで実行し、ステージの間を上限付きのキューでつなぐパイプライン
+    全体の処理時間が各ステージの処理時間の合計ではなく、最も遅いステージの処理時間に近づく
+    キューがいっぱいの場合は前のステージが待つため、メモリ上に溜まる要素の数はqueue_depthで抑えられる
+    '''
+    # 終了を表す要素
+    END = object()
+
+    def __init__(self, stages, queue_depth, logger):
+        self.stages = stages
+        self.queue_depth = queue_depth
+        self.logger = logger
+        self.elapsed_seconds = 0.0
+
+    def run(self, items):
+        """itemsを全て処理し終えるまで待つ"""
+        queues = [queue.Queue(maxsize=self.queue_depth) for _ in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            output_queue = queues[i + 1] if i + 1 < len(queues) else None
+            thread = threading.Thread(target=self.run_stage, args=(stage, queues[i], output_queue), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        start_time = time.monotonic()
+        for item in items:
+            queues[0].put((item, time.monotonic()))
+        queues[0].put((self.END, time.monotonic()))
+        for thread in threads:
+            thread.join()
+        self.elapsed_seconds = time.monotonic() - start_time
+
+    def run_stage(self, stage, input_queue, output_queue):
+        while True:
+            item, enqueued_time = input_queue.get()
+            if item is self.END:
+                if output_queue is not None:
+                    output_queue.put((self.END, time.monotonic()))
+                return
+
+            queue_wait_seconds = time.monotonic() - enqueued_time
+            stage.total_queue_wait_seconds += queue_wait_seconds
+            stage.max_queue_wait_seconds = max(stage.max_queue_wait_seconds, queue_wait_seconds)
+            stage.num_items += 1
+
+            stage_start_time = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                # 失敗した要素は次のステージに渡さず、残りの要素の処理を続ける
+                self.logger.exception(e)
+                result = None
+            stage.busy_seconds += time.monotonic() - stage_start_time
+
+            if output_queue is not None and result is not None:
+                output_queue.put((result, time.monotonic()))
+
+    def statistics(self):
+        """ステージごとの稼働率とキューでの待ち時間を表す文字列のリストを返す"""
+        lines = ["Pipeline elapsed time = {:.9f} s, queue depth = {}".format(self.elapsed_seconds, self.queue_depth)]
+        for stage in self.stages:
+            lines.append(
+                "Pipeline stage {}: items = {}, busy time = {:.9f} s, occupancy = {:.2f} %, average queue wait = {:.9f} s, max queue wait = {:.9f} s".format(
+                    stage.name,
+                    stage.num_items,
+                    stage.busy_seconds,
+                    stage.occupancy(self.elapsed_seconds) * 100,
+                    stage.average_queue_wait_seconds(),
+                    stage.max_queue_wait_seconds,
+                )
+            )
+        return lines
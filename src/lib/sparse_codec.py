@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+import struct
+
+import numpy as np
+
+# ReLUの直後で分割した中間層出力は0の要素が多いので、パケットごとに0以外の要素だけを送る
+# パケットの先頭に付けるヘッダ(形式(1) パケットの要素数(4))
+SPARSE_HEADER = struct.Struct("<BI")
+# 全ての要素をそのまま並べる
+SPARSE_MODE_DENSE = 0
+# 要素ごとに0以外かどうかを1ビットで表したビットマップの後ろに、0以外の要素を並べる
+SPARSE_MODE_BITMAP = 1
+# 0以外の要素のパケット内の位置の後ろに、0以外の要素を並べる(0以外の要素がごく少ない場合)
+SPARSE_MODE_INDEX = 2
+
+
+def index_dtype(num_elements):
+    """パケット内の位置を表す型"""
+    return np.dtype("<u2") if num_elements <= 1 << 16 else np.dtype("<u4")
+
+
+def encode_sparse_payload(payload):
+    """
+    パケットのペイロード(np.ndarray)を、密・ビットマップ・位置のうち最も小さくなる形式のバイト列にする
+    0以外の要素の割合をパケットごとに見て選ぶので、0の少ないパケットは密のまま送る
+    """
+    values = np.ascontiguousarray(np.ravel(payload), dtype=payload.dtype.newbyteorder("<"))
+    num_elements = len(values)
+    nonzero = np.flatnonzero(values)
+    sizes = {
+        SPARSE_MODE_DENSE: values.nbytes,
+        SPARSE_MODE_BITMAP: (num_elements + 7) // 8 + len(nonzero) * values.itemsize,
+        SPARSE_MODE_INDEX: len(nonzero) * (index_dtype(num_elements).itemsize + values.itemsize),
+    }
+    mode = min(sizes, key=sizes.get)
+    header = SPARSE_HEADER.pack(mode, num_elements)
+    if mode == SPARSE_MODE_DENSE:
+        return header + values.tobytes()
+    if mode == SPARSE_MODE_BITMAP:
+        return header + np.packbits(values != 0).tobytes() + values[nonzero].tobytes()
+    return header + nonzero.astype(index_dtype(num_elements)).tobytes() + values[nonzero].tobytes()
+
+
+def decode_sparse_payload(data, dtype):
+    """encode_sparse_payloadで変換したバイト列から、パケットの全ての要素を0で埋めて戻したnp.ndarrayを返す"""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    mode, num_elements = SPARSE_HEADER.unpack_from(data)
+    body = memoryview(data)[SPARSE_HEADER.size:]
+    if mode == SPARSE_MODE_DENSE:
+        return np.frombuffer(body, dtype=dtype, count=num_elements)
+
+    values = np.zeros(num_elements, dtype=dtype)
+    if mode == SPARSE_MODE_BITMAP:
+        bitmap_size = (num_elements + 7) // 8
+        mask = np.unpackbits(np.frombuffer(body, dtype=np.uint8, count=bitmap_size), count=num_elements).view(bool)
+        values[mask] = np.frombuffer(body, dtype=dtype, offset=bitmap_size)
+    elif mode == SPARSE_MODE_INDEX:
+        positions_dtype = index_dtype(num_elements)
+        num_nonzero = len(body) // (positions_dtype.itemsize + dtype.itemsize)
+        positions = np.frombuffer(body, dtype=positions_dtype, count=num_nonzero)
+        values[positions] = np.frombuffer(body, dtype=dtype, offset=num_nonzero * positions_dtype.itemsize)
+    else:
+        raise ValueError(f"sparse mode {mode} is not supported")
+    return values
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib.array_cache import ArrayLruCache
+
+
+class TestArrayLruCache(unittest.TestCase):
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = ArrayLruCache(max_bytes=300)
+        for key in ["a", "b", "c"]:
+            cache.put(key, np.zeros(100, dtype=np.uint8))
+        # aを参照したので、次に追加した時にはbが捨てられる
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", np.zeros(100, dtype=np.uint8))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.total_bytes, 300)
+
+    def test_get_or_load_loads_once(self):
+        cache = ArrayLruCache(max_bytes=1000)
+        calls = []
+
+        def load():
+            calls.append(1)
+            return np.arange(10)
+
+        first = cache.get_or_load("x", load)
+        second = cache.get_or_load("x", load)
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(first.flags.writeable)
+
+    def test_array_larger_than_limit_is_not_cached(self):
+        cache = ArrayLruCache(max_bytes=10)
+        array = cache.put("x", np.zeros(100, dtype=np.uint8))
+        self.assertEqual(array.shape, (100,))
+        self.assertIsNone(cache.get("x"))
+        self.assertEqual(cache.total_bytes, 0)
+
+if __name__ == "__main__":
+    unittest.main()
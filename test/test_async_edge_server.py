@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import logging
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.conf import environment_settings
+from src.edge_server.async_edge_server import AsyncEdgeServer
+from src.lib import command
+from src.lib.connection import ConnectionPool
+from src.lib.model.request import CommonRequest, IotDeviceResultDataRequest, IotDeviceResultSummaryRequest
+from src.lib.packetizer import TensorPacketizer
+from src.lib.tc import Tc
+
+logger = logging.getLogger(__name__)
+
+WAITING_TIME_MILLISECONDS = 300
+PACKET_LENGTH = 64
+
+
+def unused_port(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestAsyncEdgeServer(unittest.TestCase):
+    def setUp(self):
+        self.tcp_port = unused_port(socket.SOCK_STREAM)
+        self.udp_port = unused_port(socket.SOCK_DGRAM)
+        for name, value in [
+            ("EDGE_HOSTNAME", "127.0.0.1"),
+            ("EDGE_PORT", self.tcp_port),
+            ("EDGE_UDP_PORT", self.udp_port),
+            ("UDP_RETRANSMISSION", False),
+        ]:
+            patcher = mock.patch.object(environment_settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for patcher in [mock.patch.object(Tc, "reset_tc"), mock.patch("src.lib.save_result.save_json_or_txt")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.edge_server = AsyncEdgeServer()
+        self.edge_server.setting = {
+            'layer': 1,
+            'split_mode': 'random',
+            'waiting_time': WAITING_TIME_MILLISECONDS,
+            'reach_rate': 1.0,
+            'use_udp': True,
+            'current_time_str': 'test',
+            'edge_network_delay_time': 0,
+            'edge_network_dispersion_time': 0,
+            'edge_network_loss_rate': 0,
+            'edge_network_band_limitation': 0,
+        }
+        # IoTデバイスへの通知と推論の代わりに、呼ばれた順番と受信したデータを記録する
+        self.events = []
+        self.inferred = {}
+        self.all_inferred = threading.Event()
+        self.expected_inferences = 0
+        self.edge_server.send_received_result = self.send_received_result
+        self.edge_server.do_inference = self.do_inference
+
+        self.thread = threading.Thread(target=self.edge_server.receive_common_request, daemon=True)
+        self.thread.start()
+        self.pool = ConnectionPool(logger)
+        self.addCleanup(self.stop_edge_server)
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(self.udp_socket.close)
+
+    def stop_edge_server(self):
+        self.pool.request("127.0.0.1", self.tcp_port, CommonRequest(command.EDGE_END))
+        self.pool.close()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+
+    def send_received_result(self, mode, session):
+        session.latest_received_time = None
+        self.events.append((session.device_id, mode, time.time()))
+
+    def do_inference(self, session):
+        self.events.append((session.device_id, "inference", time.time()))
+        self.inferred[session.device_id] = (session.iot_result_data_received_packets, session.iot_result_data.copy())
+        if len(self.inferred) == self.expected_inferences:
+            self.all_inferred.set()
+
+    def send_summary(self, device_id, packetizer):
+        request = IotDeviceResultSummaryRequest(
+            command.IOT_SEND_RESULT_SUMMARY,
+            packetizer.num_packets,
+            packetizer.num_elements,
+            environment_settings.IOT_RANDOM_SEED_SHUFFLE,
+            packet_length=PACKET_LENGTH,
+            device_id=device_id,
+        )
+        for _ in range(50):
+            try:
+                self.pool.request("127.0.0.1", self.tcp_port, request)
+                return request.session_id
+            except ConnectionError:
+                # イベントループがlistenを始めるまで待つ
+                time.sleep(0.05)
+        self.fail("edge server did not start")
+
+    def send_packet(self, session_id, sequence, payload):
+        request = IotDeviceResultDataRequest(command.IOT_SEND_RESULT_DATA, payload, sequence, session_id=session_id)
+        self.udp_socket.sendto(request.get_bytes(), ("127.0.0.1", self.udp_port))
+
+    def test_reception_deadline(self):
+        np.random.seed(0)
+        packetizer = TensorPacketizer(np.random.rand(1, 10, 10, 8).astype(np.float32), TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=PACKET_LENGTH)
+        packets = list(packetizer.packets())
+        self.expected_inferences = 1
+        session_id = self.send_summary("device", packetizer)
+        # 半分のパケットだけ送り、残りは届かなかったことにする
+        for sequence, payload in packets[:len(packets) // 2]:
+            self.send_packet(session_id, sequence, payload)
+        last_sent_time = time.time()
+
+        self.assertTrue(self.all_inferred.wait(5))
+        # 待機時間の経過を通知してから、受信したデータで推論する
+        self.assertEqual([event for _, event, _ in self.events], ["failure", "success", "inference"])
+        notified_time = self.events[0][2]
+        # 最後の受信からwaiting_timeが経ってから、受信を打ち切る
+        self.assertGreaterEqual(notified_time - last_sent_time, WAITING_TIME_MILLISECONDS / 1000.0 - 0.05)
+        self.assertEqual(self.inferred["device"][0], len(packets) // 2)
+        self.assertEqual(self.edge_server.timer_handles, {})
+
+    def test_interleaved_sessions(self):
+        np.random.seed(1)
+        tensors = {device_id: np.random.rand(1, 10, 10, 8).astype(np.float32) for device_id in ["a", "b"]}
+        packetizers = {
+            device_id: TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=PACKET_LENGTH)
+            for device_id, tensor in tensors.items()
+        }
+        self.expected_inferences = 2
+        session_ids = {device_id: self.send_summary(device_id, packetizer) for device_id, packetizer in packetizers.items()}
+
+        # aへの通知はbの推論が終わるまで応答しない(応答の遅いIoTデバイスがあっても、他の受信は止まらない)
+        b_inferred = threading.Event()
+        notify = self.send_received_result
+        infer = self.do_inference
+
+        def send_received_result(mode, session):
+            if session.device_id == "a":
+                b_inferred.wait(5)
+            notify(mode, session)
+
+        def do_inference(session):
+            infer(session)
+            if session.device_id == "b":
+                b_inferred.set()
+        self.edge_server.send_received_result = send_received_result
+        self.edge_server.do_inference = do_inference
+
+        # aのパケットを先に送り終えるように、2つのセッションのパケットを交互に送る
+        packets = {device_id: list(packetizer.packets()) for device_id, packetizer in packetizers.items()}
+        for (sequence_a, payload_a), (sequence_b, payload_b) in zip(packets["a"], packets["b"]):
+            self.send_packet(session_ids["a"], sequence_a, payload_a)
+            self.send_packet(session_ids["b"], sequence_b, payload_b)
+            time.sleep(0.001)
+
+        self.assertTrue(self.all_inferred.wait(5))
+        for device_id, tensor in tensors.items():
+            received_packets, received_data = self.inferred[device_id]
+            self.assertEqual(received_packets, packetizers[device_id].num_packets)
+            np.testing.assert_array_equal(received_data, tensor.flatten().astype(np.float16))
+        # waiting_timeより前に、十分なデータが届いたことを通知する
+        self.assertEqual(sorted(mode for _, mode, _ in self.events if mode != "inference"), ["success", "success"])
+        self.assertEqual([device_id for device_id, event, _ in self.events if event == "inference"], ["b", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
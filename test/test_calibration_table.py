@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.lib.calibration_table import CalibrationTable, compute_layer_calibration
+from src.lib.compressor import Compressor
+
+
+class TestCalibrationTable(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.activations = np.maximum(np.random.normal(0.5, 1.0, (20, 7, 7, 4)), 0).astype(np.float32)
+        self.calibration = compute_layer_calibration(self.activations)
+
+    def test_statistics(self):
+        np.testing.assert_array_equal(self.calibration.channel_max, self.activations.reshape(-1, 4).max(axis=0))
+        self.assertEqual(self.calibration.min, self.activations.min())
+        self.assertEqual(self.calibration.histogram.sum(), self.activations.size)
+        self.assertEqual(self.calibration.channel_percentiles.shape, (len(self.calibration.percentiles), 4))
+
+        low, high = self.calibration.range(per_channel=False, percentile=99.9)
+        self.assertEqual(low.shape, (1,))
+        self.assertLessEqual(high[0], self.activations.max())
+        with self.assertRaises(ValueError):
+            self.calibration.range(percentile=95)
+
+    def test_save_and_load(self):
+        table = CalibrationTable()
+        table.set("model_COMtune", 3, self.calibration)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "calibration_table.npz")
+            table.save(path)
+            loaded = CalibrationTable.load(path).get("model_COMtune", 3)
+        np.testing.assert_array_equal(loaded.channel_min, self.calibration.channel_min)
+        self.assertEqual(loaded.median, self.calibration.median)
+        self.assertIsNone(table.get("model_COMtune", 4))
+
+    def test_compress_with_calibration(self):
+        compressor = Compressor()
+        val = self.activations[:1]
+        quantized, params = compressor.compress_nparray_affine_int(val, 8, calibration=self.calibration)
+        # 推論対象ごとの範囲ではなく、キャリブレーションした範囲でスケールを求める
+        np.testing.assert_allclose(params["scale"], self.calibration.channel_max / 255, rtol=1e-6)
+        extracted = compressor.extract_nparray_affine_int(quantized, params)
+        self.assertLessEqual(np.abs(extracted - val).max(), max(params["scale"]))
+
+        params = {}
+        compressor.compress_nparray_normalize2sigma_16bit_int(val, params=params, calibration=self.calibration)
+        upper = float(self.calibration.median) + 2 * float(self.calibration.std)
+        lower = max(float(self.calibration.median) - 2 * float(self.calibration.std), 0)
+        self.assertAlmostEqual(params["scale"][0], (upper - lower) / 10000, places=6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib.compressor import Compressor
+
+
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        self.compressor = Compressor()
+        np.random.seed(0)
+        self.val = np.maximum(np.random.normal(0.5, 1.0, (1, 14, 14, 8)), 0).astype(np.float32)
+
+    def test_16bit_int_matches_elementwise(self):
+        legacy = np.frompyfunc(self.compressor.compress_16bit_int, 1, 1)(self.val)
+        compressed = self.compressor.compress_nparray_16bit_int(self.val)
+        self.assertEqual(compressed.dtype, np.uint16)
+        np.testing.assert_array_equal(compressed, legacy.astype(np.uint16))
+
+        legacy = np.frompyfunc(self.compressor.extract_16bit_int, 1, 1)(compressed)
+        extracted = self.compressor.extract_nparray_16bit_int(compressed)
+        self.assertEqual(extracted.dtype, np.float32)
+        np.testing.assert_array_equal(extracted, legacy.astype(np.float32))
+
+    def test_8bit_int_matches_elementwise(self):
+        legacy = np.frompyfunc(self.compressor.compress_8bit_int, 1, 1)(self.val)
+        compressed = self.compressor.compress_nparray_8bit_int(self.val)
+        self.assertEqual(compressed.dtype, np.uint8)
+        np.testing.assert_array_equal(compressed, legacy.astype(np.uint8))
+
+    def test_normalize_16bit_int_matches_elementwise(self):
+        legacy = np.frompyfunc(self.compressor.compress_normalize_16bit_int, 3, 1)(
+            self.val, self.val.max(), self.val.min()
+        )
+        compressed = self.compressor.compress_nparray_normalize_16bit_int(self.val)
+        np.testing.assert_array_equal(compressed, legacy.astype(np.uint16))
+
+    def test_normalize2sigma_16bit_int_matches_elementwise(self):
+        legacy = np.frompyfunc(self.compressor.compress_normalize2sigma_16bit_int, 3, 1)(
+            self.val, np.median(self.val), self.val.std()
+        )
+        compressed = self.compressor.compress_nparray_normalize2sigma_16bit_int(self.val)
+        np.testing.assert_array_equal(compressed, legacy.astype(np.uint16))
+
+    def test_out_of_range_saturates(self):
+        # 要素ごとの処理では桁あふれしていた範囲外の値は、0と型の最大値に揃える
+        val = np.array([-1.0, 0.0, 0.001, 65.535, 70.0, 1000.0], dtype=np.float32)
+        np.testing.assert_array_equal(
+            self.compressor.compress_nparray_16bit_int(val), np.array([0, 0, 1, 65535, 65535, 65535], dtype=np.uint16)
+        )
+        val = np.array([-1.0, 0.0, 0.1, 25.5, 30.0, 1000.0], dtype=np.float32)
+        np.testing.assert_array_equal(
+            self.compressor.compress_nparray_8bit_int(val), np.array([0, 0, 1, 255, 255, 255], dtype=np.uint8)
+        )
+
+    def test_work_buffer_not_shared(self):
+        # 同じ形状で続けて呼んでも、前の呼び出しの結果は書き換えられない
+        first = self.compressor.get_work_buffer(self.val)
+        second = self.compressor.get_work_buffer(self.val * 2)
+        self.assertIsNot(first, second)
+        np.testing.assert_array_equal(first, self.val.astype(np.float64))
+
+    def test_preallocated_output(self):
+        out = np.empty(self.val.shape, dtype=np.uint16)
+        compressed = self.compressor.compress_nparray_16bit_int(self.val, out=out)
+        self.assertIs(compressed, out)
+        extracted_out = np.empty(self.val.shape, dtype=np.float32)
+        extracted = self.compressor.extract_nparray_16bit_int(compressed, out=extracted_out)
+        self.assertIs(extracted, extracted_out)
+
+    def test_progressive_16bit_int(self):
+        layers = self.compressor.compress_nparray_progressive_16bit_int(self.val)
+        self.assertEqual(layers.dtype, np.uint8)
+        self.assertEqual(layers.shape, (2,) + self.val.shape)
+        # 全てのレイヤーが届いた場合は16bit intと同じ値に戻る
+        np.testing.assert_array_equal(
+            self.compressor.extract_nparray_progressive_16bit_int(layers),
+            self.compressor.extract_nparray_16bit_int(self.compressor.compress_nparray_16bit_int(self.val)),
+        )
+        # ベースレイヤーだけの場合の誤差は上位8bitの刻み幅の半分以内
+        base_only = self.compressor.extract_nparray_progressive_16bit_int(layers, np.zeros(self.val.shape, dtype=bool))
+        expected = self.compressor.extract_nparray_16bit_int(self.compressor.compress_nparray_16bit_int(self.val))
+        self.assertLessEqual(np.abs(base_only - expected).max(), 128 / 1000)
+
+    def test_pack_bits_round_trip(self):
+        for bits in [4, 2]:
+            values = np.random.randint(0, 1 << bits, size=101).astype(np.uint8)
+            packed = Compressor.pack_bits(values, bits)
+            self.assertEqual(len(packed), -(-101 * bits // 8))
+            np.testing.assert_array_equal(Compressor.unpack_bits(packed, bits, len(values)), values)
+
+    def test_packed_int(self):
+        for bits in [4, 2]:
+            for per_channel in [True, False]:
+                packed, params = self.compressor.compress_nparray_packed_int(self.val, bits, per_channel)
+                self.assertEqual(packed.dtype, np.uint8)
+                self.assertEqual(len(packed), self.val.size * bits // 8)
+                self.assertEqual(len(params["scale"]), 8 if per_channel else 1)
+                extracted = self.compressor.extract_nparray_packed_int(packed, params)
+                self.assertEqual(extracted.shape, self.val.shape)
+                # 誤差はスケールの半分以内
+                error = np.abs(extracted - self.val).reshape(-1, len(params["scale"])).max(axis=0)
+                self.assertTrue((error <= np.asarray(params["scale"]) / 2 + 1e-6).all())
+                # 届かなかったパケットの値(0)は0.0に戻る
+                zeros = self.compressor.extract_nparray_packed_int(np.zeros_like(packed), params)
+                np.testing.assert_array_equal(zeros, 0)
+
+    def test_affine_int(self):
+        # 負の値を含むテンソル(PCA圧縮後など)
+        val = np.random.normal(0, 1.0, (1, 14, 14, 8)).astype(np.float32)
+        for bits in [8, 16]:
+            for per_channel in [True, False]:
+                for symmetric in [True, False]:
+                    quantized, params = self.compressor.compress_nparray_affine_int(val, bits, per_channel, symmetric)
+                    self.assertEqual(quantized.shape, val.shape)
+                    self.assertEqual(quantized.dtype.itemsize * 8, bits)
+                    self.assertEqual(quantized.dtype.kind, 'i' if symmetric else 'u')
+                    extracted = self.compressor.extract_nparray_affine_int(quantized, params)
+                    error = np.abs(extracted - val).reshape(-1, len(params["scale"])).max(axis=0)
+                    self.assertTrue((error <= np.asarray(params["scale"]) * 0.5001).all())
+                    # 対称な量子化では、届かなかったパケットの値(0)は0.0に戻る
+                    if symmetric:
+                        zeros = self.compressor.extract_nparray_affine_int(np.zeros_like(quantized), params)
+                        np.testing.assert_array_equal(zeros, 0)
+
+    def test_packed_int_symmetric(self):
+        val = np.random.normal(0, 1.0, (1, 14, 14, 8)).astype(np.float32)
+        packed, params = self.compressor.compress_nparray_packed_int(val, 4, True, True)
+        extracted = self.compressor.extract_nparray_packed_int(packed, params)
+        error = np.abs(extracted - val).reshape(-1, 8).max(axis=0)
+        self.assertTrue((error <= np.asarray(params["scale"]) * 0.5001).all())
+
+    def test_normalize_params(self):
+        params = {}
+        compressed = self.compressor.compress_nparray_normalize_16bit_int(self.val, params=params)
+        extracted = self.compressor.extract_nparray_affine_int(compressed, params)
+        self.assertLessEqual(np.abs(extracted - self.val).max(), params["scale"][0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import logging
+import socket
+import threading
+import time
+import unittest
+
+from src.lib.connection import Connection, ConnectionPool, MessageServer
+from src.lib.framing import MessageReader, MessageWriter
+from src.lib.model.request import CommonRequest
+from src.lib.model.response import CommonResponse
+
+logger = logging.getLogger(__name__)
+
+
+def response_for(data, payload):
+    request = CommonRequest.convert_from_json(str(data, "utf-8"))
+    return CommonResponse(0, request.request_id, "", payload).get_json().encode()
+
+
+class ScriptedServer:
+    '''接続ごとにscriptを呼び出す、テスト用のTCPサーバー'''
+    def __init__(self, script):
+        self.script = script
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.accepted = 0
+        self.received = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            threading.Thread(target=self.script, args=(self, conn, MessageReader(conn), MessageWriter(conn)), daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+
+class TestConnection(unittest.TestCase):
+    def test_multiplexes_responses_by_request_id(self):
+        # 2つのリクエストを受け取ってから、逆の順番でレスポンスを返す
+        def script(server, conn, reader, writer):
+            first = reader.read_message()
+            server.received.append(first)
+            second = reader.read_message()
+            writer.write_message(response_for(second, "second"))
+            writer.write_message(response_for(first, "first"))
+
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        connection = Connection("127.0.0.1", server.port, logger)
+        self.addCleanup(connection.close)
+        results = {}
+
+        def send(name):
+            results[name] = connection.request(CommonRequest(1, request_id=f"req-{name}")).payload
+
+        threads = [threading.Thread(target=send, args=(name,)) for name in ["a", "b"]]
+        threads[0].start()
+        # 先に送った方が1つ目のリクエストになるようにする
+        while not server.received:
+            time.sleep(0.01)
+        threads[1].start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, {"a": "first", "b": "second"})
+        self.assertEqual(server.accepted, 1)
+
+    def test_reconnects_after_disconnect(self):
+        # 1つのリクエストに応答したら切断する
+        def script(server, conn, reader, writer):
+            with conn:
+                writer.write_message(response_for(reader.read_message(), server.accepted))
+
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        pool = ConnectionPool(logger)
+        self.addCleanup(pool.close)
+        self.assertEqual(pool.request("127.0.0.1", server.port, CommonRequest(1)).payload, 1)
+        # 切断に気付いてから次のリクエストを送る
+        while pool.get("127.0.0.1", server.port).sock is not None:
+            time.sleep(0.01)
+        self.assertEqual(pool.request("127.0.0.1", server.port, CommonRequest(1)).payload, 2)
+        self.assertEqual(server.accepted, 2)
+
+    def test_retries_when_connect_fails(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        connection = Connection("127.0.0.1", port, logger)
+        self.addCleanup(connection.close)
+        with self.assertRaises(ConnectionError):
+            connection.request(CommonRequest(1))
+        self.assertEqual(connection.pending, {})
+
+    def test_timeout_without_response(self):
+        # リクエストを受け取るだけで応答しない
+        def script(server, conn, reader, writer):
+            while True:
+                data = reader.read_message()
+                if data is None:
+                    return
+                server.received.append(data)
+
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        connection = Connection("127.0.0.1", server.port, logger, response_timeout=0.1)
+        self.addCleanup(connection.close)
+        with self.assertRaises(ConnectionError):
+            connection.request(CommonRequest(1))
+        # 相手がリクエストを処理したかどうか分からないので、送り直さずに接続だけを切る
+        self.assertEqual(len(server.received), 1)
+        self.assertEqual(server.accepted, 1)
+        self.assertEqual(connection.pending, {})
+        self.assertIsNone(connection.sock)
+
+    def test_closed_before_response_is_not_resent(self):
+        # リクエストを受け取ったら、応答せずに切断する
+        def script(server, conn, reader, writer):
+            with conn:
+                server.received.append(reader.read_message())
+
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        connection = Connection("127.0.0.1", server.port, logger)
+        self.addCleanup(connection.close)
+        with self.assertRaises(ConnectionError):
+            connection.request(CommonRequest(1))
+        self.assertEqual(len(server.received), 1)
+        self.assertEqual(server.accepted, 1)
+
+
+class TestMessageServer(unittest.TestCase):
+    def test_request_response(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = MessageServer("127.0.0.1", port, lambda data: response_for(data, "ok"), logger)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.stop)
+        pool = ConnectionPool(logger)
+        self.addCleanup(pool.close)
+        for _ in range(50):
+            try:
+                response = pool.request("127.0.0.1", port, CommonRequest(1))
+                break
+            except ConnectionError:
+                # serve_foreverがlistenを始めるまで待つ
+                time.sleep(0.05)
+        self.assertEqual(response.payload, "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.lib.dataset_store import DatasetStore
+
+
+class TestDatasetStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = DatasetStore(self.directory.name)
+        self.images = np.arange(10 * 4 * 4, dtype=np.uint8).reshape((10, 4, 4))
+        self.labels = np.arange(10, dtype=np.uint8) % 3
+        for split in DatasetStore.SPLITS:
+            self.store.save(split, self.images, self.labels)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_range_is_memory_mapped(self):
+        self.assertTrue(self.store.exists())
+        images, labels = self.store.range("test", 2, 5)
+        self.assertIsInstance(images, np.memmap)
+        np.testing.assert_array_equal(images, self.images[2:5])
+        np.testing.assert_array_equal(labels, self.labels[2:5])
+
+    def test_sample_is_reproducible(self):
+        indices = self.store.sample("train", 4, seed=0)
+        self.assertEqual(len(set(indices.tolist())), 4)
+        np.testing.assert_array_equal(indices, self.store.sample("train", 4, seed=0))
+        self.assertEqual(len(self.store.sample("train", 100)), 10)
+
+    def test_labels_path_for(self):
+        self.assertEqual(
+            DatasetStore.labels_path_for(self.store.images_path("test")), self.store.labels_path("test")
+        )
+        self.assertIsNone(DatasetStore.labels_path_for(os.path.join(self.directory.name, "images.npy")))
+
+    def test_for_images_path(self):
+        store, split = DatasetStore.for_images_path(self.store.images_path("test"))
+        self.assertEqual(split, "test")
+        np.testing.assert_array_equal(store.range(split, 0, 3)[0], self.images[:3])
+        # ラベルがない場合はDatasetStoreとして扱わない
+        os.remove(self.store.labels_path("train"))
+        self.assertIsNone(DatasetStore.for_images_path(self.store.images_path("train")))
+        self.assertIsNone(DatasetStore.for_images_path(os.path.join(self.directory.name, "images.npy")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 # -*- Coding: utf-8 -*-
 
+import threading
 import unittest
+from unittest import mock
 
+import numpy as np
+
+from src.conf import environment_settings
 from src.edge_server.edge_server import EdgeServer
+from src.lib import command
+from src.lib.compressor import Compressor
+from src.lib.model.request import IotDeviceResultDataRequest, IotDeviceResultSummaryRequest
+from src.lib.packetizer import TensorPacketizer
 
 
 class TestEdgeServer(unittest.TestCase):
@@ -11,5 +20,103 @@ class TestEdgeServer(unittest.TestCase):
         edge_server = EdgeServer()
         edge_server.main()
 
+
+class TestEdgeServerReception(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("src.lib.save_result.save_json_or_txt")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.edge_server = EdgeServer()
+        self.edge_server.setting = {'layer': 1, 'split_mode': 'random', 'reach_rate': 1.0, 'use_udp': False, 'current_time_str': 'test'}
+        # data_waiting_timeの監視は行わず、IoTデバイスへの通知と推論の代わりに受信したデータを記録する
+        self.edge_server.start_reception_timer = mock.Mock()
+        self.edge_server.send_received_result = mock.Mock()
+        self.received = []
+        self.edge_server.do_inference = lambda session: self.received.append(session.iot_result_data.copy())
+
+    def send_summary(self, packetizer, dtype="float16"):
+        request = IotDeviceResultSummaryRequest(
+            command.IOT_SEND_RESULT_SUMMARY,
+            packetizer.num_packets,
+            packetizer.num_elements,
+            environment_settings.IOT_RANDOM_SEED_SHUFFLE,
+            packet_length=packetizer.packet_length,
+            num_layers=packetizer.num_layers,
+            dtype=dtype,
+        )
+        self.edge_server.process_iot_send_result_summary(request)
+        return self.edge_server.sessions[request.session_id]
+
+    def test_store_packets_in_any_order(self):
+        np.random.seed(0)
+        tensor = np.random.rand(1, 10, 10, 8).astype(np.float32)
+        packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=64)
+        session = self.send_summary(packetizer)
+        # 最後のパケットは短いので、逆順に送ると短いパケットから書き込む
+        for sequence, payload in reversed(list(packetizer.packets())):
+            self.edge_server.process_iot_send_result_data(
+                IotDeviceResultDataRequest(command.IOT_SEND_RESULT_DATA, payload, sequence, session_id=session.session_id)
+            )
+        self.assertEqual(len(self.received), 1)
+        np.testing.assert_array_equal(self.received[0], tensor.flatten().astype(np.float16))
+        self.assertEqual(session.iot_result_data_received_elements, packetizer.num_elements)
+        self.assertEqual(self.edge_server.sessions, {})
+
+    def test_reception_buffer_reused_by_size_and_dtype(self):
+        tensor = np.ones((1, 10, 10, 8), dtype=np.float32)
+        packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=64)
+        session = self.send_summary(packetizer)
+        buffer = session.iot_result_data
+        buffer[:] = 1
+        self.edge_server.close_session(session)
+        self.assertEqual(self.edge_server.reception_buffers, {(packetizer.num_elements, np.dtype(np.float16)): [buffer]})
+
+        # 要素数と型が同じセッションでは、0で埋め直して使い回す
+        session = self.send_summary(packetizer)
+        self.assertIs(session.iot_result_data, buffer)
+        self.assertFalse(session.iot_result_data.any())
+        # 型が異なるセッションには別のバッファを用意する
+        other = self.send_summary(packetizer, dtype="uint8")
+        self.assertIsNot(other.iot_result_data, buffer)
+        self.assertEqual(other.iot_result_data.dtype, np.uint8)
+        self.assertEqual(len(other.iot_result_data), packetizer.num_elements)
+
+    def test_base_layer_inferred_outside_session_lock(self):
+        np.random.seed(2)
+        layers = Compressor().compress_nparray_progressive_16bit_int(np.random.rand(1, 8, 8, 4).astype(np.float32))
+        packetizer = TensorPacketizer(layers, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=64, num_layers=2)
+        session = self.send_summary(packetizer, dtype="uint8")
+        base_layer_inputs = []
+
+        def infer_base_layer(session, base_layer_input):
+            # 他のスレッドからセッションのロックを取得できる(ロックを外してから推論する)
+            acquired = []
+
+            def try_lock():
+                acquired.append(session.lock.acquire(timeout=1))
+                if acquired[0]:
+                    session.lock.release()
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            base_layer_inputs.append((acquired[0], base_layer_input))
+        self.edge_server.infer_base_layer = infer_base_layer
+
+        with mock.patch.object(environment_settings, "EDGE_PROGRESSIVE_REFINEMENT", True):
+            for sequence, payload in packetizer.packets():
+                self.edge_server.process_iot_send_result_data(
+                    IotDeviceResultDataRequest(command.IOT_SEND_RESULT_DATA, payload, sequence, session_id=session.session_id)
+                )
+
+        self.assertEqual(len(base_layer_inputs), 1)
+        acquired, base_layer_input = base_layer_inputs[0]
+        self.assertTrue(acquired)
+        # ベースレイヤーが揃った時点のコピーなので、後から届いたリファインメントレイヤーは含まない
+        base_layer, refinement_layer = base_layer_input.reshape(2, -1)
+        np.testing.assert_array_equal(base_layer, layers[0].ravel())
+        self.assertFalse(refinement_layer.any())
+        np.testing.assert_array_equal(self.received[0], layers.ravel())
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib.entropy_coder import EntropyCoder, huffman_code_lengths
+from src.lib.packetizer import TensorPacketizer
+
+
+class TestEntropyCoder(unittest.TestCase):
+    def test_round_trip_packets(self):
+        np.random.seed(0)
+        # ReLU後の中間層出力を8bitに量子化したものを想定
+        tensor = (np.maximum(np.random.normal(0, 1, (1, 14, 14, 16)), 0) * 40).clip(0, 255).astype(np.uint8)
+        packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=500)
+        for coder_type in EntropyCoder.coder_pattern():
+            coded_size = 0
+            for _, payload in packetizer.packets():
+                coded = EntropyCoder.encode(coder_type, payload)
+                decoded = EntropyCoder.decode(coder_type, coded)
+                np.testing.assert_array_equal(np.frombuffer(decoded, dtype=packetizer.dtype), payload)
+                coded_size += len(coded)
+            if coder_type != EntropyCoder.ENTROPY_NONE:
+                self.assertLess(coded_size, tensor.nbytes)
+
+    def test_incompressible_payload_is_stored(self):
+        payload = np.random.RandomState(0).randint(0, 256, 1000).astype(np.uint8).tobytes()
+        for coder_type in [EntropyCoder.ENTROPY_ZLIB, EntropyCoder.ENTROPY_HUFFMAN]:
+            coded = EntropyCoder.encode(coder_type, payload)
+            # ヘッダの分だけ大きくなる
+            self.assertEqual(len(coded), len(payload) + 5)
+            self.assertEqual(EntropyCoder.decode(coder_type, coded), payload)
+
+    def test_huffman_edge_cases(self):
+        for payload in [b"", b"\x07", b"\x00" * 100, bytes(range(256)) * 2]:
+            coded = EntropyCoder.encode(EntropyCoder.ENTROPY_HUFFMAN, payload)
+            self.assertEqual(EntropyCoder.decode(EntropyCoder.ENTROPY_HUFFMAN, coded), payload)
+
+    def test_huffman_code_length_limit(self):
+        # フィボナッチ数列の出現回数では、制限しない場合の符号長がシンボル数に近くなる
+        frequencies = [1, 1]
+        while len(frequencies) < 30:
+            frequencies.append(frequencies[-1] + frequencies[-2])
+        lengths = huffman_code_lengths(frequencies, max_code_length=12)
+        self.assertLessEqual(lengths.max(), 12)
+        # クラフトの不等式を満たす(符号として復号できる)
+        self.assertLessEqual(np.sum(2.0 ** -lengths.astype(np.float64)), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib import fec
+from src.lib.packetizer import TensorPacketizer
+
+
+class TestFec(unittest.TestCase):
+    def test_recover_one_lost_packet_per_group(self):
+        np.random.seed(0)
+        tensor = np.random.rand(1, 7, 7, 8).astype(np.float32)
+        packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=50)
+        packets = [payload for _, payload in packetizer.packets()]
+        group_size = 3
+        length = packets[0].nbytes
+        self.assertEqual(fec.num_groups(len(packets), group_size), 3)
+
+        for group in range(fec.num_groups(len(packets), group_size)):
+            sequences = fec.group_range(group, len(packets), group_size)
+            parity = fec.xor_payloads([packets[sequence] for sequence in sequences], length)
+            # 最後のパケット(短いパケットを含む)を失ったものとして復元する
+            lost = sequences[-1]
+            others = [packets[sequence] for sequence in sequences if sequence != lost]
+            recovered = fec.xor_payloads(others + [parity], length)[: packets[lost].nbytes]
+            np.testing.assert_array_equal(np.frombuffer(recovered, dtype=packetizer.dtype), packets[lost])
+
+    def test_bytes_payload(self):
+        payloads = [b"abcd", b"ef"]
+        parity = fec.xor_payloads(payloads, 4)
+        self.assertEqual(fec.xor_payloads([payloads[0], parity], 4)[:2], b"ef")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import socket
+import unittest
+
+from src.lib.framing import MESSAGE_LENGTH, MessageReader, MessageTooLargeError, MessageWriter
+
+
+class TestFraming(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_message_larger_than_chunk_size(self):
+        message = bytes(range(256)) * 100
+        MessageWriter(self.sender).write_message(message)
+        reader = MessageReader(self.receiver, chunk_size=1000)
+        self.assertEqual(reader.read_message(), message)
+
+    def test_multiple_messages_in_one_recv(self):
+        writer = MessageWriter(self.sender)
+        for message in [b"first", b"", b"third"]:
+            writer.write_message(message)
+        self.sender.close()
+        reader = MessageReader(self.receiver)
+        self.assertEqual(reader.read_message(), b"first")
+        self.assertEqual(reader.read_message(), b"")
+        self.assertEqual(reader.read_message(), b"third")
+        self.assertIsNone(reader.read_message())
+
+    def test_too_large_message(self):
+        with self.assertRaises(MessageTooLargeError):
+            MessageWriter(self.sender, max_message_size=10).write_message(b"x" * 11)
+        self.sender.sendall(MESSAGE_LENGTH.pack(11))
+        with self.assertRaises(MessageTooLargeError):
+            MessageReader(self.receiver, max_message_size=10).read_message()
+
+    def test_closed_in_the_middle_of_message(self):
+        self.sender.sendall(MESSAGE_LENGTH.pack(10) + b"12345")
+        self.sender.close()
+        with self.assertRaises(ConnectionError):
+            MessageReader(self.receiver).read_message()
+
+
+if __name__ == "__main__":
+    unittest.main()
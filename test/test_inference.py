@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+
+from src.lib import inference
+from src.lib.inference import SubModelCache
+
+
+class StubSubModel:
+    '''モデルを分割せずに、作成時の引数だけを持つSubModelの代わり'''
+    def __init__(self, model, start_layer_id, end_layer_id):
+        self.model = model
+        self.key = (model, start_layer_id, end_layer_id)
+
+
+class TestSubModelCache(unittest.TestCase):
+    def setUp(self):
+        # モデルファイルの代わりに、読み込むたびに異なる値を返す
+        self.loaded = []
+
+        def load_model(path):
+            self.loaded.append(path)
+            return (path, len(self.loaded))
+
+        for patcher in [mock.patch.object(inference, "load_model", load_model), mock.patch.object(inference, "SubModel", StubSubModel)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cache_hit(self):
+        cache = SubModelCache(max_size=4)
+        sub_model = cache.get("a", 1, 3)
+        self.assertIs(cache.get("a", 1, 3), sub_model)
+        # 同じモデルの別のレイヤーで分割したサブモデルは、モデルを読み込み直さずに作る
+        other = cache.get("a", 4, 8)
+        self.assertIsNot(other, sub_model)
+        self.assertIs(other.model, sub_model.model)
+        self.assertEqual(self.loaded, ["a"])
+
+    def test_evicts_least_recently_used(self):
+        cache = SubModelCache(max_size=2)
+        first = cache.get("a", 1, 3)
+        evicted = cache.get("b", 1, 3)
+        # 使ったサブモデルは最後に使ったものとして扱う
+        self.assertIs(cache.get("a", 1, 3), first)
+        cache.get("c", 1, 3)
+        self.assertEqual(list(cache.sub_models), [("a", 1, 3), ("c", 1, 3)])
+        self.assertIs(cache.get("a", 1, 3), first)
+        # 追い出したサブモデルは作り直す(読み込み済みのモデルは読み込み直さない)
+        self.assertIsNot(cache.get("b", 1, 3), evicted)
+        self.assertEqual(list(cache.sub_models), [("a", 1, 3), ("b", 1, 3)])
+        self.assertEqual(self.loaded, ["a", "b", "c"])
+
+    def test_reload_drops_sub_models(self):
+        cache = SubModelCache(max_size=4)
+        sub_model = cache.get("a", 1, 3)
+        kept = cache.get("b", 1, 3)
+        cache.load_model("a", reload=True)
+        reloaded = cache.get("a", 1, 3)
+        self.assertIsNot(reloaded, sub_model)
+        self.assertEqual(reloaded.model, ("a", 3))
+        self.assertIs(cache.get("b", 1, 3), kept)
+        self.assertEqual(self.loaded, ["a", "b", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
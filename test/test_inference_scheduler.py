@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import logging
+import threading
+import unittest
+
+import numpy as np
+
+from src.edge_server.inference_scheduler import InferenceScheduler
+
+
+class TestInferenceScheduler(unittest.TestCase):
+    def setUp(self):
+        self.batch_sizes = []
+        self.results = {}
+        self.done = threading.Event()
+
+    def run_batch(self, batch):
+        self.batch_sizes.append(len(batch))
+        return batch * 2
+
+    def callback(self, name, expected_count):
+        def on_result(prediction, inference_start_time, inference_end_time):
+            self.results[name] = prediction
+            if len(self.results) == expected_count:
+                self.done.set()
+        return on_result
+
+    def test_batches_same_key(self):
+        scheduler = InferenceScheduler(logging.getLogger(__name__), max_batch_size=3, max_queue_delay_seconds=1.0)
+        for i in range(4):
+            scheduler.submit("a", np.full((1, 2), i, dtype=np.float32), self.run_batch, self.callback(i, 5))
+        scheduler.submit("b", np.full((1, 2), 9, dtype=np.float32), self.run_batch, self.callback(9, 5))
+        scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        scheduler.stop()
+
+        # 同じkeyの推論対象は最大バッチサイズまでまとめられ、異なるkeyは別のバッチになる
+        self.assertEqual(self.batch_sizes, [3, 1, 1])
+        self.assertEqual(sum(scheduler.batch_size_histogram.values()), 3)
+        self.assertEqual(sum(scheduler.queue_delay_histogram.values()), 5)
+        for i in [0, 1, 2, 3, 9]:
+            np.testing.assert_array_equal(self.results[i], np.full((1, 2), i * 2, dtype=np.float32))
+
+    def test_stop_flushes_pending(self):
+        scheduler = InferenceScheduler(logging.getLogger(__name__), max_batch_size=8, max_queue_delay_seconds=10.0)
+        scheduler.start()
+        scheduler.submit("a", np.zeros((1, 2), dtype=np.float32), self.run_batch, self.callback(0, 1))
+        scheduler.stop()
+        self.assertIn(0, self.results)
+        self.assertEqual(self.batch_sizes, [1])
+
+    def test_failed_batch_retries_one_by_one(self):
+        errors = {}
+
+        def run_batch(batch):
+            self.batch_sizes.append(len(batch))
+            # 値が負の推論対象を含むバッチは失敗する
+            if (batch < 0).any():
+                raise ValueError("broken input")
+            return batch * 2
+
+        def on_result(name):
+            def callback(prediction, inference_start_time, inference_end_time):
+                self.results[name] = prediction
+                if len(self.results) + len(errors) == 3:
+                    self.done.set()
+            return callback
+
+        def on_error(name):
+            def error_callback(error):
+                errors[name] = error
+                if len(self.results) + len(errors) == 3:
+                    self.done.set()
+            return error_callback
+
+        scheduler = InferenceScheduler(logging.getLogger(__name__), max_batch_size=3, max_queue_delay_seconds=1.0)
+        for i, value in enumerate([1, -1, 2]):
+            scheduler.submit("a", np.full((1, 2), value, dtype=np.float32), run_batch, on_result(i), on_error(i))
+        scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        scheduler.stop()
+
+        # バッチが失敗した後、1つずつ推論し直して失敗した推論対象だけにエラーを返す
+        self.assertEqual(self.batch_sizes, [3, 1, 1, 1])
+        self.assertEqual(sorted(self.results), [0, 2])
+        np.testing.assert_array_equal(self.results[2], np.full((1, 2), 4, dtype=np.float32))
+        self.assertEqual(list(errors), [1])
+        self.assertIsInstance(errors[1], ValueError)
+        self.assertEqual(scheduler.batch_size_histogram, {3: 1})
+
+    def test_slow_callback_does_not_block_inference(self):
+        release = threading.Event()
+        b_done = threading.Event()
+
+        def slow_callback(prediction, inference_start_time, inference_end_time):
+            # クラウドサーバーへの送信が終わらない場合を想定して、bの結果が返るまで戻らない
+            release.wait(5)
+            self.results["a"] = prediction
+
+        def callback(prediction, inference_start_time, inference_end_time):
+            self.results["b"] = prediction
+            b_done.set()
+
+        scheduler = InferenceScheduler(logging.getLogger(__name__), max_batch_size=1, max_queue_delay_seconds=0.0, callback_workers=2)
+        scheduler.start()
+        scheduler.submit("a", np.zeros((1, 2), dtype=np.float32), self.run_batch, slow_callback)
+        scheduler.submit("b", np.ones((1, 2), dtype=np.float32), self.run_batch, callback)
+        self.assertTrue(b_done.wait(5))
+        self.assertNotIn("a", self.results)
+        release.set()
+        # stopはcallbackが返るまで待つ
+        scheduler.stop()
+        self.assertEqual(sorted(self.results), ["a", "b"])
+        self.assertEqual(self.batch_sizes, [1, 1])
+
+if __name__ == "__main__":
+    unittest.main()
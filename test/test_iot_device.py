@@ -2,7 +2,12 @@
 # -*- Coding: utf-8 -*-
 
 import unittest
+from unittest import mock
 
+import numpy as np
+
+from src.iot_device.image_source import LoadedImage
+from src.iot_device.inference_target import InferenceTarget
 from src.iot_device.iot_device import IotDevice
 
 
@@ -11,5 +16,72 @@ class TestIotDevice(unittest.TestCase):
         iot_device = IotDevice()
         iot_device.main()
 
+
+class StubSubModel:
+    '''画像ごとに異なる中間層出力を返し、呼び出された時の入力の形状を記録するSubModelの代わり'''
+    def __init__(self):
+        self.input_shapes = []
+
+    def __call__(self, X_test):
+        self.input_shapes.append(X_test.shape)
+        return X_test[:, ::2, ::2, :] * 2
+
+
+class TestIotDeviceHeadInference(unittest.TestCase):
+    def setUp(self):
+        self.sub_model = StubSubModel()
+        cache = mock.Mock()
+        cache.get.return_value = self.sub_model
+        self.condition_lines = []
+        for patcher in [
+            mock.patch("src.lib.inference.sub_model_cache", cache),
+            mock.patch("src.lib.save_result.save_json_or_txt", lambda *args, **kwargs: self.condition_lines.append(args[3])),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.iot_device = IotDevice()
+        self.iot_device.setting = {'layer': 2, 'model': 'model', 'reload': False, 'current_time_str': 'test'}
+        np.random.seed(0)
+        self.targets = [
+            InferenceTarget(LoadedImage(f"image{i}", np.random.randint(0, 255, (28, 28)).astype(np.float32)), i) for i in range(3)
+        ]
+
+    def test_batch_matches_one_by_one(self):
+        self.iot_device.infer_head_batch(self.targets)
+        # まとめて1回だけ推論する
+        self.assertEqual(self.sub_model.input_shapes, [(3, 28, 28, 1)])
+        batched = [target.inter_test for target in self.targets]
+
+        for target in self.targets:
+            self.iot_device.infer_head(target)
+        self.assertEqual(self.sub_model.input_shapes[1:], [(1, 28, 28, 1)] * 3)
+        for inter_test, target in zip(batched, self.targets):
+            # 1枚ずつ処理した場合と同じ(1, ...)の形と値になる
+            self.assertEqual(inter_test.shape, (1, 14, 14, 1))
+            np.testing.assert_array_equal(inter_test, target.inter_test)
+
+    def test_condition_lines_per_target(self):
+        self.iot_device.infer_head_batch(self.targets)
+        # 推論対象ごとに、まとめて処理した時の開始・終了時刻を書き込む
+        self.assertEqual(
+            [line.split(" = ")[0] for line in self.condition_lines],
+            [f"{i}, IoT processing {event} time" for i in range(3) for event in ["start", "end"]],
+        )
+        self.assertEqual(len({line.split(" = ")[1] for line in self.condition_lines[0::2]}), 1)
+        self.assertEqual(len({line.split(" = ")[1] for line in self.condition_lines[1::2]}), 1)
+
+    def test_send_results_after_batch_inference(self):
+        events = []
+        self.iot_device.infer_head_batch = lambda targets: events.append(("inference", [target.filename for target in targets]))
+        self.iot_device.split_into_packets = lambda target: events.append(("packetize", target.filename))
+        self.iot_device.send_target = lambda target: events.append(("send", target.filename))
+        self.iot_device.inference_and_send_results(self.targets)
+        self.assertEqual(
+            events,
+            [("inference", ["image0", "image1", "image2"])]
+            + [(event, f"image{i}") for i in range(3) for event in ["packetize", "send"]],
+        )
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
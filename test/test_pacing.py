@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import threading
+import unittest
+
+from src.lib.pacing import PacingController, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_spaces_sends_at_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1000, burst=100, clock=clock, sleep=clock.sleep)
+        for _ in range(11):
+            bucket.consume(100)
+        # 最初のburst分はすぐに送信し、残りの1000バイトは1秒かかる
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_set_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1000, burst=100, clock=clock, sleep=clock.sleep)
+        bucket.consume(100)
+        bucket.set_rate(100)
+        bucket.consume(100)
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_set_rate_while_waiting(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1000, burst=100, clock=clock, sleep=clock.sleep)
+        bucket.consume(100)
+        threads = []
+
+        def sleep(seconds):
+            # 送信スレッドが待っている間に、受信報告のスレッドからレートを変える
+            thread = threading.Thread(target=bucket.set_rate, args=(2000,))
+            thread.start()
+            thread.join(1)
+            threads.append(thread)
+            clock.sleep(seconds)
+
+        bucket.sleep = sleep
+        bucket.consume(100)
+        self.assertFalse(threads[0].is_alive())
+        self.assertEqual(bucket.rate, 2000)
+        self.assertAlmostEqual(clock.now, 0.1)
+
+
+class TestPacingController(unittest.TestCase):
+    def test_rate_decreases_on_loss_and_increases_without(self):
+        controller = PacingController(initial_rate=1000, min_rate=100, max_rate=2000, loss_threshold=0.05)
+        # 100個中50個が失われた場合は25%下げる
+        self.assertAlmostEqual(controller.on_report(100, 50), 750)
+        self.assertAlmostEqual(controller.last_loss_rate, 0.5)
+        # 次の報告までの100個が全て届いた場合は上げる
+        self.assertAlmostEqual(controller.on_report(200, 150), 825)
+        # 新しく送信していない場合は変えない
+        self.assertAlmostEqual(controller.on_report(200, 150), 825)
+
+    def test_rate_is_bounded(self):
+        controller = PacingController(initial_rate=1000, min_rate=900, max_rate=1050, loss_threshold=0.0)
+        self.assertEqual(controller.on_report(10, 0), 900)
+        self.assertAlmostEqual(controller.on_report(20, 10), 990)
+        self.assertEqual(controller.on_report(30, 20), 1050)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib.compressor import Compressor
+from src.lib.packetizer import TensorPacketizer, channel_major_permutation, channel_order_by_energy
+
+
+class TestTensorPacketizer(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.tensor = np.random.rand(1, 14, 14, 8).astype(np.float32)
+
+    def test_packets_restore_original_order(self):
+        for split_mode in [
+            TensorPacketizer.SPLIT_MODE_RANDOM,
+            TensorPacketizer.SPLIT_MODE_SEQUENTIAL,
+            TensorPacketizer.SPLIT_MODE_IMPORTANCE,
+        ]:
+            packetizer = TensorPacketizer(self.tensor, split_mode, packet_length=100)
+            self.assertEqual(packetizer.num_packets, 16)
+
+            restored = np.zeros(packetizer.num_elements, dtype=packetizer.dtype)
+            for sequence, payload in packetizer.packets():
+                start = sequence * packetizer.packet_length
+                restored[packetizer.k[start : start + len(payload)]] = payload
+            np.testing.assert_array_equal(restored, self.tensor.flatten())
+
+    def test_packet_is_view(self):
+        packetizer = TensorPacketizer(self.tensor, TensorPacketizer.SPLIT_MODE_RANDOM)
+        self.assertTrue(np.shares_memory(packetizer.packet(1), packetizer.permuted))
+
+    def test_importance_sends_high_energy_channel_first(self):
+        self.tensor[..., 5] *= 10
+        packetizer = TensorPacketizer(self.tensor, TensorPacketizer.SPLIT_MODE_IMPORTANCE, packet_length=100)
+        self.assertEqual(packetizer.channel_order[0], 5)
+        self.assertEqual(sorted(packetizer.channel_order), list(range(8)))
+        # 先頭のパケットはチャンネル5の要素のみ
+        np.testing.assert_array_equal(packetizer.packet(0), self.tensor[..., 5].flatten()[:100])
+        # 受信側はチャンネルの順番だけから同じ並べ替えを作れる
+        np.testing.assert_array_equal(
+            channel_major_permutation(packetizer.channel_order, packetizer.num_elements), packetizer.k
+        )
+
+    def test_importance_with_progressive_layers(self):
+        self.tensor[..., 5] *= 10
+        layers = Compressor().compress_nparray_progressive_16bit_int(self.tensor)
+        packetizer = TensorPacketizer(
+            layers,
+            TensorPacketizer.SPLIT_MODE_IMPORTANCE,
+            packet_length=98,
+            num_layers=2,
+            channel_order=channel_order_by_energy(self.tensor),
+        )
+        self.assertEqual(packetizer.channel_order[0], 5)
+        # 各レイヤーの先頭はチャンネル5の要素で、ベースレイヤーを全て送ってからリファインメントレイヤーを送る
+        layer_size = self.tensor.size
+        np.testing.assert_array_equal(packetizer.permuted[:196], layers[0][..., 5].flatten())
+        np.testing.assert_array_equal(packetizer.permuted[layer_size : layer_size + 196], layers[1][..., 5].flatten())
+        np.testing.assert_array_equal(packetizer.k[:layer_size], channel_major_permutation(packetizer.channel_order, layer_size))
+
+        restored = np.zeros(packetizer.num_elements, dtype=packetizer.dtype)
+        restored[packetizer.k] = packetizer.permuted
+        np.testing.assert_array_equal(restored, layers.flatten())
+
+    def test_importance_with_packed_values(self):
+        self.tensor[..., 5] *= 10
+        compressor = Compressor()
+        packed, params = compressor.compress_nparray_packed_int(self.tensor, 4)
+        # 1バイトにチャンネル(0, 1), (2, 3), (4, 5), (6, 7)の値が入るので、チャンネル4, 5のバイトから送る
+        channel_order = channel_order_by_energy(self.tensor, 2)
+        self.assertEqual(channel_order[0], 2)
+        self.assertEqual(sorted(channel_order), list(range(4)))
+        packetizer = TensorPacketizer(packed, TensorPacketizer.SPLIT_MODE_IMPORTANCE, packet_length=98, channel_order=channel_order)
+        quantized = compressor.unpack_bits(packetizer.packet(0), 4, 196).reshape(-1, 2)
+        np.testing.assert_array_equal(quantized, compressor.unpack_bits(packed, 4, self.tensor.size).reshape(-1, 8)[:98, 4:6])
+
+        restored = np.zeros(packetizer.num_elements, dtype=packetizer.dtype)
+        restored[packetizer.k] = packetizer.permuted
+        np.testing.assert_array_equal(restored, packed)
+        # チャンネル数が1バイトに詰める値の数で割り切れない場合は先頭から送る
+        self.assertEqual(channel_order_by_energy(self.tensor[..., :7], 2), [0])
+
+    def test_layers_are_sent_in_order(self):
+        layers = np.stack([self.tensor, self.tensor + 1])
+        packetizer = TensorPacketizer(layers, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=98, num_layers=2)
+        # 1つのレイヤーは16パケットで、前半のパケットには1つ目のレイヤーの要素だけが入る
+        layer_size = self.tensor.size
+        self.assertTrue((packetizer.k[:layer_size] < layer_size).all())
+        self.assertTrue((packetizer.k[layer_size:] >= layer_size).all())
+        np.testing.assert_array_equal(packetizer.k[layer_size:] - layer_size, packetizer.k[:layer_size])
+
+    def test_dtype_is_preserved(self):
+        for dtype in [np.uint8, np.uint16, np.int8, np.float16, np.float32]:
+            packetizer = TensorPacketizer(self.tensor.astype(dtype), TensorPacketizer.SPLIT_MODE_RANDOM)
+            self.assertEqual(packetizer.dtype, np.dtype(dtype))
+            self.assertEqual(packetizer.packet(0).dtype, np.dtype(dtype))
+        # PCA圧縮などで生じるfloat64はfloat32で送る
+        packetizer = TensorPacketizer(self.tensor.astype(np.float64), TensorPacketizer.SPLIT_MODE_SEQUENTIAL)
+        self.assertEqual(packetizer.packet(0).dtype, np.float32)
+        packetizer = TensorPacketizer(self.tensor, TensorPacketizer.SPLIT_MODE_SEQUENTIAL, dtype=np.float16)
+        self.assertEqual(packetizer.packet(0).dtype, np.float16)
+
+    def test_invalid_split_mode(self):
+        with self.assertRaises(Exception):
+            TensorPacketizer(self.tensor, 'unknown')
+
+if __name__ == "__main__":
+    unittest.main()
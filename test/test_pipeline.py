@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import logging
+import threading
+import time
+import unittest
+
+from src.lib.pipeline import Pipeline, PipelineStage, batched
+
+
+class TestPipeline(unittest.TestCase):
+    def test_stages_overlap_and_keep_order(self):
+        outputs = []
+        active = []
+        lock = threading.Lock()
+        max_active = [0]
+
+        def slow(name):
+            def func(item):
+                with lock:
+                    active.append(name)
+                    max_active[0] = max(max_active[0], len(active))
+                time.sleep(0.02)
+                with lock:
+                    active.remove(name)
+                return item
+            return func
+
+        def sink(item):
+            outputs.append(item)
+            return item
+
+        stages = [PipelineStage("a", slow("a")), PipelineStage("b", slow("b")), PipelineStage("c", sink)]
+        pipeline = Pipeline(stages, 2, logging.getLogger(__name__))
+        pipeline.run(range(10))
+
+        self.assertEqual(outputs, list(range(10)))
+        # 2つのステージが同時に動いているので、処理時間の合計より短く終わる
+        self.assertGreater(max_active[0], 1)
+        self.assertLess(pipeline.elapsed_seconds, 10 * 0.04)
+        self.assertEqual([stage.num_items for stage in stages], [10, 10, 10])
+        self.assertEqual(len(pipeline.statistics()), 4)
+
+    def test_failed_item_is_dropped(self):
+        outputs = []
+
+        def fail_on_odd(item):
+            if item % 2 == 1:
+                raise ValueError(item)
+            return item
+
+        stages = [PipelineStage("a", fail_on_odd), PipelineStage("b", outputs.append)]
+        Pipeline(stages, 1, logging.getLogger(__name__)).run(range(6))
+        self.assertEqual(outputs, [0, 2, 4])
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+if __name__ == "__main__":
+    unittest.main()
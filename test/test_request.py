@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import base64
+import io
+import json
+import unittest
+import uuid
+
+import numpy as np
+
+from src.lib.model.request import (
+    BINARY_FRAME_HEADER,
+    EdgeServerReceivedResultRequest,
+    IotDeviceResultDataRequest,
+    IotDeviceResultSummaryRequest,
+    decode_sequence_bitmap,
+    encode_sequence_bitmap,
+    is_binary_frame,
+)
+
+
+class TestIotDeviceResultDataRequest(unittest.TestCase):
+    def test_binary_frame_round_trip(self):
+        payload = np.arange(512, dtype=np.float16)
+        request = IotDeviceResultDataRequest(2010, payload, 7)
+        frame = request.get_bytes()
+        self.assertTrue(is_binary_frame(frame))
+        self.assertEqual(len(frame), BINARY_FRAME_HEADER.size + payload.nbytes)
+
+        converted = IotDeviceResultDataRequest.convert_from_bytes(frame)
+        self.assertEqual(converted.command, 2010)
+        self.assertEqual(converted.sequence, 7)
+        self.assertEqual(converted.request_id, request.request_id)
+        self.assertEqual(converted.payload.dtype, np.float16)
+        np.testing.assert_array_equal(converted.payload, payload)
+
+    def test_binary_frame_native_dtypes(self):
+        for dtype in [np.uint8, np.int8, np.uint16, np.int16, np.float32]:
+            payload = np.arange(-3, 5).astype(dtype)
+            converted = IotDeviceResultDataRequest.convert_from_bytes(IotDeviceResultDataRequest(2010, payload, 0).get_bytes())
+            self.assertEqual(converted.payload.dtype, np.dtype(dtype))
+            np.testing.assert_array_equal(converted.payload, payload)
+
+    def test_binary_frame_session_id(self):
+        session_id = str(uuid.uuid4())
+        request = IotDeviceResultDataRequest(2010, np.zeros(4, dtype=np.float16), 0, session_id=session_id)
+        self.assertEqual(IotDeviceResultDataRequest.convert_from_bytes(request.get_bytes()).session_id, session_id)
+        request = IotDeviceResultDataRequest(2010, np.zeros(4, dtype=np.float16), 0)
+        self.assertIsNone(IotDeviceResultDataRequest.convert_from_bytes(request.get_bytes()).session_id)
+
+    def test_binary_frame_bytes_payload(self):
+        request = IotDeviceResultDataRequest(2010, b"\xff\xd8\x00", 0)
+        converted = IotDeviceResultDataRequest.convert_from_bytes(request.get_bytes())
+        self.assertEqual(converted.payload.tobytes(), b"\xff\xd8\x00")
+
+    def test_binary_frame_truncated(self):
+        frame = IotDeviceResultDataRequest(2010, np.zeros(4, dtype=np.float16), 0).get_bytes()
+        with self.assertRaises(ValueError):
+            IotDeviceResultDataRequest.convert_from_bytes(frame[:-1])
+
+    def test_json_fallback(self):
+        payload = np.arange(4, dtype=np.float16)
+        json_str = IotDeviceResultDataRequest(2010, payload, 1).get_json()
+        self.assertFalse(is_binary_frame(json_str.encode()))
+        converted = IotDeviceResultDataRequest.convert_from_json(json_str)
+        loaded = np.load(io.BytesIO(base64.b64decode(converted.payload)))
+        np.testing.assert_array_equal(loaded, payload)
+        self.assertEqual(json.loads(json_str)["sequence"], 1)
+
+
+class TestIotDeviceResultSummaryRequest(unittest.TestCase):
+    def test_entropy_coder_round_trip(self):
+        request = IotDeviceResultSummaryRequest(2000, 3, 1500, 42, "00000", entropy_coder="zlib", sparse_encoding=True)
+        converted = IotDeviceResultSummaryRequest.convert_from_json(request.get_json())
+        self.assertEqual(converted.entropy_coder, "zlib")
+        self.assertTrue(converted.sparse_encoding)
+
+    def test_entropy_coder_missing(self):
+        # entropy_coderを送らない以前のIoTデバイスのサマリーは、圧縮しないものとして扱う
+        data = json.loads(IotDeviceResultSummaryRequest(2000, 3, 1500, 42, "00000").get_json())
+        del data["entropy_coder"], data["sparse_encoding"]
+        converted = IotDeviceResultSummaryRequest.convert_from_json(json.dumps(data))
+        self.assertEqual(converted.entropy_coder, "None")
+        self.assertFalse(converted.sparse_encoding)
+
+
+class TestEdgeServerReceivedResultRequest(unittest.TestCase):
+    def test_missing_bitmap_round_trip(self):
+        missing = np.zeros(21, dtype=bool)
+        missing[[0, 7, 8, 20]] = True
+        request = EdgeServerReceivedResultRequest(3000, 3, session_id=str(uuid.uuid4()), missing=encode_sequence_bitmap(missing))
+        converted = EdgeServerReceivedResultRequest.convert_from_json(request.get_json())
+        np.testing.assert_array_equal(decode_sequence_bitmap(converted.missing, 21), [0, 7, 8, 20])
+        # missingがない場合はJSONに含めない
+        self.assertNotIn("missing", json.loads(EdgeServerReceivedResultRequest(3000, 1).get_json()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- Coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from src.lib.packetizer import TensorPacketizer
+from src.lib.sparse_codec import (
+    SPARSE_HEADER,
+    SPARSE_MODE_BITMAP,
+    SPARSE_MODE_DENSE,
+    SPARSE_MODE_INDEX,
+    decode_sparse_payload,
+    encode_sparse_payload,
+)
+
+
+class TestSparseCodec(unittest.TestCase):
+    def test_round_trip_relu_packets(self):
+        np.random.seed(0)
+        # ReLU後の中間層出力を想定した、半分程度が0のテンソル
+        tensor = np.maximum(np.random.normal(0, 1, (1, 14, 14, 16)), 0).astype(np.float32)
+        packetizer = TensorPacketizer(tensor, TensorPacketizer.SPLIT_MODE_RANDOM, packet_length=500)
+        encoded_size = 0
+        for _, payload in packetizer.packets():
+            encoded = encode_sparse_payload(payload)
+            np.testing.assert_array_equal(decode_sparse_payload(encoded, packetizer.dtype), payload)
+            encoded_size += len(encoded)
+        self.assertLess(encoded_size, tensor.nbytes * 0.6)
+
+    def test_mode_by_density(self):
+        cases = [
+            (np.arange(1, 101, dtype=np.float16), SPARSE_MODE_DENSE),
+            (np.where(np.arange(100) % 2 == 0, 1, 0).astype(np.float16), SPARSE_MODE_BITMAP),
+            (np.where(np.arange(100) == 37, 5, 0).astype(np.uint8), SPARSE_MODE_INDEX),
+        ]
+        for payload, expected_mode in cases:
+            encoded = encode_sparse_payload(payload)
+            mode, num_elements = SPARSE_HEADER.unpack_from(encoded)
+            self.assertEqual(mode, expected_mode)
+            self.assertEqual(num_elements, len(payload))
+            decoded = decode_sparse_payload(encoded, payload.dtype)
+            self.assertEqual(decoded.dtype, payload.dtype)
+            np.testing.assert_array_equal(decoded, payload)
+
+    def test_all_zero_packet(self):
+        payload = np.zeros(37, dtype=np.int8)
+        encoded = encode_sparse_payload(payload)
+        self.assertEqual(len(encoded), SPARSE_HEADER.size)
+        np.testing.assert_array_equal(decode_sparse_payload(encoded, np.int8), payload)
+
+
+if __name__ == "__main__":
+    unittest.main()